@@ -1,112 +1,318 @@
-import glob
-import os
-import subprocess, sys, time
-import concurrent.futures
-import math
-from pydantic import BaseModel, Field
-from pydantic import BaseModel, ConfigDict
-from ivcap_service import getLogger, Service, JobContext
-from ivcap_ai_tool import start_tool_server, ToolOptions, ivcap_ai_tool, logging_init
-
-logging_init()
-logger = getLogger("app")
-
-service = Service(
-    name="FoldX tool to prepare a protein PDB file for other FoldX tools",
-    contact={
-        "name": "Andrew Wardene",
-        "email": "andrew.warden@csiro.au",
-    },
-    license={
-        "name": "Academic",
-        "url": "",
-    },
-)
-
-#====================================
-# Tool global variables
-#====================================
-
-# Dictionary to convert three-letter amino acid codes to single-letter codes
-aa_dict = {
-    'ALA': 'A', 'CYS': 'C', 'ASP': 'D', 'GLU': 'E', 'PHE': 'F', 'GLY': 'G', 'HIS': 'H',
-    'ILE': 'I', 'LYS': 'K', 'LEU': 'L', 'MET': 'M', 'ASN': 'N', 'PRO': 'P', 'GLN': 'Q',
-    'ARG': 'R', 'SER': 'S', 'THR': 'T', 'VAL': 'V', 'TRP': 'W', 'TYR': 'Y'
-}
-
-#====================================
-# Request/Result schemas
-#====================================
-
-class Request(BaseModel):
-    jschema: str = Field("urn:sd:schema.foldx_repair_pdb.request.1", alias="$schema")
-    pdb_file: str = Field(description="Path to PDB file to be repaired")
-
-    model_config = ConfigDict(json_schema_extra={
-        "example": {
-            "$schema": "urn:sd:schema.foldx_repair_pdb.request.1",
-            "pdb_file": "/scratch3/war391/sciansa_apps/foldx/example.pdb"
-        }
-    })
-
-class Result(BaseModel):
-    jschema: str = Field("urn:sd:schema.foldx_repair_pdb.1", alias="$schema")
-    pdb_file: str = Field(description="Path to PDB file to be repaired")
-    repaired_pdb_file: str = Field(description="Path to repaired DB file")
-
-    model_config = ConfigDict(json_schema_extra={
-        "example": {
-            "$schema": "urn:sd:schema.foldx_repair_pdb.1",
-            "pdb_file": "/scratch3/war391/sciansa_apps/foldx/example.pdb",
-            "repaired_pdb_file": "/scratch3/war391/sciansa_apps/foldx/example_prep_Repair.pdb"
-        }
-    })
-
-#====================================
-# Tool Functions
-#====================================
-
-def repair_pdb_with_foldx(work_dir, pdb_file, base): # This 'prepares' the file for 'repair'
-    print(f'{work_dir}/{pdb_file}....{base}')
-    with open(f'{work_dir}/{pdb_file}', 'r') as f:
-        h = open(f'{work_dir}/{base}_prep.pdb', 'w')
-        lines = f.readlines()
-        for line in lines:
-            newline = line.replace('HIE', 'HIS').replace('HID', 'HIS').replace('CYX', 'CYS').replace('CYP', 'CYS')
-            newline = newline[:21] + 'A' + newline[22:]
-            if 'TER' in line:
-                h.write('TER\n')
-                break
-            h.write(newline)
-
-        h.close()
-        time.sleep(1)
-        print(f'COMMAND LINE = {work_dir}/foldx_20251231 --command=RepairPDB --output-dir={work_dir} --pdb={work_dir}/{base}_prep.pdb\n\n')
-    subprocess.run(f'{work_dir}/foldx_20251231 --command=RepairPDB --output-dir={work_dir} --pdb={base}_prep.pdb --pdb-dir={work_dir} -d true', shell=True)
-
-#====================================
-# Sciansa wrapper function
-#====================================
-
-@ivcap_ai_tool("/", opts=ToolOptions(tags=["FoldX repair PDB"]))
-def foldx_repair_pdb(req: Request, jobCtxt: JobContext) -> Result:
-    """
-    Repairs a PDB file for FoldX and other protein structure manipulations
-    """
-    pdb_file = req.pdb_file
-    jobCtxt.report.step_started("main", f"Repairing '{pdb_file}'")
-
-    base = os.path.basename(pdb_file)
-    work_dir = base.replace(f'{pdb_file}', '{base}')
-
-    repair_pdb_with_foldx(work_dir, pdb_file, base) # calling the real function
-
-    jobCtxt.report.step_finished("main", f"Repaired PDB file is {repaired_pdb_file}")
-    return Result(pdb_file=pdb_file, repaired_pdb_file=repaired_pdb_file)
-
-if __name__ == "__main__":
-    start_tool_server(service)
-
-
-
-
+"""
+Offline bulk repair of PDB collections with FoldX.
+
+Runs the same prep, pre-flight scan and supervised RepairPDB as the tool
+service over a whole directory tree (or a manifest listing one structure per
+line), spreading the files across a process pool sized to the container's CPU
+quota. Every finished file is appended to a JSON-lines journal in the output
+directory, so an interrupted run picks up where it stopped. Ctrl-C kills the
+FoldX processes in flight and leaves their files out of the journal.
+Structures whose repaired file name is already taken by an earlier one (x.pdb
+and x.cif in the same directory) are journaled as failed rather than
+overwriting it:
+
+    python FoldX_repair_pdb.py /data/pdb_mirror --output /data/repaired
+    python FoldX_repair_pdb.py manifest.txt --output /data/repaired --workers 16
+"""
+
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+from ivcap_service import getLogger
+from ivcap_ai_tool import logging_init
+
+from compression import strip_compression_suffix
+from foldx_executor import (
+    FoldxCancelledError,
+    FoldxExecutor,
+    default_concurrency,
+    read_cpu_quota,
+    read_memory_limit,
+    repair_pdb_command,
+)
+from pdb_prep import prepare_pdb_file
+from preflight import check_pdb_file
+
+logging_init()
+logger = getLogger("app")
+
+#====================================
+# Tool global variables
+#====================================
+
+FOLDX_BINARY = Path(__file__).resolve().parent / "foldx_20251231"
+JOURNAL_NAME = "repair_journal.jsonl"
+# Matched after any compression suffix has been stripped.
+STRUCTURE_SUFFIXES = (".pdb", ".ent", ".cif", ".bcif")
+# Futures kept in flight per worker, so huge collections are not all queued
+# in memory at once.
+IN_FLIGHT_PER_WORKER = 4
+
+OK = "ok"
+FAILED = "failed"
+# Interrupted runs are not journaled, so the next run repairs them again.
+CANCELLED = "cancelled"
+
+#====================================
+# Inputs and journal
+#====================================
+
+def is_structure(name: str) -> bool:
+    return strip_compression_suffix(name).endswith(STRUCTURE_SUFFIXES)
+
+
+def find_structures(source: Path) -> Iterator[Path]:
+    """
+    Structures under a directory, in path order, or the paths listed in a
+    manifest file. The tree is walked once; hidden entries are skipped.
+    """
+    if source.is_dir():
+        for directory, subdirs, files in os.walk(source):
+            subdirs[:] = sorted(name for name in subdirs if not name.startswith("."))
+            for name in sorted(files):
+                if not name.startswith(".") and is_structure(name):
+                    yield Path(directory) / name
+        return
+    with source.open() as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                path = Path(line)
+                yield path if path.is_absolute() else source.parent / path
+
+
+def output_path_for(structure: Path, root: Path, output_dir: Path) -> Path:
+    try:
+        relative = structure.relative_to(root)
+    except ValueError:
+        relative = Path(structure.name)
+    stem = Path(strip_compression_suffix(relative.name)).stem
+    return output_dir / relative.parent / f"{stem}_Repair.pdb"
+
+
+def read_journal(path: Path) -> Dict[str, Dict]:
+    """Latest journal entry per source; a torn last line is ignored."""
+    entries: Dict[str, Dict] = {}
+    if not path.exists():
+        return entries
+    with path.open() as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry["source"]] = entry
+    return entries
+
+
+def completed_sources(entries: Dict[str, Dict], retry_failed: bool) -> Set[str]:
+    done = set()
+    for source, entry in entries.items():
+        if entry["status"] == OK and Path(entry["output"]).exists():
+            done.add(source)
+        elif entry["status"] == FAILED and not retry_failed:
+            done.add(source)
+    return done
+
+#====================================
+# Tool Functions
+#====================================
+
+_executor: Optional[FoldxExecutor] = None
+_cancel = None
+
+
+def worker_executor(workers: int) -> FoldxExecutor:
+    """
+    The executor of one of ``workers`` pool processes: it runs one FoldX
+    process at a time, with an equal share of the container memory limit.
+    """
+    return FoldxExecutor.from_environment(workers=1, processes=workers)
+
+
+def _init_worker(cancel, workers: int) -> None:
+    """Pool worker setup: Ctrl-C is handled by the parent, which sets ``cancel``."""
+    global _cancel, _executor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _cancel = cancel
+    _executor = worker_executor(workers)
+
+
+def repair_pdb_with_foldx(source: str, output: str, foldx_binary: str) -> Dict:
+    """Preps and repairs one structure; runs inside a pool worker."""
+    start = time.monotonic()
+    entry = {"source": source, "output": output}
+    try:
+        with tempfile.TemporaryDirectory(prefix="foldx-bulk-") as tmp_dir:
+            work_dir = Path(tmp_dir)
+            prep_path = work_dir / "input_prep.pdb"
+            stats = prepare_pdb_file(Path(source), prep_path)
+            entry["atom_records"] = stats.atom_records
+            preflight = check_pdb_file(prep_path)
+            run = _executor.run(
+                repair_pdb_command(Path(foldx_binary), work_dir, pdb=prep_path.name),
+                cwd=work_dir,
+                timeout=_executor.timeout_for(preflight.residues),
+                cancel=_cancel,
+                stdout=work_dir / "foldx_stdout.log",
+            )
+            repaired = work_dir / "input_prep_Repair.pdb"
+            if not repaired.exists():
+                raise FileNotFoundError("FoldX did not produce a repaired file")
+            Path(output).parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(repaired), output)
+            entry.update(status=OK, foldx_seconds=round(run.run_seconds, 3))
+    except FoldxCancelledError:
+        entry["status"] = CANCELLED
+    except Exception as exc:
+        entry.update(status=FAILED, error=f"{type(exc).__name__}: {exc}")
+    entry["seconds"] = round(time.monotonic() - start, 3)
+    return entry
+
+
+def default_workers() -> int:
+    return default_concurrency(read_cpu_quota(), read_memory_limit())
+
+
+def bulk_repair(
+    source: Path,
+    output_dir: Path,
+    workers: int,
+    foldx_binary: Path = FOLDX_BINARY,
+    retry_failed: bool = False,
+    cancel=None,
+) -> Dict:
+    """
+    Repairs every structure under ``source`` not yet in the journal. Setting
+    ``cancel`` (a ``multiprocessing.Event``) stops the run early.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    journal_path = output_dir / JOURNAL_NAME
+    done = completed_sources(read_journal(journal_path), retry_failed)
+    root = source if source.is_dir() else source.parent
+
+    summary = {"repaired": 0, "failed": 0, "skipped": 0, "cancelled": 0, "atom_records": 0}
+    start = time.monotonic()
+    cancel = cancel or multiprocessing.Event()
+    with journal_path.open("a") as journal, concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(cancel, workers)
+    ) as pool:
+        pending = set()
+
+        def record(entry: Optional[Dict]) -> None:
+            if entry is None or entry["status"] == CANCELLED:
+                summary["cancelled"] += 1
+                return
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            if entry["status"] == OK:
+                summary["repaired"] += 1
+                summary["atom_records"] += entry.get("atom_records", 0)
+            else:
+                summary["failed"] += 1
+                logger.warning("Failed to repair '%s': %s", entry["source"], entry["error"])
+
+        def record_future(future) -> None:
+            record(None if future.cancelled() else future.result())
+
+        # Repaired file name -> the structure it belongs to. x.pdb and x.cif
+        # in one directory would both be written to x_Repair.pdb.
+        outputs: Dict[Path, Path] = {}
+        for structure in find_structures(source):
+            if cancel.is_set():
+                break
+            output = output_path_for(structure, root, output_dir)
+            owner = outputs.setdefault(output, structure)
+            if str(structure) in done:
+                summary["skipped"] += 1
+                continue
+            if owner != structure:
+                record({
+                    "source": str(structure),
+                    "output": str(output),
+                    "status": FAILED,
+                    "error": f"Output '{output}' is already used by '{owner}'",
+                })
+                continue
+            pending.add(
+                pool.submit(repair_pdb_with_foldx, str(structure), str(output), str(foldx_binary))
+            )
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                finished, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    record_future(future)
+        if cancel.is_set():
+            logger.warning("Interrupted, cancelling %d pending repairs", len(pending))
+            for future in pending:
+                future.cancel()
+        for future in concurrent.futures.as_completed(pending):
+            record_future(future)
+
+    elapsed = time.monotonic() - start
+    processed = summary["repaired"] + summary["failed"]
+    summary.update(
+        interrupted=cancel.is_set(),
+        workers=workers,
+        elapsed_seconds=round(elapsed, 3),
+        files_per_second=round(processed / elapsed, 3) if elapsed else None,
+        atoms_per_second=round(summary["atom_records"] / elapsed, 1) if elapsed else None,
+    )
+    return summary
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{math.floor(hours)}h{math.floor(minutes):02d}m{seconds:04.1f}s"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source", type=Path, help="Directory of structures or a manifest file")
+    parser.add_argument("--output", type=Path, required=True, help="Directory for repaired files")
+    parser.add_argument("--workers", type=int, default=None, help="Pool size (default: CPU quota)")
+    parser.add_argument("--foldx", type=Path, default=FOLDX_BINARY, help="FoldX binary")
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="Retry files the journal records as failed"
+    )
+    args = parser.parse_args(argv)
+
+    workers = args.workers or default_workers()
+    logger.info("Repairing '%s' with %d workers", args.source, workers)
+    cancel = multiprocessing.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel.set())
+    summary = bulk_repair(
+        args.source, args.output, workers, args.foldx, args.retry_failed, cancel
+    )
+    logger.info(
+        "Repaired %d, failed %d, skipped %d, cancelled %d in %s (%.2f files/s, %.0f atoms/s)",
+        summary["repaired"],
+        summary["failed"],
+        summary["skipped"],
+        summary["cancelled"],
+        format_duration(summary["elapsed_seconds"]),
+        summary["files_per_second"] or 0,
+        summary["atoms_per_second"] or 0,
+    )
+    print(json.dumps(summary, indent=2))
+    if summary["interrupted"]:
+        sys.exit(130)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
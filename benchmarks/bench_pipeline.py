@@ -0,0 +1,269 @@
+"""
+Benchmarks for the prep, download, FoldX and upload stages of the repair
+service.
+
+Synthetic PDBs from 1k to 1M atoms are generated by tiling the residues of
+example.pdb. Download and upload are timed against a local HTTP server that
+stands in for the Data Fabric, going through the service's own streaming
+download code. FoldX itself is timed with the bundled binary on example.pdb.
+
+Results are written as JSON so runs can be compared across releases:
+
+    python benchmarks/bench_pipeline.py --output bench_results.json
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from pdb_prep import prepare_pdb_file  # noqa: E402
+
+EXAMPLE_PDB = REPO_DIR / "example.pdb"
+FOLDX_BINARY = REPO_DIR / "foldx_20251231"
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# Protonation variants sprinkled into the synthetic structures so the rename
+# pass has work to do.
+VARIANTS = {"HIS": "HIE", "CYS": "CYX", "ASP": "ASH"}
+
+
+def load_service_module():
+    spec = importlib.util.spec_from_file_location("tool_service", REPO_DIR / "tool-service.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ====================================
+# Synthetic structures
+# ====================================
+
+
+def write_synthetic_pdb(path: Path, atoms: int) -> None:
+    """Tiles example.pdb into a single-TER structure of ``atoms`` atoms."""
+    template = [
+        line
+        for line in EXAMPLE_PDB.read_text().splitlines()
+        if line.startswith("ATOM")
+    ]
+    residues_per_copy = int(template[-1][22:26]) + 1
+    lines = []
+    for i in range(atoms):
+        copy, index = divmod(i, len(template))
+        line = template[index]
+        resname = line[17:20]
+        if copy % 2:
+            resname = VARIANTS.get(resname, resname)
+        resseq = (int(line[22:26]) + copy * residues_per_copy) % 10000
+        shift = 40.0 * copy
+        x = float(line[30:38]) + shift
+        lines.append(
+            f"ATOM  {i % 100000:>5} {line[12:16]} {resname} {'ABCD'[copy % 4]}"
+            f"{resseq:>4}    {x % 10000:8.3f}{line[38:54]}{line[54:]}\n"
+        )
+    lines.append("TER\n")
+    path.write_text("".join(lines))
+
+
+# ====================================
+# Local Data Fabric stand-in
+# ====================================
+
+
+class _Handler(BaseHTTPRequestHandler):
+    root: Path
+
+    def do_GET(self):
+        path = self.root / self.path.lstrip("/")
+        size = path.stat().st_size
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        with path.open("rb") as source:
+            shutil.copyfileobj(source, self.wfile, 1 << 16)
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 16)))
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalDataFabric:
+    def __init__(self, root: Path):
+        handler = type("Handler", (_Handler,), {"root": root})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.client = httpx.Client()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def artifact(self, name: str):
+        fabric = self
+
+        class _Client:
+            def get_httpx_client(self):
+                return fabric.client
+
+        class _Ivcap:
+            _client = _Client()
+
+        class _Artifact:
+            id = f"urn:bench:{name}"
+            size = None
+            _data_href = f"{fabric.url}/{name}"
+            _ivcap = _Ivcap()
+
+        artifact = _Artifact()
+        artifact.name = name
+        return artifact
+
+    def upload(self, path: Path) -> None:
+        with path.open("rb") as source:
+            response = self.client.post(
+                f"{self.url}/upload",
+                content=source,
+                headers={"Content-Length": str(path.stat().st_size)},
+            )
+        response.raise_for_status()
+
+
+# ====================================
+# Timing
+# ====================================
+
+
+def best_of(repeat: int, func: Callable[[], None]) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def record(stage: str, atoms: int, size: int, seconds: float, **extra) -> Dict:
+    result = {
+        "stage": stage,
+        "atoms": atoms,
+        "bytes": size,
+        "seconds": round(seconds, 6),
+        "atoms_per_s": round(atoms / seconds, 1) if seconds else None,
+        "mb_per_s": round(size / seconds / 1e6, 3) if seconds else None,
+    }
+    result.update(extra)
+    print(
+        f"{stage:<10} {atoms:>9} atoms {seconds * 1000:10.2f} ms "
+        f"{result['mb_per_s'] or 0:9.2f} MB/s",
+        file=sys.stderr,
+    )
+    return result
+
+
+def bench_structure(service, fabric: LocalDataFabric, work_dir: Path, atoms: int, repeat: int) -> List[Dict]:
+    source = work_dir / f"synthetic_{atoms}.pdb"
+    write_synthetic_pdb(source, atoms)
+    size = source.stat().st_size
+    prep_path = work_dir / f"synthetic_{atoms}_prep.pdb"
+
+    results = [
+        record("prep", atoms, size, best_of(repeat, lambda: prepare_pdb_file(source, prep_path)))
+    ]
+
+    artifact = fabric.artifact(source.name)
+    streamed_path = work_dir / f"streamed_{atoms}_prep.pdb"
+    results.append(
+        record(
+            "download",
+            atoms,
+            size,
+            best_of(
+                repeat,
+                lambda: service.download_and_prepare_artifact(
+                    artifact, streamed_path, service.StreamingPreparer()
+                ),
+            ),
+        )
+    )
+    results.append(record("upload", atoms, size, best_of(repeat, lambda: fabric.upload(prep_path))))
+    return results
+
+
+def bench_foldx(service, work_dir: Path) -> Dict:
+    foldx_dir = work_dir / "foldx"
+    foldx_dir.mkdir()
+    source = foldx_dir / EXAMPLE_PDB.name
+    shutil.copy(EXAMPLE_PDB, source)
+    prep_path = service.prep_path_for(source)
+    stats = prepare_pdb_file(source, prep_path)
+    size = prep_path.stat().st_size
+    start = time.perf_counter()
+    try:
+        service.run_foldx_repair(prep_path, FOLDX_BINARY)
+    except Exception as exc:
+        return {"stage": "foldx", "atoms": stats.atom_records, "bytes": size, "error": str(exc)}
+    return record("foldx", stats.atom_records, size, time.perf_counter() - start)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-foldx", action="store_true")
+    parser.add_argument("--output", type=Path, help="JSON output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    service = load_service_module()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, LocalDataFabric(Path(tmp_dir)) as fabric:
+        work_dir = Path(tmp_dir)
+        for atoms in args.sizes:
+            results.extend(bench_structure(service, fabric, work_dir, atoms, args.repeat))
+        if not args.skip_foldx:
+            results.append(bench_foldx(service, work_dir))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(encoded + "\n")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
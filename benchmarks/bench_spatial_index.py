@@ -0,0 +1,193 @@
+"""
+Benchmarks for the cell-list neighbour search in spatial_index.py.
+
+Synthetic assemblies from 1k to 1M atoms are built by placing copies of
+example.pdb on a cubic lattice, which keeps the atom density of a real
+structure. For each size the benchmark times loading the coordinates from a
+PDB file, building the cell list, listing every pair within the clash
+cutoff, a radius query around 1,000 points and a residue-neighbourhood query
+around 10% of the residues:
+
+    python benchmarks/bench_spatial_index.py --output bench_spatial.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from spatial_index import CellList, load_coordinates  # noqa: E402
+
+EXAMPLE_PDB = REPO_DIR / "example.pdb"
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# Gap between neighbouring copies on the lattice, in Å.
+COPY_SPACING = 3.0
+PAIR_CUTOFF = 3.2
+RADIUS = 8.0
+RADIUS_POINTS = 1_000
+NEIGHBORHOOD_RADIUS = 5.0
+NEIGHBORHOOD_FRACTION = 0.1
+TARGET_SECONDS = 1.0
+
+
+# ====================================
+# Synthetic structures
+# ====================================
+
+
+def synthetic_assembly(atoms: int) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Tiles example.pdb on a cubic lattice. Returns the coordinates, residue
+    index and ATOM line template (columns 1-30) of ``atoms`` atoms.
+    """
+    template = [line for line in EXAMPLE_PDB.read_text().splitlines() if line.startswith("ATOM")]
+    coords, residues = load_coordinates(EXAMPLE_PDB, records=(b"ATOM  ",))
+    coords -= coords.min(axis=0)
+    extent = coords.max(axis=0) + COPY_SPACING
+    copies = -(-atoms // len(coords))
+    side = int(np.ceil(copies ** (1 / 3)))
+    lattice = np.stack(np.meshgrid(*[np.arange(side)] * 3, indexing="ij"), axis=-1)
+    shifts = lattice.reshape(-1, 3)[:copies] * extent
+    tiled = (coords[None] + shifts[:, None]).reshape(-1, 3)[:atoms]
+    residue_index = (residues[None] + np.arange(copies)[:, None] * (residues[-1] + 1))
+    return (
+        np.ascontiguousarray(tiled, dtype=np.float32),
+        residue_index.reshape(-1)[:atoms],
+        template,
+    )
+
+
+def write_pdb(path: Path, coords: np.ndarray, template: List[str]) -> None:
+    lines = []
+    for i, (x, y, z) in enumerate(coords.tolist()):
+        line = template[i % len(template)]
+        copy = i // len(template)
+        resseq = (int(line[22:26]) + copy * 1000) % 10000
+        lines.append(
+            f"ATOM  {i % 100000:>5}{line[11:22]}{resseq:>4}    "
+            f"{x % 10000:8.3f}{y % 10000:8.3f}{z % 10000:8.3f}{line[54:]}\n"
+        )
+    lines.append("TER\n")
+    path.write_text("".join(lines))
+
+
+# ====================================
+# Timing
+# ====================================
+
+
+def best_of(repeat: int, func: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def record(stage: str, atoms: int, seconds: float, **extra) -> Dict:
+    result = {
+        "stage": stage,
+        "atoms": atoms,
+        "seconds": round(seconds, 6),
+        "atoms_per_s": round(atoms / seconds, 1) if seconds else None,
+    }
+    result.update(extra)
+    print(f"{stage:<13} {atoms:>9} atoms {seconds * 1000:10.2f} ms", file=sys.stderr)
+    return result
+
+
+def bench_size(work_dir: Path, atoms: int, repeat: int, skip_load: bool) -> List[Dict]:
+    coords, residue_index, template = synthetic_assembly(atoms)
+    results = []
+    if not skip_load:
+        path = work_dir / f"synthetic_{atoms}.pdb"
+        write_pdb(path, coords, template)
+        results.append(record("load", atoms, best_of(repeat, lambda: load_coordinates(path))))
+
+    build = best_of(repeat, lambda: CellList(coords, PAIR_CUTOFF, residue_index))
+    results.append(record("build", atoms, build, cell_size=PAIR_CUTOFF))
+    index = CellList(coords, PAIR_CUTOFF, residue_index)
+
+    pairs = index.pairs(PAIR_CUTOFF)
+    seconds = best_of(repeat, lambda: index.pairs(PAIR_CUTOFF))
+    results.append(
+        record(
+            "pairs",
+            atoms,
+            seconds,
+            cutoff=PAIR_CUTOFF,
+            pairs=len(pairs[0]),
+            build_and_query_seconds=round(build + seconds, 6),
+            within_target=build + seconds < TARGET_SECONDS,
+        )
+    )
+
+    rng = np.random.default_rng(0)
+    points = coords[rng.choice(atoms, min(RADIUS_POINTS, atoms), replace=False)]
+    seconds = best_of(repeat, lambda: index.query_radius(points, RADIUS))
+    results.append(
+        record("radius", atoms, seconds, radius=RADIUS, points=len(points),
+               build_and_query_seconds=round(build + seconds, 6))
+    )
+
+    selected = rng.random(int(residue_index[-1]) + 1) < NEIGHBORHOOD_FRACTION
+    neighborhood = index.residue_neighborhood(selected, NEIGHBORHOOD_RADIUS)
+    seconds = best_of(
+        repeat, lambda: index.residue_neighborhood(selected, NEIGHBORHOOD_RADIUS)
+    )
+    results.append(
+        record(
+            "neighborhood",
+            atoms,
+            seconds,
+            radius=NEIGHBORHOOD_RADIUS,
+            selected_residues=int(selected.sum()),
+            neighborhood_residues=int(neighborhood.sum()),
+            build_and_query_seconds=round(build + seconds, 6),
+        )
+    )
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-load", action="store_true", help="Skip writing and parsing PDB files")
+    parser.add_argument("--output", type=Path, help="JSON output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for atoms in args.sizes:
+            results.extend(bench_size(Path(tmp_dir), atoms, args.repeat, args.skip_load))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "target_seconds": TARGET_SECONDS,
+        "results": results,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(encoded + "\n")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
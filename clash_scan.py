@@ -0,0 +1,188 @@
+"""
+Steric clash pre-scan used to restrict FoldX RepairPDB to the residues that
+need it.
+
+Heavy-atom pairs from different residues whose van der Waals spheres overlap
+by at least ``CLASH_OVERLAP`` are found with a ``spatial_index.CellList``. The
+residues taking part in a clash, plus every residue within
+``NEIGHBOR_RADIUS`` of them, make up the repair region. All other residues are
+written to a FoldX ``--fix-residues-file`` so RepairPDB leaves them alone.
+"""
+
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from dictionaries import aa_dict
+from pdb_prep import CHAIN_COL, gather_field, load_pdb_buffer, parse_atom_records
+from spatial_index import RESID_START, CellList, gather_coordinates, residue_starts
+
+ATOM_NAME_START = 12
+RESSEQ_WIDTH = 4
+ICODE_COL = 26
+ELEMENT_START = 76
+
+# MolProbity's threshold for a serious clash.
+CLASH_OVERLAP = 0.4
+# N/O pairs may be hydrogen bonded; they only clash below this distance.
+HBOND_MIN_DISTANCE = 2.5
+POLAR_ELEMENTS = (b"N", b"O")
+NEIGHBOR_RADIUS = 5.0
+VDW_RADII = {b"C": 1.7, b"N": 1.55, b"O": 1.52, b"S": 1.8, b"SE": 1.9}
+DEFAULT_VDW_RADIUS = 1.7
+# Backbone atoms (and the CB bonded to CA) sit at near-bonded distances from
+# the backbone of sequence neighbours.
+BACKBONE_ATOMS = (b"N", b"CA", b"C", b"O", b"CB")
+# The proline ring closes onto the peptide nitrogen, so its CD sits at bonded
+# distances from the preceding backbone.
+PROLINE_RING_ATOM = b"CD"
+DISULFIDE_ATOM = b"SG"
+
+# Residue labels listed in the report; the counts always cover every residue.
+MAX_LISTED_RESIDUES = 20
+
+
+@dataclass
+class StructureAtoms:
+    coords: np.ndarray
+    names: np.ndarray
+    elements: np.ndarray
+    residue_index: np.ndarray
+    residue_names: np.ndarray
+    residue_chains: np.ndarray
+    residue_numbers: np.ndarray
+    residue_insertion_codes: np.ndarray
+
+    @property
+    def residues(self) -> int:
+        return len(self.residue_names)
+
+    def is_standard(self, index: int) -> bool:
+        """Whether FoldX has a one-letter code for the residue."""
+        return self.residue_names[index].decode("ascii", errors="replace") in aa_dict
+
+    def residue_label(self, index: int) -> str:
+        """
+        Residue label as written in FoldX residue files, e.g. ``EA1`` or
+        ``EA52A`` with an insertion code. Non-standard residues keep their
+        three-letter name (``ZNB9``); they never go into residue files.
+        """
+        name = self.residue_names[index].decode("ascii", errors="replace").strip()
+        chain = self.residue_chains[index].decode("ascii", errors="replace")
+        icode = self.residue_insertion_codes[index].decode("ascii", errors="replace")
+        return f"{aa_dict.get(name, name)}{chain}{self.residue_numbers[index]}{icode}"
+
+
+def load_structure_atoms(path: Path) -> StructureAtoms:
+    """Loads the heavy atoms of a PDB file into NumPy arrays."""
+    data = path.read_bytes()
+    buf = load_pdb_buffer(data)
+    atoms = parse_atom_records(buf, len(data))
+    names = np.char.strip(gather_field(buf, atoms, ATOM_NAME_START, 4))
+    elements = np.char.upper(np.char.strip(gather_field(buf, atoms, ELEMENT_START, 2)))
+    # Files without (valid) element columns: take it from the atom name.
+    missing = ~np.char.isalpha(elements)
+    elements[missing] = np.char.lstrip(names[missing], b"0123456789").astype("S1")
+    heavy = elements != b"H"
+    atoms, names, elements = atoms[heavy], names[heavy], elements[heavy]
+
+    starts = residue_starts(buf, atoms)
+    chains = gather_field(buf, atoms, CHAIN_COL, 1)
+    return StructureAtoms(
+        coords=gather_coordinates(buf, atoms),
+        names=names,
+        elements=elements,
+        residue_index=np.cumsum(starts) - 1,
+        residue_names=atoms["resname"][starts],
+        residue_chains=chains[starts],
+        residue_numbers=gather_field(buf, atoms[starts], RESID_START, RESSEQ_WIDTH)
+        .astype(np.int64),
+        residue_insertion_codes=np.char.strip(gather_field(buf, atoms[starts], ICODE_COL, 1)),
+    )
+
+
+@dataclass
+class ClashReport:
+    residues: int = 0
+    clashes: int = 0
+    clashing_residues: int = 0
+    repaired_residues: int = 0
+    skipped_residues: int = 0
+    clashing_residue_labels: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _clashing_pairs(
+    structure: StructureAtoms, index: CellList
+) -> Tuple[np.ndarray, np.ndarray]:
+    radii = np.array(
+        [VDW_RADII.get(element, DEFAULT_VDW_RADIUS) for element in structure.elements],
+        dtype=np.float32,
+    )
+    i, j = index.pairs(2 * max(VDW_RADII.values()) - CLASH_OVERLAP)
+    res_i, res_j = structure.residue_index[i], structure.residue_index[j]
+    keep = res_i != res_j
+
+    names_i, names_j = structure.names[i], structure.names[j]
+    backbone_i = np.isin(names_i, BACKBONE_ATOMS)
+    backbone_j = np.isin(names_j, BACKBONE_ATOMS)
+    adjacent = np.abs(res_i - res_j) == 1
+    keep &= ~(adjacent & backbone_i & backbone_j)
+    keep &= ~(
+        adjacent
+        & ((backbone_i & (names_j == PROLINE_RING_ATOM))
+           | (backbone_j & (names_i == PROLINE_RING_ATOM)))
+    )
+    keep &= ~((names_i == DISULFIDE_ATOM) & (names_j == DISULFIDE_ATOM))
+    i, j = i[keep], j[keep]
+
+    delta = structure.coords[i] - structure.coords[j]
+    distance = np.sqrt(np.einsum("ij,ij->i", delta, delta))
+    clash = radii[i] + radii[j] - distance >= CLASH_OVERLAP
+    polar = np.isin(structure.elements[i], POLAR_ELEMENTS) & np.isin(
+        structure.elements[j], POLAR_ELEMENTS
+    )
+    clash[polar] = distance[polar] < HBOND_MIN_DISTANCE
+    return i[clash], j[clash]
+
+
+def scan_clashes(structure: StructureAtoms) -> Tuple[ClashReport, np.ndarray]:
+    """
+    Finds clashing residues and returns the report together with a boolean
+    mask of the residues to repair (clashing residues and their neighbours).
+    """
+    report = ClashReport(residues=structure.residues)
+    index = CellList(structure.coords, NEIGHBOR_RADIUS, structure.residue_index)
+    i, j = _clashing_pairs(structure, index)
+    report.clashes = len(i)
+    clashing = np.zeros(structure.residues, dtype=bool)
+    clashing[structure.residue_index[i]] = True
+    clashing[structure.residue_index[j]] = True
+    report.clashing_residues = int(clashing.sum())
+    report.clashing_residue_labels = [
+        structure.residue_label(index)
+        for index in np.flatnonzero(clashing)[:MAX_LISTED_RESIDUES]
+    ]
+
+    repair = index.residue_neighborhood(clashing, NEIGHBOR_RADIUS)
+    report.repaired_residues = int(repair.sum())
+    report.skipped_residues = report.residues - report.repaired_residues
+    return report, repair
+
+
+def write_fixed_residues(structure: StructureAtoms, repair: np.ndarray, path: Path) -> int:
+    """
+    Writes the residues outside the repair region in FoldX's residue-file
+    format (``EA1,KA2;``) and returns how many were written.
+    """
+    labels = [
+        structure.residue_label(index)
+        for index in np.flatnonzero(~repair)
+        if structure.is_standard(index)
+    ]
+    path.write_text(",".join(labels) + ";\n")
+    return len(labels)
@@ -0,0 +1,141 @@
+"""
+Transparent gzip/bzip2/zstd handling for PDB artifacts.
+
+Compression is detected from the leading magic bytes rather than the artifact
+name, so ``.pdb.gz``/``.ent.gz`` archives and mislabelled uploads are handled
+alike. zstd support needs the optional ``zstandard`` package.
+"""
+
+import bz2
+import gzip
+import shutil
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+GZIP = "gzip"
+BZIP2 = "bzip2"
+ZSTD = "zstd"
+
+MAGIC_BYTES: Dict[str, bytes] = {
+    GZIP: b"\x1f\x8b",
+    BZIP2: b"BZh",
+    ZSTD: b"\x28\xb5\x2f\xfd",
+}
+SUFFIXES: Dict[str, str] = {GZIP: ".gz", BZIP2: ".bz2", ZSTD: ".zst"}
+CONTENT_TYPES: Dict[str, str] = {
+    GZIP: "application/gzip",
+    BZIP2: "application/x-bzip2",
+    ZSTD: "application/zstd",
+}
+
+_MAGIC_LENGTH = max(len(magic) for magic in MAGIC_BYTES.values())
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    for codec, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def strip_compression_suffix(name: str) -> str:
+    for suffix in SUFFIXES.values():
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise RuntimeError(
+            "zstd-compressed artifacts require the optional 'zstandard' package"
+        )
+
+
+class StreamDecompressor:
+    """
+    Decompresses a byte stream chunk by chunk, choosing the codec from the
+    magic bytes of the first chunk. Uncompressed input passes straight
+    through. Concatenated gzip members and bzip2 streams are followed.
+    """
+
+    def __init__(self):
+        self.codec: Optional[str] = None
+        self._decoder = None
+        self._head = b""
+        self._detected = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not self._detected:
+            self._head += chunk
+            if len(self._head) < _MAGIC_LENGTH:
+                return b""
+            chunk, self._head = self._head, b""
+            self._start(detect_compression(chunk))
+        if self._decoder is None:
+            return chunk
+        return self._decompress(chunk)
+
+    def finish(self) -> bytes:
+        if not self._detected:
+            head, self._head = self._head, b""
+            self._start(detect_compression(head))
+            return head if self._decoder is None else self._decompress(head)
+        if self.codec == GZIP:
+            return self._decoder.flush()
+        return b""
+
+    def _start(self, codec: Optional[str]) -> None:
+        self._detected = True
+        self.codec = codec
+        self._decoder = self._new_decoder()
+
+    def _new_decoder(self):
+        if self.codec == GZIP:
+            return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        if self.codec == BZIP2:
+            return bz2.BZ2Decompressor()
+        if self.codec == ZSTD:
+            _require_zstandard()
+            return zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+        return None
+
+    def _decompress(self, chunk: bytes) -> bytes:
+        if self.codec == ZSTD:
+            return self._decoder.decompress(chunk)
+        output = []
+        while chunk:
+            output.append(self._decoder.decompress(chunk))
+            if not self._decoder.eof:
+                break
+            # Start the next concatenated gzip member / bzip2 stream.
+            chunk = self._decoder.unused_data
+            self._decoder = self._new_decoder()
+        return b"".join(output)
+
+
+def decompress_bytes(data: bytes) -> bytes:
+    decompressor = StreamDecompressor()
+    return decompressor.feed(data) + decompressor.finish()
+
+
+def compress_file(source: Path, codec: str) -> Path:
+    """Writes a ``codec``-compressed copy of ``source`` next to it."""
+    target = source.with_name(source.name + SUFFIXES[codec])
+    with source.open("rb") as raw:
+        if codec == ZSTD:
+            _require_zstandard()
+            with target.open("wb") as out_file:
+                zstandard.ZstdCompressor().copy_stream(raw, out_file)
+        else:
+            opener = {GZIP: gzip.open, BZIP2: bz2.open}[codec]
+            with opener(target, "wb") as out_file:
+                shutil.copyfileobj(raw, out_file, 1 << 20)
+    return target
+
@@ -0,0 +1,250 @@
+"""
+On-disk, content-addressed cache of downloaded artifacts.
+
+Blobs are stored under the SHA-256 of their bytes, so URNs with identical
+content share one copy. A small JSON entry per URN records the blob, the
+ETag and size the Data Fabric reported, and whether the blob holds the whole
+artifact or only the prefix the prep stream read (up to the first TER
+record). Callers validate an entry against the artifact's ETag (with a
+conditional GET) or its size before using it.
+
+Blobs are kept within ``FOLDX_DOWNLOAD_CACHE_BYTES`` by evicting the least
+recently used entries; an entry's mtime is its last use. Every change to the
+cache happens under an exclusive ``flock``, and files are published with
+atomic renames. Worker processes can therefore share one cache directory,
+and a reader that has opened a blob keeps it even if the blob is evicted.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from ivcap_service import getLogger
+
+logger = getLogger("app")
+
+DEFAULT_MAX_BYTES = 2 << 30
+LOCK_NAME = ".lock"
+READ_SIZE = 1 << 20
+
+
+@dataclass
+class CacheEntry:
+    urn: str
+    sha256: str
+    bytes: int
+    complete: bool
+    etag: Optional[str] = None
+    size: Optional[int] = None
+
+    def matches(self, etag: Optional[str], size: Optional[int]) -> bool:
+        """Whether the entry is still valid for an artifact with this ETag or size."""
+        if etag and self.etag:
+            return etag == self.etag
+        return size is not None and size == self.size
+
+
+def read_chunks(blob: BinaryIO, size: int = READ_SIZE) -> Iterator[bytes]:
+    return iter(lambda: blob.read(size), b"")
+
+
+class CacheWriter:
+    """Collects downloaded bytes in a temporary file inside the cache."""
+
+    def __init__(self, tmp_dir: Path, urn: str):
+        self.urn = urn
+        fd, name = tempfile.mkstemp(dir=tmp_dir, prefix="download-")
+        self.path = Path(name)
+        self._file = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.bytes += len(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def abort(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+class DownloadCache:
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = root / "blobs"
+        self.entry_dir = root / "entries"
+        self.tmp_dir = root / "tmp"
+        for directory in (self.blob_dir, self.entry_dir, self.tmp_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self._metrics_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._bytes_saved = 0
+        self._evictions = 0
+        self._stored_bytes = 0
+
+    @classmethod
+    def from_environment(cls) -> Optional["DownloadCache"]:
+        """The cache in ``FOLDX_DOWNLOAD_CACHE``, or None when it is not set."""
+        root = os.getenv("FOLDX_DOWNLOAD_CACHE")
+        if not root:
+            return None
+        max_bytes = int(os.getenv("FOLDX_DOWNLOAD_CACHE_BYTES", DEFAULT_MAX_BYTES))
+        cache = cls(Path(root), max_bytes)
+        logger.info("Download cache in '%s' (budget %d bytes)", root, max_bytes)
+        return cache
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with (self.root / LOCK_NAME).open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entry_path(self, urn: str) -> Path:
+        return self.entry_dir / f"{hashlib.sha256(urn.encode()).hexdigest()}.json"
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / sha256[:2] / sha256
+
+    def lookup(self, urn: str) -> Optional[CacheEntry]:
+        try:
+            return CacheEntry(**json.loads(self._entry_path(urn).read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def open(self, entry: CacheEntry) -> Optional[BinaryIO]:
+        """
+        Opens the blob of ``entry`` and marks it as recently used; None if it
+        has been evicted in the meantime.
+        """
+        try:
+            blob = self._blob_path(entry.sha256).open("rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(self._entry_path(entry.urn))
+        except FileNotFoundError:
+            pass
+        return blob
+
+    def record_hit(self, entry: CacheEntry) -> None:
+        with self._metrics_lock:
+            self._hits += 1
+            self._bytes_saved += entry.bytes
+
+    def record_miss(self) -> None:
+        with self._metrics_lock:
+            self._misses += 1
+
+    def writer(self, urn: str) -> CacheWriter:
+        return CacheWriter(self.tmp_dir, urn)
+
+    def store_file(
+        self, urn: str, path: Path, etag: Optional[str], size: Optional[int]
+    ) -> Optional[CacheEntry]:
+        """Adds an artifact that was downloaded in full to ``path``."""
+        if path.stat().st_size > self.max_bytes:
+            return None
+        writer = self.writer(urn)
+        try:
+            with path.open("rb") as source:
+                for chunk in read_chunks(source):
+                    writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return self.commit(writer, etag, size, complete=True)
+
+    def commit(
+        self,
+        writer: CacheWriter,
+        etag: Optional[str],
+        size: Optional[int],
+        complete: bool,
+    ) -> Optional[CacheEntry]:
+        """Publishes the bytes collected by ``writer``; returns the new entry."""
+        writer.close()
+        if writer.bytes > self.max_bytes:
+            writer.abort()
+            return None
+        entry = CacheEntry(writer.urn, writer.sha256, writer.bytes, complete, etag, size)
+        blob_path = self._blob_path(entry.sha256)
+        with self._locked():
+            if blob_path.exists():
+                writer.abort()
+            else:
+                blob_path.parent.mkdir(exist_ok=True)
+                os.replace(writer.path, blob_path)
+            fd, name = tempfile.mkstemp(dir=self.tmp_dir, prefix="entry-")
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(asdict(entry), tmp)
+            os.replace(name, self._entry_path(entry.urn))
+            self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        """Drops least recently used entries until the blobs fit the budget."""
+        entries = []
+        for path in self.entry_dir.glob("*.json"):
+            try:
+                entry = CacheEntry(**json.loads(path.read_text()))
+                entries.append((path.stat().st_mtime, path, entry))
+            except (FileNotFoundError, ValueError, TypeError):
+                path.unlink(missing_ok=True)
+        entries.sort(key=lambda item: item[0])
+        references: Dict[str, int] = {}
+        for _, _, entry in entries:
+            references[entry.sha256] = references.get(entry.sha256, 0) + 1
+        sizes = {entry.sha256: entry.bytes for _, _, entry in entries}
+        stored = sum(sizes.values())
+
+        evicted = 0
+        for _, path, entry in entries:
+            if stored <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            evicted += 1
+            references[entry.sha256] -= 1
+            if not references[entry.sha256]:
+                self._blob_path(entry.sha256).unlink(missing_ok=True)
+                stored -= entry.bytes
+        # Blobs left behind by entries that were overwritten or removed.
+        for blob in self.blob_dir.glob("*/*"):
+            if blob.name not in references or not references[blob.name]:
+                blob.unlink(missing_ok=True)
+        with self._metrics_lock:
+            self._evictions += evicted
+            self._stored_bytes = stored
+
+    def metrics(self) -> Dict:
+        with self._metrics_lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "bytes_saved": self._bytes_saved,
+                "evictions": self._evictions,
+                "stored_bytes": self._stored_bytes,
+                "max_bytes": self.max_bytes,
+            }
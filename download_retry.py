@@ -0,0 +1,252 @@
+"""
+Retries for artifact downloads.
+
+A transfer that breaks mid-stream is resumed from the last byte received
+with a ``Range`` request (guarded by ``If-Range`` when the server sent an
+ETag) instead of failing the job. The offset counts body bytes as sent,
+so a response with a ``Content-Encoding`` (whose decoded length differs) is
+restarted from the beginning instead, skipping what was already delivered;
+so is a ``206`` whose ``Content-Range`` does not start at the offset asked
+for. Connection errors, timeouts, 429 and 5xx
+responses are retried after a capped exponential backoff with full jitter:
+a random delay of up to ``FOLDX_RETRY_BASE_DELAY * 2**attempt`` seconds,
+never more than ``FOLDX_RETRY_MAX_DELAY``. Every job gets one
+``RetryBudget`` of ``FOLDX_DOWNLOAD_RETRIES`` retries, shared by all of its
+downloads, so a dead link still fails in bounded time. The retries a job
+used are reported in its download step.
+"""
+
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Mapping, Optional
+
+import httpx
+
+from ivcap_service import getLogger
+
+logger = getLogger("app")
+
+DEFAULT_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+# Retries listed individually in the job report.
+MAX_LISTED_RETRIES = 10
+
+
+def content_range_start(response: httpx.Response) -> Optional[int]:
+    """First byte of a ``Content-Range: bytes <first>-<last>/<size>`` header."""
+    unit, _, spec = response.headers.get("Content-Range", "").partition(" ")
+    first = spec.partition("-")[0]
+    if unit != "bytes" or not first.isdigit():
+        return None
+    return int(first)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter delay before retry number ``attempt`` (counting from 0)."""
+    return random.uniform(0.0, min(cap, base * 2**attempt))
+
+
+def retryable_status(status_code: int) -> bool:
+    return status_code >= 500 or status_code == httpx.codes.TOO_MANY_REQUESTS
+
+
+def retryable(exc: BaseException) -> bool:
+    """Whether a download error is worth retrying."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return retryable_status(exc.response.status_code)
+    return False
+
+
+@dataclass
+class DownloadRetry:
+    url: str
+    offset: int
+    attempt: int
+    delay: float
+    error: str
+
+
+class RetryBudget:
+    """The retries left to one job, shared by all of its downloads."""
+
+    def __init__(
+        self,
+        retries: int = DEFAULT_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.events: List[DownloadRetry] = []
+
+    @classmethod
+    def from_environment(cls) -> "RetryBudget":
+        return cls(
+            int(os.getenv("FOLDX_DOWNLOAD_RETRIES", DEFAULT_RETRIES)),
+            float(os.getenv("FOLDX_RETRY_BASE_DELAY", DEFAULT_BASE_DELAY)),
+            float(os.getenv("FOLDX_RETRY_MAX_DELAY", DEFAULT_MAX_DELAY)),
+        )
+
+    @property
+    def used(self) -> int:
+        return len(self.events)
+
+    def retry(self, url: str, offset: int, attempt: int, exc: BaseException) -> bool:
+        """
+        Waits out the backoff before retrying after ``exc``. Returns False,
+        without waiting, when the error is not retryable or the budget is spent.
+        """
+        if not retryable(exc):
+            return False
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        with self._lock:
+            if len(self.events) >= self.retries:
+                return False
+            self.events.append(DownloadRetry(url, offset, attempt, round(delay, 3), str(exc)))
+        logger.warning("Retrying '%s' from byte %d in %.2f s (%r)", url, offset, delay, exc)
+        self._sleep(delay)
+        return True
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "retries": len(self.events),
+                "retry_budget": self.retries,
+                "retry_events": [asdict(event) for event in self.events[:MAX_LISTED_RETRIES]],
+            }
+
+
+class ResumableStream:
+    """
+    A streamed GET whose body is resumed with a ``Range`` request after a
+    transport error. ``status_code`` and ``headers`` are those of the first
+    response.
+    """
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        url: str,
+        budget: RetryBudget,
+        headers: Optional[Mapping[str, str]] = None,
+        timeout: Optional[httpx.Timeout] = None,
+    ):
+        self.client = client
+        self.url = url
+        self.budget = budget
+        self.request_headers = dict(headers or {})
+        self.timeout = timeout
+        self.response: Optional[httpx.Response] = None
+        self.status_code = 0
+        self.headers = httpx.Headers()
+        self.received = 0
+        self.resumes = 0
+        self._downloaded = 0
+
+    def __enter__(self) -> "ResumableStream":
+        self.response = self._open(self.request_headers)
+        self.status_code = self.response.status_code
+        self.headers = self.response.headers
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.response is not None:
+            self._downloaded += self.response.num_bytes_downloaded
+            self.response.close()
+            self.response = None
+
+    @property
+    def num_bytes_downloaded(self) -> int:
+        current = self.response.num_bytes_downloaded if self.response is not None else 0
+        return self._downloaded + current
+
+    def raise_for_status(self) -> None:
+        self.response.raise_for_status()
+
+    @property
+    def encoded(self) -> bool:
+        """Whether the body is sent with a content coding httpx decodes."""
+        return self.headers.get("Content-Encoding", "identity").lower() != "identity"
+
+    def _resume_headers(self, offset: int) -> Dict[str, str]:
+        # Conditional headers of the first request are dropped: a 304 cannot
+        # continue a body.
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if self.headers.get("ETag"):
+                headers["If-Range"] = self.headers["ETag"]
+        return headers
+
+    def _open(self, headers: Mapping[str, str], offset: int = 0) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                request = self.client.build_request(
+                    "GET", self.url, headers=headers, timeout=self.timeout
+                )
+                response = self.client.send(request, stream=True)
+                if retryable_status(response.status_code):
+                    try:
+                        response.raise_for_status()
+                    finally:
+                        response.close()
+                return response
+            except httpx.HTTPError as exc:
+                if not self.budget.retry(self.url, offset, attempt, exc):
+                    raise
+                attempt += 1
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        attempt = 0
+        skip = 0
+        while True:
+            try:
+                for chunk in self.response.iter_bytes():
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    if chunk:
+                        self.received += len(chunk)
+                        attempt = 0
+                        yield chunk
+                return
+            except httpx.TransportError as exc:
+                if not self.budget.retry(self.url, self.received, attempt, exc):
+                    raise
+                attempt += 1
+            self.close()
+            self.resumes += 1
+            offset = 0 if self.encoded else self.received
+            self.response = self._open(self._resume_headers(offset), offset)
+            if offset and self.response.status_code == httpx.codes.PARTIAL_CONTENT:
+                if content_range_start(self.response) == offset:
+                    continue
+                logger.warning(
+                    "'%s' answered a range from byte %d with Content-Range %r, "
+                    "restarting from the beginning",
+                    self.url,
+                    offset,
+                    self.response.headers.get("Content-Range"),
+                )
+                self.close()
+                self.response = self._open(self._resume_headers(0))
+            self.response.raise_for_status()
+            etag = self.headers.get("ETag")
+            if etag and self.response.headers.get("ETag") != etag:
+                raise httpx.RemoteProtocolError(f"'{self.url}' changed during the download")
+            # The whole body was sent again; drop what was already delivered.
+            skip = self.received
@@ -0,0 +1,288 @@
+"""
+Micro-batching of FoldX repairs.
+
+Starting FoldX and loading its parameter tables is a fixed cost that
+dominates the repair time of small peptides. With ``FOLDX_BATCH_WINDOW`` set,
+the first job to arrive opens a batch and waits up to that many seconds for
+others to join (at most ``FOLDX_BATCH_MAX``). The batch then runs as a single
+RepairPDB invocation over a ``--pdb-list``, and each job's outputs are moved
+back into its own workspace.
+
+Jobs are isolated from each other. Every job that did not get a repaired
+file from the batch, whether the batched process failed, was killed or
+exited cleanly without it, is re-run on its own, so only the structures that
+really break FoldX fail.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ivcap_service import getLogger
+
+from foldx_executor import (
+    FoldxCancelledError,
+    FoldxExecutor,
+    FoldxRun,
+    FoldxSupervisionError,
+    repair_pdb_command,
+)
+from foldx_progress import ProgressSnapshot, RepairProgress, residue_labels
+
+logger = getLogger("app")
+
+STDOUT_NAME = "foldx_stdout.log"
+PDB_LIST_NAME = "pdb_list.txt"
+DEFAULT_BATCH_MAX = 8
+
+
+def repaired_paths(prep_path: Path) -> List[Path]:
+    """The repaired PDB and fxout RepairPDB writes for ``prep_path``."""
+    return [
+        prep_path.with_name(f"{prep_path.stem}_Repair.pdb"),
+        prep_path.with_name(f"{prep_path.stem}_Repair.fxout"),
+    ]
+
+
+@dataclass
+class BatchJob:
+    prep_path: Path
+    foldx_binary: Path
+    residues: Optional[int] = None
+    on_progress: Optional[Callable[[ProgressSnapshot], None]] = None
+    fixed_residues: Optional[str] = None
+    run: Optional[FoldxRun] = None
+    error: Optional[BaseException] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class _Batch:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.jobs: List[BatchJob] = []
+        self.full = threading.Event()
+
+    def add(self, job: BatchJob) -> None:
+        self.jobs.append(job)
+        if len(self.jobs) >= self.max_size:
+            self.full.set()
+
+
+class BatchScheduler:
+    """
+    Runs FoldX repairs through ``executor``, batching the jobs that arrive
+    within ``window`` seconds of each other. A ``window`` of 0 runs every job
+    on its own. Setting ``cancel`` kills the runs in flight and fails the
+    ones still to come.
+    """
+
+    def __init__(
+        self,
+        executor: FoldxExecutor,
+        window: float = 0.0,
+        max_size: int = DEFAULT_BATCH_MAX,
+        progress_interval: float = 5.0,
+        cancel: Optional[threading.Event] = None,
+    ):
+        self.executor = executor
+        self.window = window
+        self.max_size = max(1, max_size)
+        self.progress_interval = progress_interval
+        self.cancel = cancel
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+        self._batches = 0
+        self._batched_jobs = 0
+        self._isolated_reruns = 0
+
+    @classmethod
+    def from_environment(
+        cls,
+        executor: FoldxExecutor,
+        progress_interval: float = 5.0,
+        cancel: Optional[threading.Event] = None,
+    ) -> "BatchScheduler":
+        return cls(
+            executor,
+            float(os.getenv("FOLDX_BATCH_WINDOW", 0.0)),
+            int(os.getenv("FOLDX_BATCH_MAX", DEFAULT_BATCH_MAX)),
+            progress_interval,
+            cancel,
+        )
+
+    def submit(
+        self,
+        prep_path: Path,
+        foldx_binary: Path,
+        residues: Optional[int] = None,
+        on_progress: Optional[Callable[[ProgressSnapshot], None]] = None,
+        fixed_residues: Optional[str] = None,
+    ) -> FoldxRun:
+        """
+        Repairs ``prep_path``, leaving the RepairPDB outputs next to it.
+        Blocks until the job's batch has finished. Jobs with a
+        ``fixed_residues`` file next to ``prep_path`` never join a batch,
+        since the file applies to the whole invocation.
+        """
+        job = BatchJob(prep_path, foldx_binary, residues, on_progress, fixed_residues)
+        if self.window <= 0 or self.max_size == 1 or fixed_residues:
+            return self._run_single(job)
+
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch(self.max_size)
+            batch.add(job)
+            if batch.full.is_set():
+                self._open = None
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run_batch(batch.jobs)
+        else:
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.run
+
+    def _progress(self, job: BatchJob, fxout_path: Path, stdout_path: Optional[Path]):
+        if job.on_progress is None:
+            return None
+        return RepairProgress(
+            fxout_path,
+            stdout_path,
+            residue_labels(job.prep_path),
+            job.on_progress,
+            self.progress_interval,
+        )
+
+    def _run_single(self, job: BatchJob) -> FoldxRun:
+        work_dir = job.prep_path.parent
+        stdout_path = work_dir / STDOUT_NAME
+        progress = self._progress(job, repaired_paths(job.prep_path)[1], stdout_path)
+        return self.executor.run(
+            repair_pdb_command(
+                job.foldx_binary,
+                work_dir,
+                pdb=job.prep_path.name,
+                fixed_residues=job.fixed_residues,
+            ),
+            cwd=work_dir,
+            timeout=self.executor.timeout_for(job.residues),
+            cancel=self.cancel,
+            stdout=stdout_path,
+            on_sample=progress.poll if progress else None,
+        )
+
+    def _run_batch(self, jobs: List[BatchJob]) -> None:
+        if len(jobs) == 1:
+            job = jobs[0]
+            try:
+                job.run = self._run_single(job)
+            except BaseException as exc:
+                job.error = exc
+            job.done.set()
+            return
+
+        batch_dir = Path(
+            tempfile.mkdtemp(prefix="foldx-batch-", dir=jobs[0].prep_path.parent.parent)
+        )
+        try:
+            self._run_batch_in(batch_dir, jobs)
+        except BaseException as exc:
+            for job in jobs:
+                if job.run is None and job.error is None:
+                    job.error = exc
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            for job in jobs:
+                job.done.set()
+
+    def _run_batch_in(self, batch_dir: Path, jobs: List[BatchJob]) -> None:
+        # Prefixing the index keeps identically named inputs apart.
+        names = [f"job{i}_{job.prep_path.name}" for i, job in enumerate(jobs)]
+        for name, job in zip(names, jobs):
+            (batch_dir / name).symlink_to(job.prep_path.resolve())
+        (batch_dir / PDB_LIST_NAME).write_text("".join(f"{name}\n" for name in names))
+
+        stdout_path = batch_dir / STDOUT_NAME
+        progresses = [
+            progress
+            for progress in (
+                self._progress(job, repaired_paths(batch_dir / name)[1], None)
+                for name, job in zip(names, jobs)
+            )
+            if progress is not None
+        ]
+        residues = [job.residues for job in jobs]
+        timeout = None
+        if None not in residues:
+            timeout = self.executor.timeout_for(sum(residues))
+
+        logger.info("Running a FoldX batch of %d structures", len(jobs))
+        run = None
+        batch_error: Optional[BaseException] = None
+        try:
+            run = self.executor.run(
+                repair_pdb_command(jobs[0].foldx_binary, batch_dir, pdb_list=PDB_LIST_NAME),
+                cwd=batch_dir,
+                timeout=timeout,
+                cancel=self.cancel,
+                stdout=stdout_path,
+                on_sample=lambda: [progress.poll() for progress in progresses],
+            )
+        except FoldxCancelledError:
+            raise
+        except (subprocess.CalledProcessError, FoldxSupervisionError) as exc:
+            batch_error = exc
+            run = getattr(exc, "run", None)
+            logger.warning("FoldX batch failed (%s), isolating its jobs", exc)
+
+        with self._lock:
+            self._batches += 1
+            self._batched_jobs += len(jobs)
+
+        for name, job in zip(names, jobs):
+            outputs = repaired_paths(batch_dir / name)
+            if not outputs[0].exists():
+                # A batch that exited cleanly without this job's repaired
+                # file failed it just the same.
+                if batch_error is None:
+                    logger.warning(
+                        "FoldX batch wrote no repaired file for '%s', re-running it alone",
+                        job.prep_path.name,
+                    )
+                with self._lock:
+                    self._isolated_reruns += 1
+                try:
+                    job.run = self._run_single(job)
+                except BaseException as exc:
+                    job.error = exc
+                continue
+            for source, target in zip(outputs, repaired_paths(job.prep_path)):
+                if source.exists():
+                    shutil.move(str(source), target)
+            if stdout_path.exists():
+                shutil.copy(stdout_path, job.prep_path.parent / STDOUT_NAME)
+            job.run = replace(run or FoldxRun(), batch_size=len(jobs))
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "window_seconds": self.window,
+                "max_size": self.max_size,
+                "batches": self._batches,
+                "batched_jobs": self._batched_jobs,
+                "mean_batch_size": self._batched_jobs / self._batches
+                if self._batches
+                else 0.0,
+                "isolated_reruns": self._isolated_reruns,
+            }
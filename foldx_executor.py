@@ -0,0 +1,401 @@
+"""
+Bounded executor for FoldX processes.
+
+FoldX is single-threaded and memory hungry, so the number of concurrent
+processes is sized from the container's cgroup CPU quota and memory limit
+rather than left to however many requests the tool server accepts. Jobs beyond
+that wait in a FIFO queue; queue depth, wait times and slot utilisation are
+tracked for the metrics endpoint and the job report.
+
+Every FoldX process is supervised while it runs. Its wall-clock budget scales
+with the residue count, and its RSS is sampled from /proc so it can be killed
+when it exceeds its share of the memory limit, before the kernel OOM killer
+takes the whole pod down. Peak RSS and CPU seconds come from ``wait4``.
+"""
+
+import math
+import os
+import subprocess
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ivcap_service import getLogger
+
+logger = getLogger("app")
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+# Rough resident size of one RepairPDB process on a mid-sized protein.
+DEFAULT_JOB_MEMORY = 512 * 1024 * 1024
+# cgroup v1 reports "no limit" as a huge page-aligned number.
+_UNLIMITED_MEMORY = 1 << 60
+# Share of the container memory limit the FoldX processes may use together;
+# the rest is left to the service itself.
+FOLDX_MEMORY_SHARE = 0.9
+DEFAULT_TIMEOUT_BASE = 120.0
+DEFAULT_TIMEOUT_PER_RESIDUE = 3.0
+DEFAULT_SAMPLE_INTERVAL = 0.5
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _read_text(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def read_cpu_quota(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """Returns the cgroup CPU limit in cores, or None when unlimited."""
+    cpu_max = _read_text(root / "cpu.max")
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(" ")
+        if quota == "max":
+            return None
+        return int(quota) / int(period or 100000)
+    quota = _read_text(root / "cpu" / "cpu.cfs_quota_us")
+    period = _read_text(root / "cpu" / "cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def read_memory_limit(root: Path = CGROUP_ROOT) -> Optional[int]:
+    """Returns the cgroup memory limit in bytes, or None when unlimited."""
+    limit = _read_text(root / "memory.max")
+    if limit is None:
+        limit = _read_text(root / "memory" / "memory.limit_in_bytes")
+    if limit is None or limit == "max" or int(limit) >= _UNLIMITED_MEMORY:
+        return None
+    return int(limit)
+
+
+def default_concurrency(
+    cpu_quota: Optional[float],
+    memory_limit: Optional[int],
+    job_memory: int = DEFAULT_JOB_MEMORY,
+) -> int:
+    cpu_slots = math.floor(cpu_quota) if cpu_quota else os.cpu_count() or 1
+    slots = cpu_slots
+    if memory_limit:
+        slots = min(slots, memory_limit // job_memory)
+    return max(1, slots)
+
+
+def read_rss(pid: int) -> Optional[int]:
+    """Returns the resident set size of ``pid`` in bytes."""
+    statm = _read_text(Path(f"/proc/{pid}/statm"))
+    if not statm:
+        return None
+    return int(statm.split()[1]) * _PAGE_SIZE
+
+
+def repair_pdb_command(
+    foldx_binary: Path,
+    work_dir: Path,
+    pdb: Optional[str] = None,
+    pdb_list: Optional[str] = None,
+    fixed_residues: Optional[str] = None,
+) -> List[str]:
+    """
+    RepairPDB command for one ``pdb`` or a ``pdb_list`` file in ``work_dir``,
+    optionally leaving the residues listed in ``fixed_residues`` untouched.
+    """
+    cmd = [
+        str(foldx_binary),
+        "--command=RepairPDB",
+        f"--output-dir={work_dir}",
+        f"--pdb-list={pdb_list}" if pdb_list else f"--pdb={pdb}",
+        f"--pdb-dir={work_dir}",
+    ]
+    if fixed_residues:
+        cmd.append(f"--fix-residues-file={fixed_residues}")
+    return cmd + ["-d", "true"]
+
+
+@dataclass
+class FoldxRun:
+    wait_seconds: float = 0.0
+    run_seconds: float = 0.0
+    queue_depth: int = 0
+    returncode: Optional[int] = None
+    timeout: Optional[float] = None
+    peak_rss: int = 0
+    cpu_seconds: float = 0.0
+    batch_size: int = 1
+
+    def as_dict(self) -> Dict:
+        return {
+            "batch_size": self.batch_size,
+            "queue_depth": self.queue_depth,
+            "queue_wait_seconds": round(self.wait_seconds, 3),
+            "foldx_seconds": round(self.run_seconds, 3),
+            "foldx_timeout_seconds": self.timeout,
+            "foldx_peak_rss_bytes": self.peak_rss,
+            "foldx_cpu_seconds": round(self.cpu_seconds, 3),
+        }
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class FoldxSupervisionError(RuntimeError):
+    """FoldX was killed by the supervisor; ``run`` holds its measurements."""
+
+    def __init__(self, message: str, run: FoldxRun):
+        self.run = run
+        super().__init__(message)
+
+
+class FoldxTimeoutError(FoldxSupervisionError):
+    pass
+
+
+class FoldxMemoryError(FoldxSupervisionError):
+    pass
+
+
+class FoldxCancelledError(FoldxSupervisionError):
+    pass
+
+
+class FoldxExecutor:
+    """
+    Runs FoldX commands with at most ``max_workers`` processes at a time.
+    Callers block in ``run`` until a slot is free and are served in arrival
+    order.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue: int = 0,
+        job_memory: int = DEFAULT_JOB_MEMORY,
+        rss_limit: Optional[int] = None,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+        timeout_base: float = DEFAULT_TIMEOUT_BASE,
+        timeout_per_residue: float = DEFAULT_TIMEOUT_PER_RESIDUE,
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_memory = job_memory
+        self.rss_limit = rss_limit
+        self.sample_interval = sample_interval
+        self.timeout_base = timeout_base
+        self.timeout_per_residue = timeout_per_residue
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._waiting = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._busy_seconds = 0.0
+        self._timeouts = 0
+        self._memory_kills = 0
+        self._started = time.monotonic()
+
+    @classmethod
+    def from_environment(
+        cls, workers: Optional[int] = None, processes: Optional[int] = None
+    ) -> "FoldxExecutor":
+        """
+        Sizes the executor from the cgroup limits and FOLDX_* variables.
+        ``workers`` overrides its concurrency. ``processes`` is how many FoldX
+        processes share the memory limit across every executor in the
+        container (default: this one's workers); each gets an equal RSS share.
+        """
+        cpu_quota = read_cpu_quota()
+        memory_limit = read_memory_limit()
+        job_memory = int(os.getenv("FOLDX_JOB_MEMORY", DEFAULT_JOB_MEMORY))
+        workers = workers or int(
+            os.getenv("FOLDX_MAX_CONCURRENCY", 0)
+            or default_concurrency(cpu_quota, memory_limit, job_memory)
+        )
+        processes = processes or workers
+        max_queue = int(os.getenv("FOLDX_MAX_QUEUE", 0))
+        rss_limit = int(
+            os.getenv("FOLDX_RSS_LIMIT", 0)
+            or (memory_limit and memory_limit * FOLDX_MEMORY_SHARE // processes)
+            or 0
+        )
+        logger.info(
+            "FoldX executor: %d concurrent processes (cpu quota=%s, memory limit=%s, "
+            "rss limit per process=%s)",
+            workers,
+            cpu_quota,
+            memory_limit,
+            rss_limit or None,
+        )
+        return cls(
+            workers,
+            max_queue,
+            job_memory,
+            rss_limit or None,
+            float(os.getenv("FOLDX_SAMPLE_INTERVAL", DEFAULT_SAMPLE_INTERVAL)),
+            float(os.getenv("FOLDX_TIMEOUT_BASE", DEFAULT_TIMEOUT_BASE)),
+            float(os.getenv("FOLDX_TIMEOUT_PER_RESIDUE", DEFAULT_TIMEOUT_PER_RESIDUE)),
+        )
+
+    def timeout_for(self, residues: Optional[int]) -> Optional[float]:
+        """Wall-clock budget for repairing ``residues`` residues."""
+        if residues is None:
+            return None
+        return self.timeout_base + self.timeout_per_residue * residues
+
+    def _acquire(self) -> FoldxRun:
+        run = FoldxRun()
+        with self._cond:
+            if self.max_queue and self._waiting >= self.max_queue:
+                raise QueueFullError(
+                    f"FoldX queue is full ({self._waiting} jobs waiting)"
+                )
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            run.queue_depth = self._waiting
+            self._waiting += 1
+            queued = time.monotonic()
+            while ticket != self._serving or self._running >= self.max_workers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._serving += 1
+            self._running += 1
+            run.wait_seconds = time.monotonic() - queued
+            self._total_wait += run.wait_seconds
+            self._max_wait = max(self._max_wait, run.wait_seconds)
+            # The next ticket may also fit into a free slot.
+            self._cond.notify_all()
+        return run
+
+    def _release(self, run: FoldxRun) -> None:
+        with self._cond:
+            self._running -= 1
+            self._busy_seconds += run.run_seconds
+            if run.returncode == 0:
+                self._completed += 1
+            else:
+                self._failed += 1
+            self._cond.notify_all()
+
+    def _supervise(
+        self,
+        process: subprocess.Popen,
+        run: FoldxRun,
+        cancel: Optional[threading.Event],
+        on_sample: Optional[Callable[[], None]],
+    ) -> Optional[type]:
+        """
+        Waits for ``process``, sampling its RSS and calling ``on_sample``
+        every ``sample_interval``. Kills it when it overruns ``run.timeout``,
+        exceeds ``rss_limit`` or ``cancel`` is set, returning the matching
+        error class.
+        """
+        start = time.monotonic()
+        error = None
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if on_sample is not None:
+                on_sample()
+            rss = read_rss(process.pid)
+            if rss:
+                run.peak_rss = max(run.peak_rss, rss)
+            if self.rss_limit and rss and rss > self.rss_limit:
+                error = FoldxMemoryError
+            elif run.timeout and time.monotonic() - start > run.timeout:
+                error = FoldxTimeoutError
+            elif cancel is not None and cancel.is_set():
+                error = FoldxCancelledError
+            if error:
+                process.kill()
+                _, status, usage = os.wait4(process.pid, 0)
+                break
+            if cancel is not None:
+                cancel.wait(self.sample_interval)
+            else:
+                time.sleep(self.sample_interval)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        run.returncode = process.returncode
+        run.cpu_seconds = usage.ru_utime + usage.ru_stime
+        # ru_maxrss is reported in KiB on Linux.
+        run.peak_rss = max(run.peak_rss, usage.ru_maxrss * 1024)
+        return error
+
+    def run(
+        self,
+        cmd: List[str],
+        cwd: Path,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+        stdout: Optional[Path] = None,
+        on_sample: Optional[Callable[[], None]] = None,
+    ) -> FoldxRun:
+        """
+        Runs ``cmd`` once a slot is free, raising on a non-zero exit or when
+        the supervisor kills the process. Output goes to ``stdout`` if given.
+        Setting ``cancel`` kills the process; a run cancelled before it
+        started raises without launching FoldX.
+        """
+        if cancel is not None and cancel.is_set():
+            raise FoldxCancelledError("FoldX run was cancelled", FoldxRun())
+        run = self._acquire()
+        run.timeout = timeout
+        start = time.monotonic()
+        error = None
+        try:
+            with stdout.open("wb") if stdout else nullcontext() as output:
+                process = subprocess.Popen(cmd, cwd=cwd, stdout=output)
+                try:
+                    error = self._supervise(process, run, cancel, on_sample)
+                except BaseException:
+                    process.kill()
+                    process.wait()
+                    raise
+        finally:
+            run.run_seconds = time.monotonic() - start
+            self._release(run)
+        if error is FoldxTimeoutError:
+            with self._cond:
+                self._timeouts += 1
+            raise FoldxTimeoutError(
+                f"FoldX exceeded its {timeout:g}s budget and was killed", run
+            )
+        if error is FoldxMemoryError:
+            with self._cond:
+                self._memory_kills += 1
+            raise FoldxMemoryError(
+                f"FoldX RSS of {run.peak_rss} bytes exceeded the limit of "
+                f"{self.rss_limit} bytes and it was killed",
+                run,
+            )
+        if error is FoldxCancelledError:
+            raise FoldxCancelledError("FoldX run was cancelled", run)
+        if run.returncode:
+            raise subprocess.CalledProcessError(run.returncode, cmd)
+        return run
+
+    def metrics(self) -> Dict[str, float]:
+        with self._cond:
+            uptime = time.monotonic() - self._started
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queue_depth": self._waiting,
+                "completed": self._completed,
+                "failed": self._failed,
+                "timeouts": self._timeouts,
+                "memory_kills": self._memory_kills,
+                "mean_wait_seconds": self._total_wait / finished if finished else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "utilization": self._busy_seconds / (self.max_workers * uptime)
+                if uptime
+                else 0.0,
+            }
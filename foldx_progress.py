@@ -0,0 +1,215 @@
+"""
+Live progress of a FoldX RepairPDB run.
+
+RepairPDB writes one fxout row per residue as it optimises them (``GLUA1``,
+``LYSA2``, ...) after a "Now Optimizing Residues" marker, and then revisits
+residues with bad energies. Histidines appear under their protonation state
+(``H1SA98``, ``H2SA9``) and are matched to the ``HIS`` of the prepared
+structure. ``RepairProgress`` tails the fxout and FoldX's
+stdout while the process runs, maps each row to the residue order of the
+prepared structure, and hands throttled snapshots with a percentage and ETA to
+a callback.
+"""
+
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from ivcap_service import getLogger
+
+from pdb_prep import CHAIN_COL, gather_field, load_pdb_buffer, parse_atom_records
+
+logger = getLogger("app")
+
+OPTIMIZING = "optimizing"
+MOVING = "moving bad residues"
+PHASE_MARKERS = {
+    "Now Optimizing Residues": OPTIMIZING,
+    "Now moving residues with bad energies": MOVING,
+}
+_PHASE_ORDER = (None, OPTIMIZING, MOVING)
+
+STARTING_STRUCTURE = "Starting Structure"
+# Residue names FoldX writes in place of the ones in the prepared structure.
+FOLDX_RESIDUE_NAMES = {"H1S": "HIS", "H2S": "HIS"}
+RESSEQ_START = 22
+RESSEQ_WIDTH = 5
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+
+def residue_labels(prep_path: Path) -> List[str]:
+    """Returns fxout-style labels (``GLUA1``) for the residues in file order."""
+    data = prep_path.read_bytes()
+    buf = load_pdb_buffer(data)
+    atoms = parse_atom_records(buf, len(data))
+    if not len(atoms):
+        return []
+    chains = gather_field(buf, atoms, CHAIN_COL, 1)
+    resseqs = np.char.strip(gather_field(buf, atoms, RESSEQ_START, RESSEQ_WIDTH))
+    keys = np.char.add(np.char.add(atoms["resname"], chains), resseqs)
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    return [key.decode("ascii", errors="replace") for key in keys[starts]]
+
+
+def normalise_label(label: str) -> str:
+    """Maps an fxout residue label (``H2SA9``) to the prepared one (``HISA9``)."""
+    name = FOLDX_RESIDUE_NAMES.get(label[:3])
+    return label if name is None else name + label[3:]
+
+
+def read_repair_energies(fxout_path: Path) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Total energy (kcal/mol) of the starting structure and of the repaired
+    one, from the first and last energy rows of a RepairPDB fxout.
+    """
+    start = final = None
+    if not fxout_path.exists():
+        return start, final
+    with fxout_path.open(errors="replace") as fxout:
+        for line in fxout:
+            label, _, rest = line.partition("\t")
+            try:
+                energy = float(rest.split("\t", 1)[0])
+            except ValueError:
+                continue
+            if label == STARTING_STRUCTURE:
+                start = energy
+            final = energy
+    return start, final
+
+
+class _Tail:
+    """Reads the complete lines appended to a file since the last call."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.phase: Optional[str] = None
+        self._offset = 0
+        self._partial = b""
+
+    def read_lines(self) -> List[str]:
+        try:
+            with self.path.open("rb") as handle:
+                handle.seek(self._offset)
+                data = handle.read()
+        except FileNotFoundError:
+            return []
+        self._offset += len(data)
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        return [line.decode("utf-8", errors="replace").rstrip("\r") for line in lines]
+
+
+@dataclass
+class ProgressSnapshot:
+    phase: Optional[str]
+    residues_done: int
+    residues_total: int
+    residues_revisited: int
+    elapsed_seconds: float
+    eta_seconds: Optional[float]
+
+    @property
+    def percent(self) -> float:
+        if not self.residues_total:
+            return 0.0
+        return 100.0 * self.residues_done / self.residues_total
+
+    def as_dict(self) -> Dict:
+        if self.phase == MOVING:
+            message = (
+                f"Re-optimising residues with bad energies "
+                f"({self.residues_revisited} so far)"
+            )
+        else:
+            message = (
+                f"Optimising residues: {self.percent:.0f}% "
+                f"({self.residues_done}/{self.residues_total})"
+            )
+            if self.eta_seconds is not None:
+                message += f", ETA {self.eta_seconds:.0f}s"
+        return {
+            "message": message,
+            "phase": self.phase,
+            "percent": round(self.percent, 1),
+            "residues_done": self.residues_done,
+            "residues_total": self.residues_total,
+            "residues_revisited": self.residues_revisited,
+            "elapsed_seconds": round(self.elapsed_seconds, 1),
+            "eta_seconds": None if self.eta_seconds is None else round(self.eta_seconds, 1),
+        }
+
+
+class RepairProgress:
+    """
+    Call ``poll`` periodically while FoldX runs. ``on_progress`` is called at
+    most once per ``min_interval`` seconds, and only when something changed.
+    """
+
+    def __init__(
+        self,
+        fxout_path: Path,
+        stdout_path: Optional[Path],
+        labels: List[str],
+        on_progress: Callable[[ProgressSnapshot], None],
+        min_interval: float = DEFAULT_PROGRESS_INTERVAL,
+    ):
+        self._tails = [_Tail(fxout_path)]
+        if stdout_path is not None:
+            self._tails.append(_Tail(stdout_path))
+        self._index = {label: i for i, label in enumerate(labels)}
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.phase: Optional[str] = None
+        self.residues_done = 0
+        self.residues_revisited = 0
+        self._started = time.monotonic()
+        self._last_emit = float("-inf")
+        self._emitted = (None, 0, 0)
+
+    def _consume(self, tail: _Tail, line: str) -> None:
+        # stdout may announce a phase before the fxout rows of the previous
+        # one have been read, so rows are attributed by their own file's phase.
+        marker = PHASE_MARKERS.get(line.strip())
+        if marker:
+            tail.phase = marker
+            if _PHASE_ORDER.index(marker) > _PHASE_ORDER.index(self.phase):
+                self.phase = marker
+            return
+        label, _, rest = line.partition("\t")
+        index = self._index.get(normalise_label(label))
+        if index is None or not rest:
+            return
+        if tail.phase == MOVING:
+            self.residues_revisited += 1
+        else:
+            self.residues_done = max(self.residues_done, index + 1)
+            if self.phase is None:
+                self.phase = OPTIMIZING
+
+    def snapshot(self) -> ProgressSnapshot:
+        elapsed = time.monotonic() - self._started
+        total = len(self._index)
+        eta = None
+        if self.phase == OPTIMIZING and self.residues_done:
+            eta = elapsed * (total - self.residues_done) / self.residues_done
+        return ProgressSnapshot(
+            self.phase, self.residues_done, total, self.residues_revisited, elapsed, eta
+        )
+
+    def poll(self) -> None:
+        for tail in self._tails:
+            for line in tail.read_lines():
+                self._consume(tail, line)
+        now = time.monotonic()
+        state = (self.phase, self.residues_done, self.residues_revisited)
+        if state == self._emitted or now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+        self._emitted = state
+        try:
+            self.on_progress(self.snapshot())
+        except Exception as exc:
+            logger.warning("Failed to report FoldX progress: %s", exc)
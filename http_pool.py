@@ -0,0 +1,240 @@
+"""
+Process-wide HTTP connection pool for artifact transfers.
+
+Every download in the service goes through one long-lived ``httpx``
+transport, so connections (and TLS sessions) to the Data Fabric are reused
+across jobs instead of depending on each job's IVCAP client. Jobs keep their
+own credentials: ``client_for`` builds a client from the configuration of the
+job's IVCAP client (base URL, headers, cookies, timeout and extra httpx
+arguments) on a pooled transport with the same TLS verification and client
+certificate. Clients configured with their own transport are used unpooled.
+
+The pool is sized with ``FOLDX_HTTP_MAX_CONNECTIONS`` (default 32) and keeps
+up to ``FOLDX_HTTP_MAX_KEEPALIVE`` (default 16) idle connections for
+``FOLDX_HTTP_KEEPALIVE_EXPIRY`` seconds (default 60). ``FOLDX_HTTP_CONNECT_TIMEOUT``,
+``FOLDX_HTTP_READ_TIMEOUT`` and ``FOLDX_HTTP_POOL_TIMEOUT`` bound connecting,
+waiting for data and waiting for a free connection. ``FOLDX_HTTP2=1``
+negotiates HTTP/2 when the optional ``h2`` package is installed, multiplexing
+range requests over fewer connections.
+
+``metrics()`` reports connection setups (TCP connects and TLS handshakes),
+requests that found every connection busy, pool timeouts and the transfers
+currently in flight, which is what sizing it needs. In-flight transfers are
+counted here, from the start of a request until its response is closed, so
+the numbers do not depend on httpcore internals.
+"""
+
+import atexit
+import os
+import threading
+import weakref
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+from ivcap_service import getLogger
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # pragma: no cover - optional dependency
+    h2 = None
+
+logger = getLogger("app")
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_MAX_KEEPALIVE = 16
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_POOL_TIMEOUT = 30.0
+
+# httpx client arguments that replace the transport the pool would provide.
+OWN_TRANSPORT_ARGS = frozenset({"transport", "mounts"})
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body that tells the pool when its transfer is over."""
+
+    def __init__(self, stream: httpx.SyncByteStream, finished):
+        self._stream = stream
+        self._finished = finished
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._stream)
+
+    def close(self) -> None:
+        finished, self._finished = self._finished, None
+        if finished is None:
+            return
+        try:
+            self._stream.close()
+        finally:
+            finished()
+
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+    """Counts connection setups and pool contention of an ``HTTPTransport``."""
+
+    def __init__(self, pool: "TransferPool", **kwargs):
+        super().__init__(**kwargs)
+        self._transfers = pool
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self._transfers._trace
+        self._transfers._request_started()
+        try:
+            response = super().handle_request(request)
+        except httpx.PoolTimeout:
+            self._transfers._request_finished()
+            self._transfers._pool_timeout()
+            raise
+        except BaseException:
+            self._transfers._request_finished()
+            raise
+        response.stream = _TrackedStream(response.stream, self._transfers._request_finished)
+        return response
+
+
+class TransferPool:
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        timeout: httpx.Timeout = httpx.Timeout(
+            DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT, pool=DEFAULT_POOL_TIMEOUT
+        ),
+        http2: bool = False,
+    ):
+        if http2 and h2 is None:
+            logger.warning("HTTP/2 needs the 'h2' package, using HTTP/1.1")
+            http2 = False
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2
+        self.transport = _InstrumentedTransport(self, limits=self.limits, http2=http2)
+        self._lock = threading.Lock()
+        # Transports for jobs whose TLS settings differ from the defaults,
+        # keyed on (verify, cert).
+        self._transports: Dict[Tuple[Any, Any], httpx.HTTPTransport] = {
+            (True, None): self.transport
+        }
+        self._clients: "weakref.WeakKeyDictionary[httpx.Client, httpx.Client]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._requests = 0
+        self._active = 0
+        self._saturated_requests = 0
+        self._peak_active = 0
+        self._pool_timeouts = 0
+        self._tcp_connects = 0
+        self._tls_handshakes = 0
+        self._connect_failures = 0
+        atexit.register(self.close)
+
+    @classmethod
+    def from_environment(cls) -> "TransferPool":
+        return cls(
+            int(os.getenv("FOLDX_HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+            int(os.getenv("FOLDX_HTTP_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE)),
+            float(os.getenv("FOLDX_HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)),
+            httpx.Timeout(
+                float(os.getenv("FOLDX_HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+                connect=float(os.getenv("FOLDX_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+                pool=float(os.getenv("FOLDX_HTTP_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)),
+            ),
+            os.getenv("FOLDX_HTTP2", "").lower() in ("1", "true", "yes"),
+        )
+
+    def client_for(self, source) -> httpx.Client:
+        """
+        A client configured like ``source`` (a job's IVCAP API client) that
+        sends its requests through the shared pool. A job without its own
+        timeout gets the pool's.
+        """
+        httpx_client = source.get_httpx_client()
+        config = dict(getattr(source, "_httpx_args", None) or {})
+        if OWN_TRANSPORT_ARGS & config.keys():
+            return httpx_client
+        with self._lock:
+            client = self._clients.get(httpx_client)
+            if client is None:
+                verify = config.pop("verify", getattr(source, "_verify_ssl", True))
+                cert = config.pop("cert", None)
+                timeout = getattr(source, "_timeout", None)
+                client = httpx.Client(
+                    transport=self._transport_for(verify, cert),
+                    base_url=httpx_client.base_url,
+                    headers=httpx_client.headers,
+                    cookies=httpx_client.cookies,
+                    follow_redirects=httpx_client.follow_redirects,
+                    timeout=self.timeout if timeout is None else timeout,
+                    **config,
+                )
+                self._clients[httpx_client] = client
+        return client
+
+    def close(self) -> None:
+        for transport in list(self._transports.values()):
+            transport.close()
+
+    def _transport_for(self, verify: Any, cert: Optional[Any]) -> httpx.HTTPTransport:
+        key = (verify, cert)
+        transport = self._transports.get(key)
+        if transport is None:
+            transport = _InstrumentedTransport(
+                self, verify=verify, cert=cert, limits=self.limits, http2=self.http2
+            )
+            self._transports[key] = transport
+        return transport
+
+    def _request_started(self) -> None:
+        with self._lock:
+            self._requests += 1
+            if self._active >= self.limits.max_connections:
+                self._saturated_requests += 1
+            self._active += 1
+            self._peak_active = max(self._peak_active, self._active)
+
+    def _request_finished(self) -> None:
+        with self._lock:
+            self._active -= 1
+
+    def _pool_timeout(self) -> None:
+        with self._lock:
+            self._pool_timeouts += 1
+
+    def _trace(self, event: str, info: Dict) -> None:
+        if not event.startswith("connection."):
+            return
+        with self._lock:
+            if event == "connection.connect_tcp.complete":
+                self._tcp_connects += 1
+            elif event == "connection.start_tls.complete":
+                self._tls_handshakes += 1
+            elif event.endswith(".failed"):
+                self._connect_failures += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "http2": self.http2,
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "active": self._active,
+                "saturation": self._active / self.limits.max_connections,
+                "peak_active": self._peak_active,
+                "requests": self._requests,
+                "saturated_requests": self._saturated_requests,
+                "pool_timeouts": self._pool_timeouts,
+                "connections_opened": self._tcp_connects,
+                "tls_handshakes": self._tls_handshakes,
+                "connect_failures": self._connect_failures,
+                "requests_per_connection": self._requests / self._tcp_connects
+                if self._tcp_connects
+                else None,
+            }
@@ -0,0 +1,469 @@
+"""
+Streaming mmCIF and BinaryCIF ingestion for the FoldX prep stage.
+
+Only the ``_atom_site`` loop is read. Rows are converted to fixed-column PDB
+ATOM/HETATM records as they arrive and a TER record is emitted at the end of
+each chain, so the PDB prep transform downstream sees the same shape of input
+as for a native PDB file and can stop the download at the first chain.
+
+BinaryCIF is a columnar MessagePack document, so it is decoded once the whole
+file has arrived, and only the ``_atom_site`` columns are expanded into
+arrays. It needs the optional ``msgpack`` package.
+"""
+
+import re
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+PDB = "pdb"
+MMCIF = "mmcif"
+BINARY_CIF = "bcif"
+BINARY_CIF_SUFFIX = ".bcif"
+
+# Serials above MAX_DECIMAL_SERIAL are written in hybrid-36, the convention
+# PDB readers share for large structures: A0000-ZZZZZ, then a0000-zzzzz.
+MAX_DECIMAL_SERIAL = 99999
+_HY36_BLOCK = 26 * 36**4
+MAX_SERIAL = MAX_DECIMAL_SERIAL + 2 * _HY36_BLOCK
+_HY36_UPPER = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_HY36_LOWER = "0123456789abcdefghijklmnopqrstuvwxyz"
+MAX_RESSEQ = 10000
+
+_MISSING = (".", "?", "")
+_ATOM_FORMAT = "%-6s%5s %-4s%1s%3s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n"
+_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+
+def detect_structure_format(head: bytes) -> str:
+    """Guesses the structure format from the first bytes of a document."""
+    if head[:1] and (0x80 <= head[0] <= 0x8F or head[0] in (0xDE, 0xDF)):
+        return BINARY_CIF
+    for line in head.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith(b"#"):
+            continue
+        return MMCIF if stripped.startswith(b"data_") else PDB
+    return PDB
+
+
+def _tokenize(line: str) -> List[str]:
+    if "'" not in line and '"' not in line:
+        return line.split()
+    return [
+        next(group for group in match.groups() if group is not None)
+        for match in _TOKEN.finditer(line)
+    ]
+
+
+def hybrid36_serial(serial: int) -> str:
+    """Formats an atom serial for the five PDB columns, in hybrid-36 past 99,999."""
+    if serial <= MAX_DECIMAL_SERIAL:
+        return "%5d" % serial
+    if serial > MAX_SERIAL:
+        raise ValueError(f"Atom serial {serial} does not fit PDB columns, even in hybrid-36")
+    value = serial - MAX_DECIMAL_SERIAL - 1
+    digits = _HY36_UPPER
+    if value >= _HY36_BLOCK:
+        value -= _HY36_BLOCK
+        digits = _HY36_LOWER
+    # The leading digit starts at "A"/"a": skip the ten decimal digits.
+    value += 10 * 36**4
+    encoded = ""
+    for _ in range(5):
+        value, digit = divmod(value, 36)
+        encoded = digits[digit] + encoded
+    return encoded
+
+
+def format_atom_name(name: str, element: str) -> str:
+    """Aligns an atom name in PDB columns 13-16."""
+    if len(name) < 4 and len(element) <= 1:
+        return f" {name:<3}"
+    return f"{name:<4}"[:4]
+
+
+# ====================================
+# Row -> PDB record conversion
+# ====================================
+
+
+class AtomSiteWriter:
+    """
+    Formats ``_atom_site`` rows as PDB records. Atom serials are renumbered
+    sequentially and continue in hybrid-36 after 99,999, so large assemblies
+    fit the five-column serial field without repeating a serial. Only the first model is kept and a TER record
+    closes every chain.
+    """
+
+    def __init__(self):
+        self.serial = 0
+        self.atoms = 0
+        self.done = False
+        self._chain: Optional[str] = None
+        self._model: Optional[str] = None
+
+    def write(
+        self,
+        group: str,
+        name: str,
+        alt_loc: str,
+        resname: str,
+        chain: str,
+        resseq: str,
+        icode: str,
+        x: float,
+        y: float,
+        z: float,
+        occupancy: float,
+        b_factor: float,
+        element: str,
+        model: str,
+    ) -> str:
+        if self.done:
+            return ""
+        prefix = ""
+        if self._model is None:
+            self._model = model
+        elif model != self._model:
+            self.done = True
+            return "TER\n" if self._chain is not None else ""
+        if self._chain is not None and chain != self._chain:
+            prefix = "TER\n"
+        self._chain = chain
+
+        seq = int(resseq)
+        if not -999 <= seq < MAX_RESSEQ:
+            raise ValueError(
+                f"Residue number {seq} in chain '{chain}' does not fit PDB columns"
+            )
+        self.serial += 1
+        self.atoms += 1
+        serial = self.serial
+        if serial > MAX_DECIMAL_SERIAL:
+            serial = hybrid36_serial(serial)
+        record = "HETATM" if group == "HETATM" else "ATOM"
+        return prefix + _ATOM_FORMAT % (
+            record,
+            serial,
+            format_atom_name(name, element),
+            alt_loc[:1],
+            resname[:3],
+            chain[:1],
+            seq,
+            icode[:1],
+            x,
+            y,
+            z,
+            occupancy,
+            b_factor,
+            element[:2],
+        )
+
+    def close(self) -> str:
+        if self.done or self._chain is None:
+            return ""
+        self.done = True
+        return "TER\n"
+
+
+class _Columns:
+    """Resolves the ``_atom_site`` items, preferring author over label ids."""
+
+    def __init__(self, names: Sequence[str]):
+        index = {name: i for i, name in enumerate(names)}
+
+        def pick(*candidates: str) -> Optional[int]:
+            for candidate in candidates:
+                if candidate in index:
+                    return index[candidate]
+            return None
+
+        self.count = len(names)
+        self.group = pick("group_PDB")
+        self.name = pick("auth_atom_id", "label_atom_id")
+        self.alt_loc = pick("label_alt_id")
+        self.resname = pick("auth_comp_id", "label_comp_id")
+        self.chain = pick("auth_asym_id", "label_asym_id")
+        self.resseq = pick("auth_seq_id", "label_seq_id")
+        self.icode = pick("pdbx_PDB_ins_code")
+        self.x = pick("Cartn_x")
+        self.y = pick("Cartn_y")
+        self.z = pick("Cartn_z")
+        self.occupancy = pick("occupancy")
+        self.b_factor = pick("B_iso_or_equiv")
+        self.element = pick("type_symbol")
+        self.model = pick("pdbx_PDB_model_num")
+        required = (self.name, self.resname, self.chain, self.resseq, self.x, self.y, self.z)
+        if any(column is None for column in required):
+            raise ValueError("mmCIF _atom_site loop lacks required coordinate columns")
+
+    def write_row(self, writer: AtomSiteWriter, row: Sequence[str]) -> str:
+        value = _value
+        return writer.write(
+            value(row, self.group, "ATOM"),
+            value(row, self.name),
+            value(row, self.alt_loc),
+            value(row, self.resname),
+            value(row, self.chain, "A"),
+            value(row, self.resseq, "0"),
+            value(row, self.icode),
+            float(row[self.x]),
+            float(row[self.y]),
+            float(row[self.z]),
+            float(value(row, self.occupancy, "1.0")),
+            float(value(row, self.b_factor, "0.0")),
+            value(row, self.element),
+            value(row, self.model, "1"),
+        )
+
+
+def _value(row: Sequence[str], column: Optional[int], default: str = "") -> str:
+    if column is None or row[column] in _MISSING:
+        return default
+    return row[column]
+
+
+# ====================================
+# Text mmCIF
+# ====================================
+
+
+class MmcifStreamConverter:
+    """
+    Converts mmCIF text arriving in arbitrary chunks into PDB records. Only
+    the ``_atom_site`` loop of the first data block is held in memory, one
+    row at a time.
+    """
+
+    def __init__(self):
+        self.writer = AtomSiteWriter()
+        self._pending = b""
+        self._in_loop = False
+        self._names: List[str] = []
+        self._columns: Optional[_Columns] = None
+        self._tokens: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        return self.writer.done
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.done:
+            return b""
+        data = self._pending + chunk
+        cut = data.rfind(b"\n") + 1
+        self._pending = data[cut:]
+        return self._convert(data[:cut].decode("utf-8", errors="replace").splitlines())
+
+    def finish(self) -> bytes:
+        data, self._pending = self._pending, b""
+        output = self._convert(data.decode("utf-8", errors="replace").splitlines())
+        if self.writer.atoms == 0:
+            raise ValueError("mmCIF document contains no _atom_site records")
+        return output + self.writer.close().encode("ascii")
+
+    def _convert(self, lines: List[str]) -> bytes:
+        output: List[str] = []
+        for line in lines:
+            if self.done:
+                break
+            stripped = line.strip()
+            if self._columns is not None:
+                if stripped.startswith(("#", "_", "loop_", "data_")):
+                    output.append(self.writer.close())
+                    break
+                self._tokens.extend(_tokenize(stripped))
+                output.extend(self._drain_rows())
+            elif stripped == "loop_":
+                self._in_loop = True
+                self._names = []
+            elif self._in_loop and stripped.startswith("_atom_site."):
+                self._names.append(stripped.split(None, 1)[0][len("_atom_site."):])
+            elif self._in_loop and self._names and not stripped.startswith("_"):
+                self._columns = _Columns(self._names)
+                self._tokens.extend(_tokenize(stripped))
+                output.extend(self._drain_rows())
+            elif self._in_loop and stripped.startswith("_"):
+                self._in_loop = False
+        return "".join(output).encode("ascii")
+
+    def _drain_rows(self) -> Iterator[str]:
+        width = self._columns.count
+        rows = len(self._tokens) // width
+        for start in range(0, rows * width, width):
+            yield self._columns.write_row(self.writer, self._tokens[start : start + width])
+        del self._tokens[: rows * width]
+
+
+# ====================================
+# BinaryCIF
+# ====================================
+
+_BYTE_ARRAY_TYPES = {
+    1: "<i1",
+    2: "<i2",
+    3: "<i4",
+    4: "<u1",
+    5: "<u2",
+    6: "<u4",
+    32: "<f4",
+    33: "<f8",
+}
+_INT_TYPES = {1: np.int8, 2: np.int16, 3: np.int32, 4: np.uint8, 5: np.uint16, 6: np.uint32}
+
+
+def _unpack_integers(data: np.ndarray, encoding: Dict) -> np.ndarray:
+    # Values equal to the type's upper/lower bound continue into the next slot.
+    info = np.iinfo(data.dtype)
+    if encoding["isUnsigned"]:
+        sentinel = data == info.max
+    else:
+        sentinel = (data == info.max) | (data == info.min)
+    totals = np.cumsum(data.astype(np.int64))
+    ends = np.flatnonzero(~sentinel)
+    values = totals[ends]
+    values[1:] -= totals[ends[:-1]]
+    return values.astype(np.int32)
+
+
+def decode_bcif_data(encoded: Dict):
+    """Applies the BinaryCIF encoding chain of ``encoded`` in reverse."""
+    data = encoded["data"]
+    for encoding in reversed(encoded["encoding"]):
+        kind = encoding["kind"]
+        if kind == "ByteArray":
+            data = np.frombuffer(data, dtype=_BYTE_ARRAY_TYPES[encoding["type"]])
+        elif kind == "FixedPoint":
+            data = data.astype(np.float64) / encoding["factor"]
+        elif kind == "IntervalQuantization":
+            step = (encoding["max"] - encoding["min"]) / (encoding["numSteps"] - 1)
+            data = encoding["min"] + step * data.astype(np.float64)
+        elif kind == "RunLength":
+            pairs = data.reshape(-1, 2)
+            data = np.repeat(pairs[:, 0], pairs[:, 1]).astype(_INT_TYPES[encoding["srcType"]])
+        elif kind == "Delta":
+            data = (encoding["origin"] + np.cumsum(data, dtype=np.int64)).astype(
+                _INT_TYPES[encoding["srcType"]]
+            )
+        elif kind == "IntegerPacking":
+            data = _unpack_integers(data, encoding)
+        elif kind == "StringArray":
+            offsets = decode_bcif_data(
+                {"data": encoding["offsets"], "encoding": encoding["offsetEncoding"]}
+            )
+            indices = decode_bcif_data(
+                {"data": data, "encoding": encoding["dataEncoding"]}
+            )
+            text = encoding["stringData"]
+            strings = np.array(
+                [text[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+                + [""],
+                dtype=object,
+            )
+            # Index -1 marks a missing value and picks the trailing empty string.
+            data = strings[indices]
+        else:
+            raise ValueError(f"Unsupported BinaryCIF encoding '{kind}'")
+    return data
+
+
+class BinaryCifConverter:
+    """Buffers a BinaryCIF document and converts its ``_atom_site`` category."""
+
+    def __init__(self):
+        self.writer = AtomSiteWriter()
+        self._chunks: List[bytes] = []
+
+    @property
+    def done(self) -> bool:
+        return self.writer.done
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._chunks.append(chunk)
+        return b""
+
+    def finish(self) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("BinaryCIF input requires the optional 'msgpack' package")
+        document = msgpack.unpackb(b"".join(self._chunks), raw=False)
+        self._chunks = []
+        for category in document["dataBlocks"][0]["categories"]:
+            if category["name"] == "_atom_site":
+                return self._convert(category)
+        raise ValueError("BinaryCIF document contains no _atom_site category")
+
+    def _convert(self, category: Dict) -> bytes:
+        names = []
+        columns = []
+        for column in category["columns"]:
+            values = decode_bcif_data(column["data"])
+            if column.get("mask"):
+                mask = decode_bcif_data(column["mask"])
+                values = np.where(mask == 0, values.astype(str), ".")
+            names.append(column["name"])
+            columns.append(values.astype(str))
+        resolved = _Columns(names)
+        output = []
+        for row in zip(*columns):
+            output.append(resolved.write_row(self.writer, row))
+            if self.writer.done:
+                break
+        output.append(self.writer.close())
+        return "".join(output).encode("ascii")
+
+
+# ====================================
+# Format dispatch
+# ====================================
+
+
+class StructureTranscoder:
+    """
+    Passes PDB input through unchanged and converts mmCIF/BinaryCIF input to
+    PDB records, choosing the format from the first bytes of the stream.
+    """
+
+    def __init__(self, sniff_size: int = 512):
+        self.format: Optional[str] = None
+        self._sniff_size = sniff_size
+        self._head = b""
+        self._converter = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.format is None:
+            self._head += chunk
+            if len(self._head) < self._sniff_size:
+                return b""
+            chunk, self._head = self._head, b""
+            self._start(chunk[: self._sniff_size])
+        if self._converter is None:
+            return chunk
+        return self._converter.feed(chunk)
+
+    def finish(self) -> bytes:
+        output = b""
+        if self.format is None:
+            head, self._head = self._head, b""
+            self._start(head)
+            output = head if self._converter is None else self._converter.feed(head)
+        if self._converter is None:
+            return output
+        return output + self._converter.finish()
+
+    def _start(self, head: bytes) -> None:
+        self.format = detect_structure_format(head)
+        if self.format == MMCIF:
+            self._converter = MmcifStreamConverter()
+        elif self.format == BINARY_CIF:
+            self._converter = BinaryCifConverter()
+
+
+def to_pdb_bytes(data: bytes) -> bytes:
+    transcoder = StructureTranscoder()
+    return transcoder.feed(data) + transcoder.finish()
@@ -0,0 +1,376 @@
+"""
+Vectorised preparation of PDB files for FoldX RepairPDB.
+
+FoldX expects a single chain ``A`` and the standard residue names, so the prep
+stage renames force-field protonation variants, rewrites the chain identifier
+and truncates the structure at the first ``TER`` record. Instead of rewriting
+every line in Python, the line starts are found with one NumPy scan, the
+fixed-width ATOM/HETATM columns are read as packed integers, and only the
+renamed residue names and the chain column are scattered back into the raw
+byte buffer, which is then written out in a single pass.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from compression import decompress_bytes
+from mmcif import to_pdb_bytes
+
+# ====================================
+# Fixed-column layout (0-based offsets)
+# ====================================
+
+RECORD_WIDTH = 6
+RESNAME_START = 17
+RESNAME_WIDTH = 3
+CHAIN_COL = 21
+
+# Bump whenever the prep transform changes its output, so content-keyed
+# repair caches do not serve results prepared the old way.
+PREP_VERSION = 1
+
+FOLDX_CHAIN = b"A"
+TER_RECORD = b"TER\n"
+ATOM_RECORDS = (b"ATOM  ", b"HETATM")
+
+# Amber, CHARMM and GROMACS protonation/disulfide variants that FoldX does not
+# recognise, mapped to the standard residue names it expects. Only names that
+# fit the three residue-name columns can appear in a PDB file.
+DEFAULT_RESIDUE_RENAMES: Dict[str, str] = {
+    # Histidine tautomers and the doubly protonated form
+    "HIE": "HIS",
+    "HID": "HIS",
+    "HIP": "HIS",
+    "HSE": "HIS",
+    "HSD": "HIS",
+    "HSP": "HIS",
+    # Disulfide-bonded, deprotonated and metal-bound cysteine
+    "CYX": "CYS",
+    "CYM": "CYS",
+    "CYP": "CYS",
+    # Protonated acids
+    "ASH": "ASP",
+    "GLH": "GLU",
+    # Neutral bases and deprotonated tyrosine
+    "LYN": "LYS",
+    "LSN": "LYS",
+    "ARN": "ARG",
+    "TYM": "TYR",
+}
+
+ATOM_DTYPE = np.dtype(
+    [
+        ("offset", np.int64),
+        ("length", np.int64),
+        ("record", f"S{RECORD_WIDTH}"),
+        ("resname", f"S{RESNAME_WIDTH}"),
+        ("chain", "S1"),
+    ]
+)
+
+# Fixed-width columns are read as unaligned little-endian 64-bit words, one
+# per line, rather than gathered a byte at a time.
+_WORD = 8
+_RECORD_MASK = (1 << 8 * RECORD_WIDTH) - 1
+_RESNAME_MASK = (1 << 8 * RESNAME_WIDTH) - 1
+_CHAIN_SHIFT = 8 * (CHAIN_COL - RESNAME_START)
+
+# Zero padding appended to the work buffer so column reads on short lines
+# never index past the end of the data.
+_PAD = RESNAME_START + _WORD
+
+
+def _word_code(text: bytes) -> int:
+    """Packs up to eight bytes into a little-endian integer."""
+    return int.from_bytes(text, "little")
+
+
+_ATOM_CODE, _HETATM_CODE = (_word_code(record) for record in ATOM_RECORDS)
+
+
+@dataclass
+class PrepStats:
+    atom_records: int = 0
+    terminated: bool = False
+    renamed: Dict[str, int] = field(default_factory=dict)
+
+
+# ====================================
+# Residue rename table
+# ====================================
+
+
+def check_renames(renames: Mapping[str, str]) -> None:
+    """Raises ``ValueError`` unless every name is ``RESNAME_WIDTH`` ASCII characters."""
+    for old, new in renames.items():
+        if not all(len(name) == RESNAME_WIDTH and name.isascii() for name in (old, new)):
+            raise ValueError(
+                f"Residue rename '{old}' -> '{new}' must map "
+                f"{RESNAME_WIDTH}-character ASCII names"
+            )
+
+
+class RenameTable:
+    """
+    Compiled residue-name substitution, matched against the packed residue
+    names of every ATOM/HETATM record in a single vectorised lookup.
+    """
+
+    def __init__(self, renames: Mapping[str, str]):
+        check_renames(renames)
+        self.renames: Dict[str, str] = dict(renames)
+        names = sorted(self.renames, key=lambda name: _word_code(name.encode("ascii")))
+        self._old = names
+        self._codes = np.array(
+            [_word_code(name.encode("ascii")) for name in names], dtype=np.uint64
+        )
+        self._new = np.frombuffer(
+            b"".join(self.renames[name].encode("ascii") for name in names), dtype=np.uint8
+        ).reshape(-1, RESNAME_WIDTH)
+
+    def extend(self, overrides: Optional[Mapping[str, str]]) -> "RenameTable":
+        if not overrides:
+            return self
+        return RenameTable({**self.renames, **overrides})
+
+    def match(self, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the residue names in ``codes`` (packed with ``_word_code``) that
+        are renamed. Returns their indices and their slots in the table.
+        """
+        if not len(self._codes) or not len(codes):
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty
+        slot = np.searchsorted(self._codes, codes)
+        slot[slot == len(self._codes)] = 0
+        rows = np.flatnonzero(self._codes[slot] == codes)
+        return rows, slot[rows]
+
+    def replacements(self, slots: np.ndarray) -> np.ndarray:
+        return self._new[slots]
+
+    def counts(self, slots: np.ndarray) -> Dict[str, int]:
+        counts = np.bincount(slots, minlength=len(self._codes))
+        return {self._old[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+DEFAULT_RENAME_TABLE = RenameTable(DEFAULT_RESIDUE_RENAMES)
+
+
+# ====================================
+# Column parsing
+# ====================================
+
+
+def _gather(buf: np.ndarray, offsets: np.ndarray, width: int) -> np.ndarray:
+    return buf[offsets[:, None] + np.arange(width)]
+
+
+def gather_field(buf: np.ndarray, atoms: np.ndarray, start: int, width: int) -> np.ndarray:
+    """Reads a fixed-width column of every record in ``atoms`` as ``S{width}``."""
+    return _gather(buf, atoms["offset"] + start, width).view(f"S{width}").ravel()
+
+
+def load_pdb_buffer(data: bytes) -> np.ndarray:
+    """Copies ``data`` into a zero-padded work buffer for column gathers."""
+    buf = np.empty(len(data) + _PAD, dtype=np.uint8)
+    buf[: len(data)] = np.frombuffer(data, dtype=np.uint8)
+    buf[len(data) :] = 0
+    return buf
+
+
+def _words(buf: np.ndarray) -> np.ndarray:
+    """The little-endian 64-bit word starting at every byte of ``buf``."""
+    return np.ndarray((len(buf) - _WORD + 1,), dtype="<u8", buffer=buf, strides=(1,))
+
+
+def _unpack(codes: np.ndarray, width: int) -> np.ndarray:
+    """Turns ``_word_code`` values back into ``S{width}`` strings."""
+    columns = codes.astype("<u8").view(np.uint8).reshape(-1, _WORD)[:, :width]
+    return np.ascontiguousarray(columns).view(f"S{width}").ravel()
+
+
+def _scatter(buf: np.ndarray, offsets: np.ndarray, values: np.ndarray, width: int) -> None:
+    buf[offsets[:, None] + np.arange(width)] = values.view(np.uint8).reshape(-1, width)
+
+
+def _atom_lines(buf: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Start, length and packed record name of the ATOM/HETATM lines."""
+    newlines = np.flatnonzero(buf[:size] == ord("\n"))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [size]))
+    present = starts < size
+    starts, ends = starts[present], ends[present]
+
+    records = _words(buf)[starts] & _RECORD_MASK
+    is_atom = (records == _ATOM_CODE) | (records == _HETATM_CODE)
+    starts = starts[is_atom]
+    return starts, ends[is_atom] - starts, records[is_atom]
+
+
+def parse_atom_records(buf: np.ndarray, size: int) -> np.ndarray:
+    """
+    Locates the ATOM/HETATM lines in ``buf[:size]`` and returns their
+    fixed-width columns as an ``ATOM_DTYPE`` structured array.
+    """
+    starts, lengths, records = _atom_lines(buf, size)
+    columns = _words(buf)[starts + RESNAME_START]
+
+    atoms = np.empty(len(starts), dtype=ATOM_DTYPE)
+    atoms["offset"] = starts
+    atoms["length"] = lengths
+    atoms["record"] = np.where(records == _HETATM_CODE, ATOM_RECORDS[1], ATOM_RECORDS[0])
+    atoms["resname"] = _unpack(columns & _RESNAME_MASK, RESNAME_WIDTH)
+    atoms["chain"] = _unpack(columns >> _CHAIN_SHIFT, 1)
+    return atoms
+
+
+# ====================================
+# Prep transform
+# ====================================
+
+
+def prepare_block(
+    data: bytes, renames: RenameTable = DEFAULT_RENAME_TABLE
+) -> Tuple[bytes, int, Dict[str, int]]:
+    """
+    Applies the prep transform to a block of whole PDB lines that contains no
+    TER record. Returns the prepared bytes, the number of ATOM/HETATM records
+    and the rename counts. Only the renamed residue names and the chain
+    column are written back.
+    """
+    size = len(data)
+    buf = load_pdb_buffer(data)
+    starts, lengths, _ = _atom_lines(buf, size)
+
+    resname_offsets = starts[lengths >= RESNAME_START + RESNAME_WIDTH] + RESNAME_START
+    rows, slots = renames.match(_words(buf)[resname_offsets] & _RESNAME_MASK)
+    _scatter(buf, resname_offsets[rows], renames.replacements(slots), RESNAME_WIDTH)
+    buf[starts[lengths > CHAIN_COL] + CHAIN_COL] = ord(FOLDX_CHAIN)
+    return buf[:size].tobytes(), len(starts), renames.counts(slots)
+
+
+class StreamingPreparer:
+    """
+    Incremental prep transform for PDB data arriving in arbitrary chunks.
+
+    Chunks are split on line boundaries and buffered until at least
+    ``block_size`` bytes of whole lines are available, so the NumPy work is
+    amortised over large blocks. Once the first TER record has been seen
+    ``done`` becomes true and further input is ignored.
+    """
+
+    def __init__(
+        self,
+        renames: RenameTable = DEFAULT_RENAME_TABLE,
+        block_size: int = 1 << 20,
+    ):
+        self.renames = renames
+        self.block_size = block_size
+        self.stats = PrepStats()
+        self._chunks: List[bytes] = []
+        self._buffered = 0
+        self._newline = False
+        # The last bytes fed, so a TER record split across chunks is still
+        # found. The stream starts on a line boundary.
+        self._tail = b"\n"
+        self._digest = hashlib.sha256()
+
+    @property
+    def done(self) -> bool:
+        return self.stats.terminated
+
+    @property
+    def content_sha256(self) -> str:
+        """SHA-256 of all prepared output produced so far."""
+        return self._digest.hexdigest()
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consumes ``chunk`` and returns any prepared output now available."""
+        if self.done or not chunk:
+            return b""
+        ter = self._find_terminator(chunk)
+        self._chunks.append(chunk)
+        self._buffered += len(chunk)
+        self._newline = self._newline or b"\n" in chunk
+
+        if ter >= 0:
+            self.stats.terminated = True
+            prepared = self._prepare(self._take()[:ter])
+            self._digest.update(TER_RECORD)
+            return prepared + TER_RECORD
+
+        if not self._newline or self._buffered < self.block_size:
+            return b""
+        data = self._take()
+        cut = data.rfind(b"\n") + 1
+        if cut < len(data):
+            self._chunks.append(data[cut:])
+            self._buffered = len(data) - cut
+        return self._prepare(data[:cut])
+
+    def finish(self) -> bytes:
+        """Flushes the trailing partial line once the input is exhausted."""
+        data = self._take()
+        if self.done:
+            return b""
+        return self._prepare(data)
+
+    def _find_terminator(self, chunk: bytes) -> int:
+        """
+        Returns the offset in the buffered data, once ``chunk`` is appended,
+        of the first TER record that ``chunk`` completes, or -1.
+        """
+        tail = self._tail
+        self._tail = (tail + chunk[-3:])[-3:]
+        pos = (tail + chunk[:3]).find(b"\nTER")
+        if pos >= 0:
+            return self._buffered - len(tail) + pos + 1
+        pos = chunk.find(b"\nTER")
+        return self._buffered + pos + 1 if pos >= 0 else -1
+
+    def _take(self) -> bytes:
+        """Joins the buffered chunks into one block."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        self._newline = False
+        return data
+
+    def _prepare(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        if b"\r" in data:
+            data = data.replace(b"\r\n", b"\n")
+        prepared, atom_records, renamed = prepare_block(data, self.renames)
+        self.stats.atom_records += atom_records
+        for name, count in renamed.items():
+            self.stats.renamed[name] = self.stats.renamed.get(name, 0) + count
+        self._digest.update(prepared)
+        return prepared
+
+
+def prepare_pdb_bytes(
+    data: bytes, renames: RenameTable = DEFAULT_RENAME_TABLE
+) -> Tuple[bytes, PrepStats]:
+    """
+    Applies the FoldX prep transform to a complete PDB document and returns
+    the prepared bytes. Everything from the first TER record onwards is
+    replaced by a bare ``TER`` line.
+    """
+    preparer = StreamingPreparer(renames, block_size=0)
+    prepared = preparer.feed(data) + preparer.finish()
+    return prepared, preparer.stats
+
+
+def prepare_pdb_file(
+    source: Path, target: Path, renames: RenameTable = DEFAULT_RENAME_TABLE
+) -> PrepStats:
+    data = to_pdb_bytes(decompress_bytes(source.read_bytes()))
+    prepared, stats = prepare_pdb_bytes(data, renames)
+    target.write_bytes(prepared)
+    return stats
@@ -0,0 +1,171 @@
+"""
+Pre-flight structure scan run before FoldX is started.
+
+Starting the FoldX binary costs far more than scanning the prepared PDB, so
+inputs that FoldX cannot repair (empty files, truncated records, structures
+without any standard amino acids or without a single complete backbone) are
+rejected up front with a ``PreflightError`` carrying the scan results.
+
+A few truncated records do not sink a structure: ``check_pdb_file`` drops
+them from the file and lists them in the report. Only when more than
+``MAX_TRUNCATED_FRACTION`` of the records lack coordinates is the input
+rejected.
+"""
+
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from ivcap_service import getLogger
+
+from dictionaries import aa_dict
+from pdb_prep import gather_field, load_pdb_buffer, parse_atom_records
+
+logger = getLogger("app")
+
+ATOM_NAME_START = 12
+RESID_START = 22
+RESID_WIDTH = 5
+# Last column of the z coordinate; anything shorter is a truncated record.
+COORDS_END = 54
+# Share of truncated records above which the structure is rejected rather
+# than repaired without them.
+MAX_TRUNCATED_FRACTION = 0.05
+
+BACKBONE_ATOMS = (b"N", b"CA", b"C", b"O")
+STANDARD_RESIDUES = np.array([name.encode("ascii") for name in aa_dict], dtype="S3")
+
+# Residue labels listed in the report; the counts always cover every residue.
+MAX_LISTED_RESIDUES = 20
+
+
+@dataclass
+class PreflightReport:
+    atom_records: int = 0
+    residues: int = 0
+    standard_residues: int = 0
+    nonstandard_residues: Dict[str, int] = field(default_factory=dict)
+    incomplete_backbone: int = 0
+    incomplete_backbone_residues: List[str] = field(default_factory=list)
+    truncated_lines: int = 0
+    truncated_line_numbers: List[int] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+class PreflightError(ValueError):
+    def __init__(self, report: PreflightReport):
+        self.report = report
+        super().__init__("Structure rejected before FoldX: " + "; ".join(report.errors))
+
+
+def _scan(data: bytes) -> Tuple[PreflightReport, np.ndarray]:
+    """The report, and the offsets of the truncated records."""
+    report = PreflightReport()
+    buf = load_pdb_buffer(data)
+    atoms = parse_atom_records(buf, len(data))
+    report.atom_records = len(atoms)
+    if not len(atoms):
+        report.errors.append("no ATOM/HETATM records")
+        return report, atoms["offset"]
+
+    truncated = atoms["length"] < COORDS_END
+    truncated_offsets = atoms["offset"][truncated]
+    report.truncated_lines = len(truncated_offsets)
+    if report.truncated_lines:
+        newlines = np.flatnonzero(buf[: len(data)] == ord("\n"))
+        report.truncated_line_numbers = (
+            np.searchsorted(newlines, truncated_offsets[:MAX_LISTED_RESIDUES]) + 1
+        ).tolist()
+    if report.truncated_lines > report.atom_records * MAX_TRUNCATED_FRACTION:
+        report.errors.append(
+            f"{report.truncated_lines} of {report.atom_records} ATOM/HETATM records "
+            "are truncated before the coordinate columns"
+        )
+        return report, truncated_offsets
+    atoms = atoms[~truncated]
+
+    # A new residue starts wherever the residue number/insertion code or the
+    # residue name changes from the previous record.
+    resids = gather_field(buf, atoms, RESID_START, RESID_WIDTH)
+    resnames = atoms["resname"]
+    starts = np.ones(len(atoms), dtype=bool)
+    starts[1:] = (resids[1:] != resids[:-1]) | (resnames[1:] != resnames[:-1])
+    residue_index = np.cumsum(starts) - 1
+    residue_names = resnames[starts]
+    report.residues = len(residue_names)
+
+    standard = np.isin(residue_names, STANDARD_RESIDUES)
+    report.standard_residues = int(standard.sum())
+    names, counts = np.unique(residue_names[~standard], return_counts=True)
+    report.nonstandard_residues = {
+        name.decode("ascii", errors="replace").strip(): int(count)
+        for name, count in zip(names, counts)
+    }
+    if not report.standard_residues:
+        report.errors.append("no standard amino-acid residues")
+        return report, truncated_offsets
+
+    atom_names = np.char.strip(gather_field(buf, atoms, ATOM_NAME_START, 4))
+    complete = np.ones(report.residues, dtype=bool)
+    for backbone_atom in BACKBONE_ATOMS:
+        present = np.bincount(
+            residue_index[atom_names == backbone_atom], minlength=report.residues
+        )
+        complete &= present > 0
+    incomplete = np.flatnonzero(standard & ~complete)
+    report.incomplete_backbone = len(incomplete)
+    residue_ids = resids[starts]
+    report.incomplete_backbone_residues = [
+        (residue_names[i] + residue_ids[i]).decode("ascii", errors="replace").replace(" ", "")
+        for i in incomplete[:MAX_LISTED_RESIDUES]
+    ]
+    if report.incomplete_backbone == report.standard_residues:
+        report.errors.append("no amino-acid residue has a complete N/CA/C/O backbone")
+    return report, truncated_offsets
+
+
+def scan_pdb_bytes(data: bytes) -> PreflightReport:
+    return _scan(data)[0]
+
+
+def scan_pdb_file(path: Path) -> PreflightReport:
+    return scan_pdb_bytes(path.read_bytes())
+
+
+def _drop_lines(data: bytes, offsets: np.ndarray) -> bytes:
+    """``data`` without the lines starting at ``offsets``."""
+    kept, start = [], 0
+    for offset in offsets.tolist():
+        kept.append(data[start:offset])
+        end = data.find(b"\n", offset)
+        start = len(data) if end < 0 else end + 1
+    kept.append(data[start:])
+    return b"".join(kept)
+
+
+def check_pdb_file(path: Path) -> PreflightReport:
+    """
+    Scans ``path`` and raises ``PreflightError`` if FoldX cannot repair it.
+    Tolerated truncated records are removed from the file.
+    """
+    data = path.read_bytes()
+    report, truncated_offsets = _scan(data)
+    if not report.ok:
+        raise PreflightError(report)
+    if len(truncated_offsets):
+        logger.warning(
+            "Dropping %d truncated ATOM/HETATM records from '%s' (lines %s)",
+            report.truncated_lines,
+            path.name,
+            report.truncated_line_numbers,
+        )
+        path.write_bytes(_drop_lines(data, truncated_offsets))
+    return report
@@ -0,0 +1,68 @@
+"""
+Content-addressed cache of FoldX repairs.
+
+Repairs are keyed on a hash of the prepared structure together with the FoldX
+binary version and every option that changes the repaired output, so a
+structure uploaded again under a new artifact URN reuses the earlier repair.
+The mapping is stored as an IVCAP aspect on a synthetic entity named after the
+key.
+"""
+
+import hashlib
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from ivcap_service import getLogger
+
+from pdb_prep import PREP_VERSION
+
+logger = getLogger("app")
+
+CACHE_SCHEMA = "urn:sd:schema.foldx_repair_pdb.cache.1"
+CACHE_ENTITY_PREFIX = "urn:sd:foldx_repair_pdb:sha256:"
+
+
+@lru_cache(maxsize=None)
+def foldx_version(foldx_binary: Path) -> str:
+    """Identifies the FoldX build by file name and content hash."""
+    digest = hashlib.sha256()
+    with foldx_binary.open("rb") as binary:
+        for block in iter(lambda: binary.read(1 << 20), b""):
+            digest.update(block)
+    return f"{foldx_binary.name}:{digest.hexdigest()}"
+
+
+def repair_cache_key(
+    content_sha256: str, foldx_binary: Path, options: Dict[str, Any]
+) -> str:
+    key = {
+        "content": content_sha256,
+        "foldx": foldx_version(foldx_binary),
+        "prep_version": PREP_VERSION,
+        "options": options,
+    }
+    encoded = json.dumps(key, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return CACHE_ENTITY_PREFIX + hashlib.sha256(encoded).hexdigest()
+
+
+def lookup_cached_repair(ivcap, cache_key: str) -> Optional[Dict[str, Any]]:
+    cached = list(ivcap.list_aspects(entity=cache_key, schema=CACHE_SCHEMA, limit=1))
+    return cached[0].content if cached else None
+
+
+def record_cached_repair(
+    ivcap, cache_key: str, repaired_pdb_urn: str, policy: Optional[str]
+) -> None:
+    aspect = {
+        "$schema": CACHE_SCHEMA,
+        "$id": cache_key,
+        "repaired_pdb_urn": repaired_pdb_urn,
+        "$policy": policy,
+    }
+    try:
+        ivcap.add_aspect(entity=cache_key, aspect=aspect, policy=policy)
+    except Exception as exc:
+        # A failed cache write only costs a future FoldX run.
+        logger.warning("Could not record repair cache entry '%s': %s", cache_key, exc)
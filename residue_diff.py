@@ -0,0 +1,109 @@
+"""
+Residue-level diff of a structure against the repaired parent it was derived
+from, used to re-repair only the part of a design that changed.
+
+Heavy atoms are matched by chain, residue number, residue name and atom name.
+A residue has changed when it is new or renamed (a mutation), when it lost
+atoms, or when one of its atoms moved more than ``MOVE_TOLERANCE``. Residues
+within ``NEIGHBOR_RADIUS`` of a changed residue, or of a parent atom that is
+gone (a deletion), are repaired too. Everything else keeps the conformation
+FoldX already produced for the parent.
+"""
+
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from clash_scan import MAX_LISTED_RESIDUES, NEIGHBOR_RADIUS, StructureAtoms
+from spatial_index import CellList
+
+# PDB coordinates carry three decimals; anything beyond rounding noise counts.
+MOVE_TOLERANCE = 0.02
+
+
+@dataclass
+class ResidueDiff:
+    residues: int = 0
+    parent_residues: int = 0
+    changed_residues: int = 0
+    removed_atoms: int = 0
+    repaired_residues: int = 0
+    skipped_residues: int = 0
+    changed_residue_labels: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _residue_keys(structure: StructureAtoms) -> np.ndarray:
+    key = np.char.add(structure.residue_chains, b":")
+    key = np.char.add(key, structure.residue_numbers.astype("S11"))
+    key = np.char.add(key, structure.residue_insertion_codes)
+    return np.char.add(np.char.add(key, b":"), structure.residue_names)
+
+
+def _atom_keys(
+    structure: StructureAtoms, parent: StructureAtoms
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Integer keys of every atom and residue of both structures, equal where
+    chain, residue number, insertion code, residue name (and atom name) match.
+    """
+    residue_keys = np.concatenate([_residue_keys(structure), _residue_keys(parent)])
+    _, residue_ids = np.unique(residue_keys, return_inverse=True)
+    _, name_ids = np.unique(
+        np.concatenate([structure.names, parent.names]), return_inverse=True
+    )
+    names = int(name_ids.max()) + 1 if len(name_ids) else 1
+    residue_ids = residue_ids.astype(np.int64)
+    child_residues = residue_ids[: structure.residues]
+    parent_residues = residue_ids[structure.residues :]
+    child_atoms = child_residues[structure.residue_index] * names + name_ids[: len(structure.names)]
+    parent_atoms = parent_residues[parent.residue_index] * names + name_ids[len(structure.names) :]
+    return child_atoms, parent_atoms, child_residues, parent_residues
+
+
+def _match(keys: np.ndarray, reference: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Position in ``reference`` of each key, and whether it was found."""
+    if not len(reference):
+        return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    order = np.argsort(reference, kind="stable")
+    pos = np.minimum(np.searchsorted(reference[order], keys), len(reference) - 1)
+    return order[pos], reference[order[pos]] == keys
+
+
+def diff_structures(
+    structure: StructureAtoms, parent: StructureAtoms
+) -> Tuple[ResidueDiff, np.ndarray]:
+    """
+    Compares ``structure`` with its ``parent`` and returns the report together
+    with a boolean mask of the residues of ``structure`` to repair.
+    """
+    report = ResidueDiff(residues=structure.residues, parent_residues=parent.residues)
+    child_atoms, parent_atoms, child_residues, parent_residues = _atom_keys(structure, parent)
+
+    pos, found = _match(child_atoms, parent_atoms)
+    delta = structure.coords - parent.coords[pos] if len(parent.coords) else structure.coords
+    moved = np.einsum("ij,ij->i", delta, delta) > np.float32(MOVE_TOLERANCE) ** 2
+    changed = np.zeros(structure.residues, dtype=bool)
+    changed[structure.residue_index[~found | moved]] = True
+
+    _, kept = _match(parent_atoms, child_atoms)
+    removed = ~kept
+    report.removed_atoms = int(removed.sum())
+    changed |= np.isin(child_residues, parent_residues[parent.residue_index[removed]])
+    report.changed_residues = int(changed.sum())
+    report.changed_residue_labels = [
+        structure.residue_label(index)
+        for index in np.flatnonzero(changed)[:MAX_LISTED_RESIDUES]
+    ]
+
+    index = CellList(structure.coords, NEIGHBOR_RADIUS, structure.residue_index)
+    repair = index.residue_neighborhood(changed, NEIGHBOR_RADIUS)
+    if report.removed_atoms:
+        near_removed = index.within(parent.coords[removed], NEIGHBOR_RADIUS)
+        repair[structure.residue_index[near_removed]] = True
+    report.repaired_residues = int(repair.sum())
+    report.skipped_residues = report.residues - report.repaired_residues
+    return report, repair
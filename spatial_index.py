@@ -0,0 +1,301 @@
+"""
+Uniform-grid cell list for neighbour searches over atom coordinates.
+
+Coordinates are held as one contiguous float32 ``(n, 3)`` array. They are
+binned into cubic cells of ``cell_size`` Å and sorted by cell id. The cells
+of a column along z have consecutive ids, so the atoms of any run of them form
+one contiguous slice of the sorted array. A query measures distances only to
+the atoms in the columns around each point. At the near-uniform density of a
+structure, the work therefore grows linearly with the number of atoms. Python
+loops run over columns only (9 for a radius up to the cell size, 5 when
+listing all pairs), never over atoms. Candidate pairs are materialised in
+chunks of ``MAX_CHUNK_PAIRS``, which bounds peak memory on large assemblies.
+"""
+
+import math
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pdb_prep import ATOM_RECORDS, gather_field, load_pdb_buffer, parse_atom_records
+
+COORD_START = 30
+COORD_WIDTH = 8
+RESID_START = 22
+RESID_WIDTH = 5
+
+DEFAULT_CELL_SIZE = 5.0
+MAX_CHUNK_PAIRS = 1 << 22
+# Grids with more cells than this per atom use a sorted lookup instead of a
+# dense table.
+DENSE_CELLS_PER_ATOM = 16
+# Cells are this many times thinner along z, so a column overshoots the
+# query sphere by less than a cell at either end.
+Z_SPLIT = 4
+# Empty cells around the grid (times Z_SPLIT along z), so that columns within
+# this reach of an occupied cell never leave it.
+_PAD = 2
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def gather_coordinates(buf: np.ndarray, atoms: np.ndarray) -> np.ndarray:
+    """Reads the x/y/z columns of ``atoms`` into a contiguous float32 array."""
+    coords = np.empty((len(atoms), 3), dtype=np.float32)
+    for axis in range(3):
+        coords[:, axis] = gather_field(
+            buf, atoms, COORD_START + axis * COORD_WIDTH, COORD_WIDTH
+        ).astype(np.float32)
+    return coords
+
+
+def residue_starts(buf: np.ndarray, atoms: np.ndarray) -> np.ndarray:
+    """True for the first record of every residue (resSeq, iCode or name change)."""
+    resids = gather_field(buf, atoms, RESID_START, RESID_WIDTH)
+    resnames = atoms["resname"]
+    starts = np.ones(len(atoms), dtype=bool)
+    starts[1:] = (resids[1:] != resids[:-1]) | (resnames[1:] != resnames[:-1])
+    return starts
+
+
+def load_coordinates(
+    path: Path, records: Tuple[bytes, ...] = ATOM_RECORDS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the float32 coordinates of the ``records`` (ATOM and HETATM by
+    default) in ``path`` and the residue index of each atom.
+    """
+    data = path.read_bytes()
+    buf = load_pdb_buffer(data)
+    atoms = parse_atom_records(buf, len(data))
+    atoms = atoms[np.isin(atoms["record"], records)]
+    return gather_coordinates(buf, atoms), np.cumsum(residue_starts(buf, atoms)) - 1
+
+
+def _columns(reach: int, half: bool) -> List[Tuple[int, int]]:
+    """(dx, dy) offsets of the cell columns around a cell, or half of them."""
+    span = range(-reach, reach + 1)
+    columns = [(dx, dy) for dx in span for dy in span]
+    if half:
+        columns = [column for column in columns if column >= (0, 0)]
+    return columns
+
+
+def _expand(
+    first: np.ndarray, lo: np.ndarray, counts: np.ndarray
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields ``(first[k], lo[k] + m)`` for every ``m < counts[k]`` in chunks of
+    at most ``MAX_CHUNK_PAIRS`` pairs (or one row, if a single row is larger).
+    """
+    ends = np.cumsum(counts)
+    if not len(ends) or not ends[-1]:
+        return
+    start = 0
+    while start < len(counts):
+        base = int(ends[start - 1]) if start else 0
+        stop = int(np.searchsorted(ends, base + MAX_CHUNK_PAIRS, side="right"))
+        stop = max(stop, start + 1)
+        chunk_counts = counts[start:stop]
+        total = int(ends[stop - 1]) - base
+        row_starts = np.repeat(lo[start:stop] - (ends[start:stop] - base) + chunk_counts, chunk_counts)
+        yield np.repeat(first[start:stop], chunk_counts), row_starts + np.arange(total)
+        start = stop
+
+
+class CellList:
+    """
+    Cell list over ``coords`` (converted to contiguous float32). Queries may
+    use any radius; radii beyond ``cell_size`` look further out than the
+    adjacent cells. Pass ``residue_index`` (residue of each atom) to answer
+    residue-neighbourhood queries.
+    """
+
+    def __init__(
+        self,
+        coords: np.ndarray,
+        cell_size: float = DEFAULT_CELL_SIZE,
+        residue_index: Optional[np.ndarray] = None,
+    ):
+        coords = np.ascontiguousarray(coords, dtype=np.float32)
+        if coords.ndim != 2 or coords.shape[1] != 3:
+            raise ValueError(f"expected (n, 3) coordinates, got shape {coords.shape}")
+        if cell_size <= 0:
+            raise ValueError(f"cell size must be positive, got {cell_size}")
+        if residue_index is not None and len(residue_index) != len(coords):
+            raise ValueError("residue_index must have one entry per atom")
+        self.coords = coords
+        self.cell_size = float(cell_size)
+        self._cell_dims = np.array([cell_size, cell_size, cell_size / Z_SPLIT], np.float32)
+        self._pad = np.array([_PAD, _PAD, _PAD * Z_SPLIT])
+        self.residue_index = residue_index
+
+        # Everything below works on one contiguous row per axis: gathering
+        # single floats is much cheaper than gathering xyz rows.
+        axes = np.ascontiguousarray(coords.T)
+        self.origin = axes.min(axis=1) if len(coords) else np.zeros(3, np.float32)
+        cells = self._cells(axes)
+        self.dims = (cells.max(axis=1) if len(coords) else self._pad) + 1 + self._pad
+        cell_id = self._cell_id(cells)
+        self.order = np.argsort(cell_id)
+        self._sorted_ids = cell_id[self.order]
+        self._axes = axes[:, self.order]
+
+        # Position of the first atom of every cell, as a dense table unless
+        # the grid is mostly empty.
+        self._starts: Optional[np.ndarray] = None
+        grid_cells = int(np.prod(self.dims))
+        if grid_cells <= max(DENSE_CELLS_PER_ATOM * len(coords), 1 << 20):
+            dtype = np.int32 if len(coords) < np.iinfo(np.int32).max else np.int64
+            self._starts = np.empty(grid_cells + 1, dtype=dtype)
+            self._starts[0] = 0
+            counts = np.bincount(self._sorted_ids, minlength=grid_cells).astype(dtype)
+            np.cumsum(counts, out=self._starts[1:])
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def _cells(self, axes: np.ndarray) -> np.ndarray:
+        """Cell coordinates, shaped ``(3, n)`` like ``axes``."""
+        cells = np.floor((axes - self.origin[:, None]) / self._cell_dims[:, None])
+        return cells.astype(np.int64) + self._pad[:, None]
+
+    def _cell_id(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[0] * self.dims[1] + cells[1]) * self.dims[2] + cells[2]
+
+    def _first_atom(self, ids: np.ndarray) -> np.ndarray:
+        """Sorted position of the first atom in a cell with id >= ``ids``."""
+        if self._starts is not None:
+            return self._starts[ids]
+        return np.searchsorted(self._sorted_ids, ids)
+
+    def _column(
+        self,
+        cells: Optional[np.ndarray],
+        ids: np.ndarray,
+        dx: int,
+        dy: int,
+        reach: Tuple[int, int],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sorted positions ``[lo, hi)`` of the atoms in cells ``(x + dx, y +
+        dy, z - reach_z .. z + reach_z)``. Cells along z have consecutive
+        ids, so they form one contiguous slice. ``cells`` must lie within the
+        occupied part of the grid; they are only needed for columns that
+        reach past its padding.
+        """
+        reach_z = reach[1]
+        shift = (dx * self.dims[1] + dy) * self.dims[2]
+        if self._padded(reach):
+            return (
+                self._first_atom(ids + (shift - reach_z)),
+                self._first_atom(ids + (shift + reach_z + 1)),
+            )
+        x = cells[0] + dx
+        y = cells[1] + dy
+        inside = (x >= 0) & (x < self.dims[0]) & (y >= 0) & (y < self.dims[1])
+        base = np.where(inside, ids - cells[2] + shift, 0)
+        lo = self._first_atom(base + np.maximum(cells[2] - reach_z, 0))
+        hi = self._first_atom(base + np.minimum(cells[2] + reach_z + 1, self.dims[2]))
+        return lo, np.where(inside, hi, lo)
+
+    @staticmethod
+    def _padded(reach: Tuple[int, int]) -> bool:
+        """Whether columns this far out stay within the grid's padding."""
+        return reach[0] <= _PAD and reach[1] <= _PAD * Z_SPLIT
+
+    def _reach(self, radius: float) -> Tuple[int, int]:
+        """Cells to search on either side of a point, across and along z."""
+        if radius <= 0:
+            raise ValueError(f"radius must be positive, got {radius}")
+        return (
+            max(1, math.ceil(radius / self._cell_dims[0])),
+            max(1, math.ceil(radius / self._cell_dims[2])),
+        )
+
+    def _close(
+        self, points: np.ndarray, first: np.ndarray, j: np.ndarray, radius_sq: float
+    ) -> np.ndarray:
+        distance_sq = None
+        for axis in range(3):
+            delta = points[axis][first]
+            delta -= self._axes[axis][j]
+            delta *= delta
+            if distance_sq is None:
+                distance_sq = delta
+            else:
+                distance_sq += delta
+        return distance_sq < radius_sq
+
+    def pairs(self, cutoff: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Index arrays ``(i, j)`` with ``i < j`` of every pair closer than ``cutoff``."""
+        reach = self._reach(cutoff)
+        if len(self) < 2:
+            return _EMPTY, _EMPTY
+        cutoff_sq = np.float32(cutoff) ** 2
+        positions = np.arange(len(self))
+        cells = None
+        if not self._padded(reach):
+            cells = np.stack(np.unravel_index(self._sorted_ids, tuple(self.dims)))
+        found_i, found_j = [], []
+        # The atom's own column (only the atoms after it) and the columns on
+        # one side of it visit every unordered pair once.
+        for dx, dy in _columns(reach[0], half=True):
+            lo, hi = self._column(cells, self._sorted_ids, dx, dy, reach)
+            if (dx, dy) == (0, 0):
+                lo = positions + 1
+            for i, j in _expand(positions, lo, hi - lo):
+                close = np.flatnonzero(self._close(self._axes, i, j, cutoff_sq))
+                found_i.append(self.order[i[close]])
+                found_j.append(self.order[j[close]])
+        if not found_i:
+            return _EMPTY, _EMPTY
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        return np.minimum(i, j), np.maximum(i, j)
+
+    def _query(self, points: np.ndarray, radius: float) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+        reach = self._reach(radius)
+        if not len(self) or not len(points):
+            return
+        radius_sq = np.float32(radius) ** 2
+        axes = np.ascontiguousarray(points.T)
+        # Points outside the structure are clamped to its edge cells: that
+        # still covers every atom within reach of them.
+        cells = np.clip(
+            self._cells(axes), self._pad[:, None], (self.dims - 1 - self._pad)[:, None]
+        )
+        ids = self._cell_id(cells)
+        query = np.arange(len(points))
+        for dx, dy in _columns(reach[0], half=False):
+            lo, hi = self._column(cells, ids, dx, dy, reach)
+            for q, j in _expand(query, lo, hi - lo):
+                close = np.flatnonzero(self._close(axes, q, j, radius_sq))
+                yield q[close], self.order[j[close]]
+
+    def query_radius(self, points: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Index arrays ``(point, atom)`` of every atom within ``radius`` of a point."""
+        found = list(self._query(points, radius))
+        if not found:
+            return _EMPTY, _EMPTY
+        return np.concatenate([q for q, _ in found]), np.concatenate([a for _, a in found])
+
+    def within(self, points: np.ndarray, radius: float) -> np.ndarray:
+        """Boolean mask of the atoms within ``radius`` of any of ``points``."""
+        mask = np.zeros(len(self), dtype=bool)
+        for _, atoms in self._query(points, radius):
+            mask[atoms] = True
+        return mask
+
+    def residue_neighborhood(self, residues: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Expands the boolean residue mask ``residues`` with every residue that
+        has an atom within ``radius`` of an atom of a selected residue.
+        """
+        if self.residue_index is None:
+            raise ValueError("residue-neighbourhood queries need a residue_index")
+        selected = self.coords[residues[self.residue_index]]
+        neighborhood = residues.copy()
+        neighborhood[self.residue_index[self.within(selected, radius)]] = True
+        return neighborhood
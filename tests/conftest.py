@@ -0,0 +1,129 @@
+import http.server
+import importlib.util
+import socketserver
+import threading
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def repo_dir() -> Path:
+    return REPO_DIR
+
+
+@pytest.fixture(scope="session")
+def tool_service():
+    """tool-service.py loaded as a module (its file name is not importable)."""
+    pytest.importorskip("ivcap_ai_tool.server")
+    spec = importlib.util.spec_from_file_location("tool_service", REPO_DIR / "tool-service.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _resource(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        return data
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, None))
+        data = self._resource()
+        if data is not None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+    def do_GET(self):
+        byte_range = self.headers.get("Range")
+        self.server.requests.append(("GET", self.path, byte_range))
+        data = self._resource()
+        if data is None:
+            return
+        if byte_range:
+            first, last = byte_range[len("bytes=") :].split("-")
+            last = int(last) if last else len(data) - 1
+            body = data[int(first) : last + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {first}-{last}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    files: Dict[str, bytes]
+    requests: List
+
+
+@pytest.fixture
+def http_server():
+    """A local server for the bytes in ``server.files``, honouring byte ranges."""
+    server = _Server(("127.0.0.1", 0), _RangeHandler)
+    server.files = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _string_column(name: str, values: Sequence[str]) -> Dict:
+    distinct = sorted(set(values))
+    offsets = np.cumsum([0] + [len(value) for value in distinct]).astype("<i4")
+    indices = np.array([distinct.index(value) for value in values], dtype="<i4")
+    int32 = [{"kind": "ByteArray", "type": 3}]
+    return {
+        "name": name,
+        "data": {
+            "data": indices.tobytes(),
+            "encoding": [
+                {
+                    "kind": "StringArray",
+                    "dataEncoding": int32,
+                    "stringData": "".join(distinct),
+                    "offsetEncoding": int32,
+                    "offsets": offsets.tobytes(),
+                }
+            ],
+        },
+        "mask": None,
+    }
+
+
+@pytest.fixture
+def bcif_document():
+    """Packs ``_atom_site`` columns (name -> values) as a BinaryCIF document."""
+    msgpack = pytest.importorskip("msgpack")
+
+    def pack(columns: Dict[str, Sequence[str]], extra: Sequence[Dict] = ()) -> bytes:
+        rows = len(next(iter(columns.values())))
+        atom_site = {
+            "name": "_atom_site",
+            "rowCount": rows,
+            "columns": [_string_column(name, values) for name, values in columns.items()],
+        }
+        block = {"header": "TEST", "categories": [*extra, atom_site]}
+        return msgpack.packb({"version": "0.3.0", "encoder": "tests", "dataBlocks": [block]})
+
+    return pack
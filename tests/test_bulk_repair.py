@@ -0,0 +1,56 @@
+import pytest
+
+import foldx_executor
+
+bulk = pytest.importorskip("FoldX_repair_pdb")
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "mirror"
+    for name in ("b/x.pdb", "b/x.cif.gz", "a/y.ent.bz2", "a/notes.txt", "c.bcif", ".cache/z.pdb"):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    return root
+
+
+def test_find_structures_walks_the_tree_in_path_order(tree):
+    found = [path.relative_to(tree).as_posix() for path in bulk.find_structures(tree)]
+    assert found == ["c.bcif", "a/y.ent.bz2", "b/x.cif.gz", "b/x.pdb"]
+
+
+def test_manifest_paths_are_relative_to_it(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# mirror\none.pdb\n\n/abs/two.cif\n")
+    assert list(bulk.find_structures(manifest)) == [tmp_path / "one.pdb", bulk.Path("/abs/two.cif")]
+
+
+def test_output_keeps_the_tree_layout(tree, tmp_path):
+    output = bulk.output_path_for(tree / "a" / "y.ent.bz2", tree, tmp_path / "out")
+    assert output == tmp_path / "out" / "a" / "y_Repair.pdb"
+
+
+def test_colliding_outputs_are_reported(tree, tmp_path):
+    out = tmp_path / "out"
+    loser = str(tree / "b" / "x.pdb")
+    error = f"Output '{out / 'b' / 'x_Repair.pdb'}' is already used by '{tree / 'b' / 'x.cif.gz'}'"
+    for retry_failed in (False, True):
+        summary = bulk.bulk_repair(
+            tree, out, workers=1, foldx_binary=bulk.Path("/bin/false"), retry_failed=retry_failed
+        )
+        entries = bulk.read_journal(out / bulk.JOURNAL_NAME)
+        assert (entries[loser]["status"], entries[loser]["error"]) == (bulk.FAILED, error)
+        assert summary["failed"] == len(entries) == 4
+
+
+def test_workers_split_the_memory_limit(monkeypatch):
+    monkeypatch.setattr(foldx_executor, "read_cpu_quota", lambda: 16.0)
+    monkeypatch.setattr(foldx_executor, "read_memory_limit", lambda: 8 << 30)
+    for name in ("FOLDX_MAX_CONCURRENCY", "FOLDX_RSS_LIMIT"):
+        monkeypatch.delenv(name, raising=False)
+    executor = bulk.worker_executor(4)
+    assert executor.max_workers == 1
+    assert executor.rss_limit == int((8 << 30) * foldx_executor.FOLDX_MEMORY_SHARE // 4)
+    monkeypatch.setenv("FOLDX_RSS_LIMIT", "1000")
+    assert bulk.worker_executor(4).rss_limit == 1000
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from clash_scan import load_structure_atoms, scan_clashes, write_fixed_residues
+
+
+def atom(record, serial, name, resname, chain, resseq, x, element=" C", icode=" "):
+    return (
+        f"{record:<6}{serial:>5} {name:<4} {resname:>3} {chain}{resseq:>4}{icode}   "
+        f"{x:8.3f}{0:8.3f}{0:8.3f}{1:6.2f}{0:6.2f}          {element}\n"
+    )
+
+
+@pytest.fixture
+def structure(tmp_path):
+    path = tmp_path / "small.pdb"
+    path.write_text(
+        atom("ATOM", 1, "CA", "GLY", "A", 52, 0.0)
+        + atom("ATOM", 2, "CA", "GLY", "A", 52, 10.0, icode="A")
+        + atom("HETATM", 3, "ZN", "ZN", "B", 9, 20.0, element="ZN")
+        # Two side chains 1.5 A apart.
+        + atom("ATOM", 4, "CD1", "LEU", "A", 60, 30.0)
+        + atom("ATOM", 5, "CD1", "LEU", "A", 70, 31.5)
+        + "END\n"
+    )
+    return load_structure_atoms(path)
+
+
+def test_labels_keep_insertion_codes_and_non_standard_names(structure):
+    labels = [structure.residue_label(index) for index in range(structure.residues)]
+    assert labels == ["GA52", "GA52A", "ZNB9", "LA60", "LA70"]
+    assert [structure.is_standard(index) for index in range(structure.residues)] == [
+        True,
+        True,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_scan_finds_the_clashing_pair(structure):
+    report, repair = scan_clashes(structure)
+    assert (report.clashes, report.clashing_residues) == (1, 2)
+    assert report.clashing_residue_labels == ["LA60", "LA70"]
+    assert repair.tolist() == [False, False, False, True, True]
+    assert (report.repaired_residues, report.skipped_residues) == (2, 3)
+
+
+def test_fixed_residues_file_format(structure, tmp_path):
+    _, repair = scan_clashes(structure)
+    path = tmp_path / "fixed.txt"
+    # The zinc is outside the repair region but FoldX has no code for it.
+    assert write_fixed_residues(structure, repair, path) == 2
+    assert path.read_text() == "GA52,GA52A;\n"
+
+
+def test_example_structure(repo_dir, tmp_path):
+    structure = load_structure_atoms(repo_dir / "example.pdb")
+    report, repair = scan_clashes(structure)
+    assert (report.residues, report.clashes, report.clashing_residues) == (208, 18, 28)
+    assert (report.repaired_residues, report.skipped_residues) == (153, 55)
+    assert report.clashing_residue_labels[:4] == ["FA21", "DA22", "FA25", "NA32"]
+
+    path = tmp_path / "fixed.txt"
+    assert write_fixed_residues(structure, repair, path) == 55
+    text = path.read_text()
+    assert text.endswith(";\n") and text.count(",") == 54
+    fixed = text[:-2].split(",")
+    assert fixed == [structure.residue_label(index) for index in np.flatnonzero(~repair)]
@@ -0,0 +1,78 @@
+import bz2
+import gzip
+
+import pytest
+
+from compression import (
+    BZIP2,
+    GZIP,
+    ZSTD,
+    StreamDecompressor,
+    compress_file,
+    decompress_bytes,
+    detect_compression,
+    strip_compression_suffix,
+)
+
+PDB = b"ATOM      1  N   MET A   1      11.104   6.134  -6.504  1.00  0.00           N\n" * 200
+
+
+def zstd_compress(data: bytes) -> bytes:
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSORS = {
+    GZIP: gzip.compress,
+    BZIP2: bz2.compress,
+    ZSTD: zstd_compress,
+}
+
+
+def decompress_in_chunks(data: bytes, chunk_size: int):
+    decompressor = StreamDecompressor()
+    out = [decompressor.feed(data[i : i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(decompressor.finish())
+    return b"".join(out), decompressor.codec
+
+
+@pytest.mark.parametrize("codec", [GZIP, BZIP2, ZSTD])
+def test_detects_codec_from_magic_bytes(codec):
+    assert detect_compression(COMPRESSORS[codec](PDB)[:8]) == codec
+
+
+def test_plain_text_is_not_compressed():
+    assert detect_compression(PDB) is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 64, 1 << 20])
+@pytest.mark.parametrize("codec", [GZIP, BZIP2, ZSTD])
+def test_stream_decompression(codec, chunk_size):
+    assert decompress_in_chunks(COMPRESSORS[codec](PDB), chunk_size) == (PDB, codec)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 20])
+def test_uncompressed_input_passes_through(chunk_size):
+    assert decompress_in_chunks(PDB, chunk_size) == (PDB, None)
+
+
+def test_short_uncompressed_input():
+    assert decompress_bytes(b"TE") == b"TE"
+
+
+@pytest.mark.parametrize("codec", [GZIP, BZIP2, ZSTD])
+def test_concatenated_streams(codec):
+    half = len(PDB) // 2
+    data = COMPRESSORS[codec](PDB[:half]) + COMPRESSORS[codec](PDB[half:])
+    assert decompress_in_chunks(data, 100)[0] == PDB
+
+
+@pytest.mark.parametrize("codec", [GZIP, BZIP2, ZSTD])
+def test_compress_file_round_trip(tmp_path, codec):
+    if codec == ZSTD:
+        pytest.importorskip("zstandard")
+    source = tmp_path / "model_Repair.pdb"
+    source.write_bytes(PDB)
+    target = compress_file(source, codec)
+    assert strip_compression_suffix(target.name) == source.name
+    assert decompress_bytes(target.read_bytes()) == PDB
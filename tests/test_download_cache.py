@@ -0,0 +1,160 @@
+import fcntl
+import multiprocessing
+import os
+from pathlib import Path
+
+import pytest
+
+from download_cache import LOCK_NAME, CacheEntry, DownloadCache
+
+
+def store(cache: DownloadCache, urn: str, data: bytes, complete: bool = True, etag=None):
+    writer = cache.writer(urn)
+    writer.write(data)
+    return cache.commit(writer, etag, len(data), complete)
+
+
+def touch(cache: DownloadCache, urn: str, mtime: float) -> None:
+    os.utime(cache._entry_path(urn), (mtime, mtime))
+
+
+def blobs(cache: DownloadCache):
+    return sorted(path.name for path in cache.blob_dir.glob("*/*"))
+
+
+def read(cache: DownloadCache, urn: str) -> bytes:
+    with cache.open(cache.lookup(urn)) as blob:
+        return blob.read()
+
+
+def _store_many(root: str, worker: int) -> None:
+    cache = DownloadCache(Path(root), max_bytes=4000)
+    for i in range(20):
+        store(cache, f"urn:{worker}:{i}", bytes([worker, i]) * 250)
+
+
+def test_store_and_lookup(tmp_path):
+    cache = DownloadCache(tmp_path)
+    entry = store(cache, "urn:a", b"ATOM\n", complete=False, etag='"v1"')
+    assert cache.lookup("urn:a") == entry
+    assert not entry.complete
+    assert read(cache, "urn:a") == b"ATOM\n"
+    assert cache.lookup("urn:missing") is None
+    assert not list(cache.tmp_dir.iterdir())
+
+
+def test_entry_validation():
+    entry = CacheEntry("urn:a", "0" * 64, 10, True, etag='"v1"', size=10)
+    assert entry.matches('"v1"', 99)
+    assert not entry.matches('"v2"', 10)
+    assert entry.matches(None, 10)
+    assert not entry.matches(None, None)
+
+
+def test_identical_content_shares_a_blob(tmp_path):
+    cache = DownloadCache(tmp_path)
+    store(cache, "urn:a", b"same")
+    store(cache, "urn:b", b"same")
+    assert len(blobs(cache)) == 1
+    assert read(cache, "urn:a") == read(cache, "urn:b") == b"same"
+
+
+def test_overwritten_entry_drops_its_old_blob(tmp_path):
+    cache = DownloadCache(tmp_path)
+    store(cache, "urn:a", b"old")
+    entry = store(cache, "urn:a", b"new")
+    assert blobs(cache) == [entry.sha256]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=250)
+    for age, urn in enumerate(["urn:a", "urn:b"]):
+        store(cache, urn, urn.encode() * 20)
+        touch(cache, urn, 1000 + age)
+    # Opening an entry marks it as used, so "urn:b" is now the oldest.
+    cache.open(cache.lookup("urn:a")).close()
+    store(cache, "urn:c", b"c" * 100)
+    assert cache.lookup("urn:b") is None
+    assert cache.lookup("urn:a") and cache.lookup("urn:c")
+    assert cache.metrics()["evictions"] == 1
+    assert cache.metrics()["stored_bytes"] == 200
+
+
+def test_shared_blob_survives_until_its_last_entry_goes(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=100)
+    store(cache, "urn:a", b"x" * 60)
+    store(cache, "urn:b", b"x" * 60)
+    touch(cache, "urn:a", 1000)
+    touch(cache, "urn:b", 1001)
+    store(cache, "urn:c", b"y" * 60)
+    assert cache.lookup("urn:a") is None and cache.lookup("urn:b") is None
+    assert len(blobs(cache)) == 1
+
+
+def test_open_blob_outlives_eviction(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=100)
+    store(cache, "urn:a", b"a" * 80)
+    blob = cache.open(cache.lookup("urn:a"))
+    touch(cache, "urn:a", 1000)
+    store(cache, "urn:b", b"b" * 80)
+    assert cache.open(CacheEntry("urn:a", blob.name.rsplit("/", 1)[-1], 80, True)) is None
+    with blob:
+        assert blob.read() == b"a" * 80
+
+
+def test_oversized_downloads_are_not_kept(tmp_path):
+    cache = DownloadCache(tmp_path, max_bytes=10)
+    assert store(cache, "urn:a", b"x" * 11) is None
+    source = tmp_path / "big.pdb"
+    source.write_bytes(b"x" * 11)
+    assert cache.store_file("urn:b", source, None, 11) is None
+    assert not blobs(cache) and not list(cache.tmp_dir.iterdir())
+
+
+def test_changes_hold_an_exclusive_lock(tmp_path):
+    cache = DownloadCache(tmp_path)
+    with cache._locked(), (tmp_path / LOCK_NAME).open("a") as other:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    with (tmp_path / LOCK_NAME).open("a") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_processes_share_one_cache(tmp_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_store_many, args=(str(tmp_path), i)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    cache = DownloadCache(tmp_path, max_bytes=4000)
+    urns = [f"urn:{worker}:{i}" for worker in range(4) for i in range(20)]
+    entries = [entry for entry in map(cache.lookup, urns) if entry]
+    assert 0 < sum(entry.bytes for entry in entries) <= cache.max_bytes
+    assert blobs(cache) == sorted(entry.sha256 for entry in entries)
+    for entry in entries:
+        worker, i = map(int, entry.urn.split(":")[1:])
+        assert read(cache, entry.urn) == bytes([worker, i]) * 250
+    assert not list(cache.tmp_dir.iterdir())
+
+
+def test_service_refetches_evicted_blob_without_etag(tool_service, http_server, tmp_path, monkeypatch):
+    from tests.test_range_download import FakeArtifact
+
+    data = b"ATOM\n" * 100
+    http_server.files["/model.pdb"] = data
+    cache = DownloadCache(tmp_path / "cache")
+    monkeypatch.setattr(tool_service, "download_cache", cache)
+    artifact = FakeArtifact(http_server, "model.pdb")
+    artifact.size = len(data)
+    entry = store(cache, artifact.id, data)
+    cache._blob_path(entry.sha256).unlink()
+
+    stats = tool_service.DownloadStats()
+    with tool_service.open_artifact_stream(artifact, stats) as chunks:
+        assert b"".join(chunks) == data
+    assert not stats.cache_hit
+    assert [request[0] for request in http_server.requests] == ["GET"]
+    assert read(cache, artifact.id) == data
@@ -0,0 +1,192 @@
+import gzip
+
+import httpx
+import pytest
+
+import download_retry
+from download_retry import (
+    MAX_LISTED_RETRIES,
+    ResumableStream,
+    RetryBudget,
+    backoff_delay,
+    retryable,
+)
+
+URL = "https://data.example/artifact"
+DATA = bytes(range(256)) * 40
+# Level 0 keeps the encoded body larger than DATA, like any incompressible input.
+GZIPPED = gzip.compress(DATA, compresslevel=0)
+
+
+class BrokenStream(httpx.SyncByteStream):
+    """A body that fails with a transport error after ``stop`` bytes."""
+
+    def __init__(self, data: bytes, stop: int):
+        self.data = data
+        self.stop = stop
+
+    def __iter__(self):
+        for start in range(0, self.stop, 1000):
+            yield self.data[start : min(start + 1000, self.stop)]
+        raise httpx.ReadError("connection reset")
+
+
+class FlakyServer:
+    """
+    Serves ``DATA``, breaking the first ``breaks`` bodies half way through.
+    Set ``honour_range`` to False to answer ranged requests with the whole
+    body, ``range_shift`` to serve ranges that many bytes early, ``etags`` to
+    the ETag of each successive response and ``gzip`` to compress the body.
+    """
+
+    def __init__(
+        self, breaks=1, failures=(), honour_range=True, etags=('"v1"',), range_shift=0, gzip=False
+    ):
+        self.breaks = breaks
+        self.range_shift = range_shift
+        self.gzip = gzip
+        self.failures = list(failures)
+        self.honour_range = honour_range
+        self.etags = list(etags)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.failures:
+            return httpx.Response(self.failures.pop(0))
+        etag = self.etags.pop(0) if len(self.etags) > 1 else self.etags[0]
+        headers = {"ETag": etag}
+        status, body = 200, DATA
+        if self.gzip:
+            headers["Content-Encoding"] = "gzip"
+            body = GZIPPED
+        range_header = request.headers.get("Range")
+        if range_header and self.honour_range:
+            offset = int(range_header[len("bytes=") : -1]) - self.range_shift
+            headers["Content-Range"] = f"bytes {offset}-{len(body) - 1}/{len(body)}"
+            status, body = 206, body[offset:]
+        if self.breaks:
+            self.breaks -= 1
+            return httpx.Response(status, headers=headers, stream=BrokenStream(body, len(body) // 2))
+        return httpx.Response(status, headers=headers, content=body)
+
+
+def budget(retries: int = 5) -> RetryBudget:
+    return RetryBudget(retries, sleep=lambda delay: None)
+
+
+def download(server: FlakyServer, retries: RetryBudget):
+    with httpx.Client(transport=httpx.MockTransport(server)) as client:
+        with ResumableStream(client, URL, retries) as stream:
+            stream.raise_for_status()
+            return b"".join(stream.iter_bytes()), stream
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(download_retry.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(attempt, 0.5, 3.0) for attempt in range(5)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (httpx.ConnectError("refused"), True),
+        (httpx.ReadTimeout("slow"), True),
+        (httpx.HTTPStatusError("", request=None, response=httpx.Response(503)), True),
+        (httpx.HTTPStatusError("", request=None, response=httpx.Response(429)), True),
+        (httpx.HTTPStatusError("", request=None, response=httpx.Response(404)), False),
+        (ValueError("bad"), False),
+    ],
+)
+def test_retryable(exc, expected):
+    assert retryable(exc) is expected
+
+
+def test_budget_is_shared_and_bounded():
+    delays = []
+    retries = RetryBudget(2, sleep=delays.append)
+    error = httpx.ReadError("reset")
+    assert retries.retry("a", 0, 0, error)
+    assert retries.retry("b", 10, 0, error)
+    assert not retries.retry("a", 20, 1, error)
+    assert not retries.retry("a", 0, 0, ValueError("bad"))
+    assert len(delays) == retries.used == 2
+    assert [event["url"] for event in retries.as_dict()["retry_events"]] == ["a", "b"]
+
+
+def test_listed_retries_are_capped():
+    retries = budget(MAX_LISTED_RETRIES + 5)
+    for attempt in range(MAX_LISTED_RETRIES + 5):
+        retries.retry(URL, 0, attempt, httpx.ReadError("reset"))
+    report = retries.as_dict()
+    assert report["retries"] == MAX_LISTED_RETRIES + 5
+    assert len(report["retry_events"]) == MAX_LISTED_RETRIES
+
+
+def test_resumes_from_the_last_byte():
+    server = FlakyServer(breaks=2)
+    retries = budget()
+    data, stream = download(server, retries)
+    assert data == DATA
+    assert stream.resumes == 2
+    assert [request.headers.get("Range") for request in server.requests] == [
+        None,
+        f"bytes={len(DATA) // 2}-",
+        f"bytes={len(DATA) * 3 // 4}-",
+    ]
+    assert all(request.headers["If-Range"] == '"v1"' for request in server.requests[1:])
+    assert [event.offset for event in retries.events] == [len(DATA) // 2, len(DATA) * 3 // 4]
+
+
+def test_whole_body_resent_is_skipped():
+    data, stream = download(FlakyServer(honour_range=False), budget())
+    assert data == DATA
+    assert stream.resumes == 1
+
+
+def test_changed_artifact_is_not_spliced():
+    with pytest.raises(httpx.RemoteProtocolError):
+        download(FlakyServer(honour_range=False, etags=('"v1"', '"v2"')), budget())
+
+
+def test_server_errors_are_retried_before_the_body():
+    server = FlakyServer(breaks=0, failures=[503, 429])
+    data, stream = download(server, budget())
+    assert data == DATA
+    assert len(server.requests) == 3
+    assert stream.status_code == 200
+
+
+def test_gives_up_when_the_budget_is_spent():
+    with pytest.raises(httpx.ReadError):
+        download(FlakyServer(breaks=3), budget(retries=2))
+
+
+def test_range_starting_elsewhere_restarts_from_the_beginning():
+    server = FlakyServer(range_shift=100)
+    data, stream = download(server, budget())
+    assert data == DATA
+    assert [request.headers.get("Range") for request in server.requests] == [
+        None,
+        f"bytes={len(DATA) // 2}-",
+        None,
+    ]
+
+
+def test_encoded_body_restarts_from_the_beginning():
+    server = FlakyServer(breaks=2, gzip=True)
+    data, stream = download(server, budget())
+    assert data == DATA
+    assert stream.resumes == 2
+    # Offsets in the decoded body mean nothing to the server.
+    assert [request.headers.get("Range") for request in server.requests] == [None, None, None]
+
+
+def test_resume_drops_conditional_headers():
+    server = FlakyServer()
+    with httpx.Client(transport=httpx.MockTransport(server)) as client:
+        headers = {"If-None-Match": '"v0"'}
+        with ResumableStream(client, URL, budget(), headers) as stream:
+            assert b"".join(stream.iter_bytes()) == DATA
+    assert server.requests[0].headers["If-None-Match"] == '"v0"'
+    assert "If-None-Match" not in server.requests[1].headers
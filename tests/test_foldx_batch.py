@@ -0,0 +1,166 @@
+import subprocess
+import threading
+from pathlib import Path
+
+import pytest
+
+from foldx_batch import STDOUT_NAME, BatchScheduler, repaired_paths
+from foldx_executor import FoldxRun
+
+FOLDX = Path("/opt/foldx")
+
+
+class StubExecutor:
+    """
+    Stands in for FoldxExecutor. Like RepairPDB it repairs the listed
+    structures in order, writing ``<stem>_Repair.pdb``/``.fxout``. A structure
+    containing BREAK makes the process fail when it is reached; one
+    containing SILENT is skipped without an error, but only within a batch.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def timeout_for(self, residues):
+        return None if residues is None else 10.0 * residues
+
+    def run(self, cmd, cwd, timeout=None, cancel=None, stdout=None, on_sample=None):
+        args = dict(arg[2:].split("=", 1) for arg in cmd[1:] if arg.startswith("--"))
+        cwd = Path(cwd)
+        if "pdb-list" in args:
+            names = (cwd / args["pdb-list"]).read_text().split()
+        else:
+            names = [args["pdb"]]
+        with self._lock:
+            self.calls.append((names, timeout, args.get("fix-residues-file")))
+        Path(stdout).write_text("FoldX stdout\n")
+        for name in names:
+            content = (cwd / name).read_text()
+            if "BREAK" in content:
+                raise subprocess.CalledProcessError(1, cmd)
+            if "SILENT" in content and len(names) > 1:
+                continue
+            for output in repaired_paths(cwd / name):
+                output.write_text(f"repaired {content}")
+        return FoldxRun(returncode=0, run_seconds=1.0)
+
+
+@pytest.fixture
+def executor():
+    return StubExecutor()
+
+
+def make_jobs(tmp_path, contents):
+    """One workspace per job, all with the same input name."""
+    paths = []
+    for i, content in enumerate(contents):
+        workspace = tmp_path / f"ws{i}"
+        workspace.mkdir()
+        path = workspace / "input_prep.pdb"
+        path.write_text(content)
+        paths.append(path)
+    return paths
+
+
+def submit_all(scheduler, paths, **kwargs):
+    """Submits every path from its own thread, all at the same moment."""
+    results = [None] * len(paths)
+    start = threading.Barrier(len(paths))
+
+    def work(i):
+        start.wait()
+        try:
+            results[i] = scheduler.submit(paths[i], FOLDX, **kwargs)
+        except Exception as exc:
+            results[i] = exc
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(paths))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def repaired(path: Path) -> str:
+    return repaired_paths(path)[0].read_text()
+
+
+def test_window_zero_runs_jobs_alone(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "b"])
+    results = submit_all(BatchScheduler(executor, window=0), paths)
+    assert sorted(len(names) for names, _, _ in executor.calls) == [1, 1]
+    assert [run.batch_size for run in results] == [1, 1]
+    assert [repaired(path) for path in paths] == ["repaired a", "repaired b"]
+
+
+def test_concurrent_jobs_share_one_invocation(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "b", "c"])
+    scheduler = BatchScheduler(executor, window=5.0, max_size=3)
+    results = submit_all(scheduler, paths, residues=2)
+
+    [(names, timeout, _)] = executor.calls
+    assert sorted(names) == ["job0_input_prep.pdb", "job1_input_prep.pdb", "job2_input_prep.pdb"]
+    assert timeout == executor.timeout_for(6)
+    assert [run.batch_size for run in results] == [3, 3, 3]
+    # Identical input names are kept apart, and every job gets its own files.
+    assert [repaired(path) for path in paths] == ["repaired a", "repaired b", "repaired c"]
+    assert all((path.parent / STDOUT_NAME).exists() for path in paths)
+    assert not list(tmp_path.glob("foldx-batch-*"))
+    assert scheduler.metrics() == {
+        "window_seconds": 5.0,
+        "max_size": 3,
+        "batches": 1,
+        "batched_jobs": 3,
+        "mean_batch_size": 3.0,
+        "isolated_reruns": 0,
+    }
+
+
+def test_batches_are_cut_at_max_size(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "b", "c", "d", "e"])
+    scheduler = BatchScheduler(executor, window=0.3, max_size=2)
+    results = submit_all(scheduler, paths)
+    assert sorted(len(names) for names, _, _ in executor.calls) == [1, 2, 2]
+    assert sorted(run.batch_size for run in results) == [1, 2, 2, 2, 2]
+    assert scheduler.metrics()["batches"] == 2
+    assert scheduler.metrics()["batched_jobs"] == 4
+
+
+def test_only_the_breaking_structure_fails(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "BREAK", "c", "d"])
+    scheduler = BatchScheduler(executor, window=5.0, max_size=4)
+    results = submit_all(scheduler, paths)
+
+    assert isinstance(results[1], subprocess.CalledProcessError)
+    assert not repaired_paths(paths[1])[0].exists()
+    for i in (0, 2, 3):
+        assert isinstance(results[i], FoldxRun)
+        assert repaired(paths[i]) == f"repaired {'abcd'[i]}"
+    # The jobs the batch never reached, the breaking one among them, ran alone.
+    isolated = [names[0] for names, _, _ in executor.calls[1:]]
+    assert len(isolated) == scheduler.metrics()["isolated_reruns"] >= 1
+    assert all(len(names) == 1 for names, _, _ in executor.calls[1:])
+    assert "input_prep.pdb" in isolated
+
+
+def test_missing_output_after_clean_exit_is_rerun(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "SILENT"])
+    scheduler = BatchScheduler(executor, window=5.0, max_size=2)
+    results = submit_all(scheduler, paths)
+
+    assert [len(names) for names, _, _ in executor.calls] == [2, 1]
+    assert repaired(paths[1]) == "repaired SILENT"
+    assert results[1].batch_size == 1
+    assert results[0].batch_size == 2
+    assert scheduler.metrics()["isolated_reruns"] == 1
+
+
+def test_fixed_residues_never_join_a_batch(executor, tmp_path):
+    paths = make_jobs(tmp_path, ["a", "b"])
+    scheduler = BatchScheduler(executor, window=5.0, max_size=2)
+    results = submit_all(scheduler, paths, fixed_residues="fixed.txt")
+    assert [(len(names), fixed) for names, _, fixed in executor.calls] == [(1, "fixed.txt")] * 2
+    assert [run.batch_size for run in results] == [1, 1]
+    assert scheduler.metrics()["batches"] == 0
@@ -0,0 +1,205 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import foldx_executor
+from foldx_executor import (
+    FOLDX_MEMORY_SHARE,
+    FoldxCancelledError,
+    FoldxExecutor,
+    FoldxMemoryError,
+    FoldxTimeoutError,
+    QueueFullError,
+    default_concurrency,
+    read_cpu_quota,
+    read_memory_limit,
+)
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+@pytest.fixture
+def executor():
+    return FoldxExecutor(max_workers=1, sample_interval=0.05)
+
+
+def test_cancel_kills_running_process(executor, tmp_path):
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    start = time.monotonic()
+    with pytest.raises(FoldxCancelledError) as raised:
+        executor.run(SLEEP, tmp_path, cancel=cancel)
+    assert time.monotonic() - start < 5
+    assert raised.value.run.returncode != 0
+    assert executor.metrics()["running"] == 0
+
+
+def test_cancelled_run_never_starts(executor, tmp_path):
+    cancel = threading.Event()
+    cancel.set()
+    marker = tmp_path / "started"
+    with pytest.raises(FoldxCancelledError):
+        executor.run(["touch", str(marker)], tmp_path, cancel=cancel)
+    assert not marker.exists()
+    assert executor.metrics()["completed"] + executor.metrics()["failed"] == 0
+
+
+def test_run_without_cancel(executor, tmp_path):
+    run = executor.run([sys.executable, "-c", "print('ok')"], tmp_path, stdout=tmp_path / "out")
+    assert run.returncode == 0
+    assert (tmp_path / "out").read_text() == "ok\n"
+
+
+def logged_job(log, name, seconds=0.3):
+    """A command that logs when it starts and ends, to check overlap and order."""
+    script = (
+        "import sys, time\n"
+        "log = open(sys.argv[1], 'a')\n"
+        "log.write(f'start {sys.argv[2]}\\n'); log.flush()\n"
+        f"time.sleep({seconds})\n"
+        "log.write(f'end {sys.argv[2]}\\n')\n"
+    )
+    return [sys.executable, "-c", script, str(log), name]
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def queued(executor):
+    metrics = executor.metrics()
+    return metrics["running"] + metrics["queue_depth"] + metrics["completed"]
+
+
+def test_fifo_queue_within_the_concurrency_limit(tmp_path):
+    executor = FoldxExecutor(max_workers=2, sample_interval=0.02)
+    log = tmp_path / "log"
+    threads = []
+    for i in range(5):
+        # Staggered run times free the slots one at a time.
+        job = logged_job(log, str(i), seconds=0.2 * (i + 1))
+        thread = threading.Thread(target=executor.run, args=(job, tmp_path))
+        thread.start()
+        threads.append(thread)
+        # Queue the next job only once this one holds a slot or a ticket.
+        wait_for(lambda: queued(executor) >= i + 1)
+    for thread in threads:
+        thread.join(30)
+
+    events = log.read_text().split("\n")[:-1]
+    starts = [event for event in events if event.startswith("start")]
+    # The first two start together; the queued ones in arrival order.
+    assert sorted(starts[:2]) == ["start 0", "start 1"]
+    assert starts[2:] == ["start 2", "start 3", "start 4"]
+    running = peak = 0
+    for event in events:
+        running += 1 if event.startswith("start") else -1
+        peak = max(peak, running)
+    assert peak == 2
+    metrics = executor.metrics()
+    assert (metrics["completed"], metrics["running"], metrics["queue_depth"]) == (5, 0, 0)
+    assert metrics["max_wait_seconds"] > 0
+
+
+def test_full_queue_is_rejected(tmp_path):
+    executor = FoldxExecutor(max_workers=1, max_queue=1, sample_interval=0.02)
+    cancel = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            executor.run(SLEEP, tmp_path, cancel=cancel)
+        except FoldxCancelledError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    threads[0].start()
+    wait_for(lambda: executor.metrics()["running"] == 1)
+    threads[1].start()
+    wait_for(lambda: executor.metrics()["queue_depth"] == 1)
+    with pytest.raises(QueueFullError):
+        executor.run(SLEEP, tmp_path)
+    cancel.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(errors) == 2
+
+
+def test_timeout_scales_with_residues():
+    executor = FoldxExecutor(max_workers=1, timeout_base=60.0, timeout_per_residue=2.5)
+    assert executor.timeout_for(None) is None
+    assert executor.timeout_for(0) == 60.0
+    assert executor.timeout_for(200) == 560.0
+
+
+def test_overrunning_process_is_killed(executor, tmp_path):
+    with pytest.raises(FoldxTimeoutError) as raised:
+        executor.run(SLEEP, tmp_path, timeout=0.3)
+    assert raised.value.run.timeout == 0.3
+    assert raised.value.run.run_seconds < 5
+    assert executor.metrics()["timeouts"] == 1
+
+
+def test_process_over_the_rss_limit_is_killed(tmp_path):
+    executor = FoldxExecutor(max_workers=1, rss_limit=64 << 20, sample_interval=0.05)
+    hog = [sys.executable, "-c", "import time; data = bytearray(256 << 20); time.sleep(30)"]
+    with pytest.raises(FoldxMemoryError) as raised:
+        executor.run(hog, tmp_path)
+    assert raised.value.run.peak_rss > 64 << 20
+    assert executor.metrics()["memory_kills"] == 1
+
+
+def write_cgroup(root, files):
+    for name, text in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text + "\n")
+    return root
+
+
+@pytest.mark.parametrize(
+    "files, expected",
+    [
+        ({"cpu.max": "200000 100000"}, 2.0),
+        ({"cpu.max": "150000"}, 1.5),
+        ({"cpu.max": "max 100000"}, None),
+        ({"cpu/cpu.cfs_quota_us": "50000", "cpu/cpu.cfs_period_us": "100000"}, 0.5),
+        ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, None),
+        ({}, None),
+    ],
+)
+def test_read_cpu_quota(tmp_path, files, expected):
+    assert read_cpu_quota(write_cgroup(tmp_path, files)) == expected
+
+
+@pytest.mark.parametrize(
+    "files, expected",
+    [
+        ({"memory.max": "1073741824"}, 1 << 30),
+        ({"memory.max": "max"}, None),
+        ({"memory/memory.limit_in_bytes": "536870912"}, 1 << 29),
+        ({"memory/memory.limit_in_bytes": "9223372036854771712"}, None),
+        ({}, None),
+    ],
+)
+def test_read_memory_limit(tmp_path, files, expected):
+    assert read_memory_limit(write_cgroup(tmp_path, files)) == expected
+
+
+def test_limits_size_the_executor(tmp_path, monkeypatch):
+    root = write_cgroup(tmp_path, {"cpu.max": "400000 100000", "memory.max": str(1 << 30)})
+    monkeypatch.setattr(foldx_executor, "read_cpu_quota", lambda: read_cpu_quota(root))
+    monkeypatch.setattr(foldx_executor, "read_memory_limit", lambda: read_memory_limit(root))
+    for name in ("FOLDX_MAX_CONCURRENCY", "FOLDX_RSS_LIMIT", "FOLDX_JOB_MEMORY"):
+        monkeypatch.delenv(name, raising=False)
+
+    # Four cores, but only two 512 MiB jobs fit into 1 GiB.
+    assert default_concurrency(4.0, 1 << 30) == 2
+    executor = FoldxExecutor.from_environment()
+    assert executor.max_workers == 2
+    assert executor.rss_limit == int((1 << 30) * FOLDX_MEMORY_SHARE // 2)
@@ -0,0 +1,158 @@
+import pytest
+
+import foldx_progress
+from foldx_progress import (
+    MOVING,
+    OPTIMIZING,
+    RepairProgress,
+    normalise_label,
+    read_repair_energies,
+    residue_labels,
+)
+
+
+def test_read_repair_energies(repo_dir):
+    assert read_repair_energies(repo_dir / "example_prep_Repair.fxout") == (10.5361, -5.20016)
+
+
+def test_read_repair_energies_without_rows(tmp_path):
+    assert read_repair_energies(tmp_path / "missing.fxout") == (None, None)
+    fxout = tmp_path / "empty.fxout"
+    fxout.write_text("/work/input_prep.pdb\nNow Optimizing Residues\n")
+    assert read_repair_energies(fxout) == (None, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(foldx_progress, "time", clock)
+    return clock
+
+
+class Run:
+    """A RepairProgress over fxout/stdout files the test appends to."""
+
+    def __init__(self, tmp_path):
+        self.fxout_path = tmp_path / "input_prep_Repair.fxout"
+        self.stdout_path = tmp_path / "stdout.txt"
+        self.fxout_path.write_text("/work/input_prep.pdb\nStarting Structure\t10.5\t-166.6\n")
+        self.stdout_path.write_text("")
+        self.snapshots = []
+        self.progress = RepairProgress(
+            self.fxout_path, self.stdout_path, LABELS, self.snapshots.append, min_interval=5.0
+        )
+
+    def fxout(self, text):
+        with self.fxout_path.open("a") as handle:
+            handle.write(text)
+
+    def stdout(self, text):
+        with self.stdout_path.open("a") as handle:
+            handle.write(text)
+
+    def poll(self):
+        self.progress.poll()
+
+
+@pytest.fixture
+def run(tmp_path, clock):
+    return Run(tmp_path)
+
+
+LABELS = ["GLUA1", "LYSA2", "HISA3", "TYRA4"]
+
+
+def rows(*labels):
+    return "".join(f"{label}\t10.4\t-166.6\n" for label in labels)
+
+
+def test_normalise_label():
+    assert normalise_label("H2SA9") == "HISA9"
+    assert normalise_label("H1SB98") == "HISB98"
+    assert normalise_label("HISA9") == "HISA9"
+    assert normalise_label("GLUA1") == "GLUA1"
+
+
+def test_protonated_histidines_count(run):
+    run.fxout("Now Optimizing Residues\n" + rows("GLUA1", "LYSA2", "H2SA3"))
+    run.poll()
+    assert run.snapshots[-1].residues_done == 3
+    assert run.snapshots[-1].phase == OPTIMIZING
+
+
+def test_reports_are_throttled(run, clock):
+    run.fxout("Now Optimizing Residues\n" + rows("GLUA1"))
+    run.poll()
+    clock.now = 1.0
+    run.fxout(rows("LYSA2"))
+    run.poll()
+    assert [s.residues_done for s in run.snapshots] == [1]
+    clock.now = 6.0
+    run.poll()
+    assert [s.residues_done for s in run.snapshots] == [1, 2]
+    # Nothing new: no report however long it has been.
+    clock.now = 60.0
+    run.poll()
+    assert len(run.snapshots) == 2
+    assert run.snapshots[-1].as_dict()["message"] == "Optimising residues: 50% (2/4), ETA 6s"
+
+
+def test_progress_never_goes_back(run, clock):
+    run.fxout("Now Optimizing Residues\n" + rows("GLUA1", "LYSA2", "HISA3", "LYSA2"))
+    run.poll()
+    assert run.progress.residues_done == 3
+    run.fxout("GLUA1\t10.")
+    run.poll()
+    assert run.progress.residues_done == 3
+
+
+def test_stdout_phase_does_not_relabel_fxout_rows(run, clock):
+    # stdout has moved on while the last optimised rows are still unread.
+    run.stdout("Now Optimizing Residues\nNow moving residues with bad energies\n")
+    run.fxout("Now Optimizing Residues\n" + rows("GLUA1", "LYSA2", "HISA3", "TYRA4"))
+    run.poll()
+    snapshot = run.snapshots[-1]
+    assert (snapshot.phase, snapshot.residues_done, snapshot.residues_revisited) == (MOVING, 4, 0)
+    clock.now = 10.0
+    run.fxout("Now moving residues with bad energies \n" + rows("GLUA1", "H1SA3"))
+    run.poll()
+    assert run.snapshots[-1].residues_revisited == 2
+    assert run.snapshots[-1].eta_seconds is None
+
+
+def test_partial_rows_wait_for_their_newline(run):
+    run.fxout("Now Optimizing Residues\nGLUA1\t10.4")
+    run.poll()
+    assert run.progress.residues_done == 0
+    run.fxout("\t-166.6\n")
+    run.poll()
+    assert run.progress.residues_done == 1
+
+
+def test_failing_callback_is_logged(tmp_path, caplog):
+    def fail(snapshot):
+        raise RuntimeError("report closed")
+
+    fxout = tmp_path / "input_prep_Repair.fxout"
+    fxout.write_text("Now Optimizing Residues\n" + rows("GLUA1"))
+    RepairProgress(fxout, None, LABELS, fail).poll()
+    assert "Failed to report FoldX progress" in caplog.text
+
+
+def test_example_fxout(repo_dir, tmp_path, clock):
+    labels = residue_labels(repo_dir / "example_prep.pdb")
+    assert labels[8] == "HISA9"
+    snapshots = []
+    progress = RepairProgress(repo_dir / "example_prep_Repair.fxout", None, labels, snapshots.append)
+    progress.poll()
+    [snapshot] = snapshots
+    assert (snapshot.phase, snapshot.residues_done, snapshot.residues_total) == (MOVING, 208, 208)
+    assert snapshot.residues_revisited == 160
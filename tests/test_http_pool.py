@@ -0,0 +1,74 @@
+import httpx
+import pytest
+
+from http_pool import TransferPool
+
+
+class FakeIvcapClient:
+    """The configuration an IVCAP API client keeps for its httpx client."""
+
+    def __init__(self, timeout=None, verify_ssl=True, **httpx_args):
+        self._timeout = timeout
+        self._verify_ssl = verify_ssl
+        self._httpx_args = httpx_args
+        self.client = httpx.Client(headers={"Authorization": "Bearer job"}, timeout=timeout)
+
+    def get_httpx_client(self):
+        return self.client
+
+
+@pytest.fixture
+def pool():
+    pool = TransferPool(max_connections=2)
+    yield pool
+    pool.close()
+
+
+def test_counts_transfers_in_flight(pool, http_server):
+    http_server.files["/a.bin"] = b"x" * 1000
+    client = pool.client_for(FakeIvcapClient())
+    with client.stream("GET", f"{http_server.url}/a.bin") as first:
+        with client.stream("GET", f"{http_server.url}/a.bin"):
+            assert pool.metrics()["active"] == 2
+        assert pool.metrics()["active"] == 1
+        first.read()
+        assert pool.metrics()["active"] == 0
+    client.get(f"{http_server.url}/a.bin")
+    metrics = pool.metrics()
+    assert (metrics["active"], metrics["peak_active"], metrics["requests"]) == (0, 2, 3)
+    assert metrics["saturated_requests"] == 0
+
+
+def test_failed_request_is_not_left_in_flight(pool):
+    client = pool.client_for(FakeIvcapClient())
+    with pytest.raises(httpx.ConnectError):
+        client.get("http://127.0.0.1:1/missing")
+    assert pool.metrics()["active"] == 0
+
+
+def test_client_keeps_the_job_configuration(pool):
+    auth = httpx.BasicAuth("job", "secret")
+    source = FakeIvcapClient(timeout=httpx.Timeout(5.0), params={"a": "1"}, auth=auth)
+    client = pool.client_for(source)
+    assert client is pool.client_for(source)
+    assert client.headers["Authorization"] == "Bearer job"
+    assert client.timeout == httpx.Timeout(5.0)
+    assert client.params["a"] == "1"
+    assert client.auth is auth
+    assert client._transport is pool.transport
+
+
+def test_default_timeout_is_the_pools(pool):
+    assert pool.client_for(FakeIvcapClient()).timeout == pool.timeout
+
+
+def test_tls_settings_get_their_own_transport(pool):
+    insecure = pool.client_for(FakeIvcapClient(verify_ssl=False))
+    other = pool.client_for(FakeIvcapClient(verify_ssl=False))
+    assert insecure._transport is not pool.transport
+    assert other._transport is insecure._transport
+
+
+def test_client_with_own_transport_is_not_pooled(pool):
+    source = FakeIvcapClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    assert pool.client_for(source) is source.client
@@ -0,0 +1,200 @@
+import numpy as np
+import pytest
+
+from mmcif import (
+    BINARY_CIF,
+    MAX_SERIAL,
+    MMCIF,
+    PDB,
+    AtomSiteWriter,
+    StructureTranscoder,
+    decode_bcif_data,
+    detect_structure_format,
+    format_atom_name,
+    hybrid36_serial,
+    to_pdb_bytes,
+)
+
+MMCIF_DOCUMENT = b"""data_TEST
+#
+_entry.id TEST
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_alt_id
+_atom_site.label_comp_id
+_atom_site.label_asym_id
+_atom_site.label_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.occupancy
+_atom_site.B_iso_or_equiv
+_atom_site.auth_seq_id
+_atom_site.auth_asym_id
+_atom_site.pdbx_PDB_model_num
+ATOM   1 N  N   . MET X 1 ? 11.104 6.134 -6.504 1.00 10.00 5 A 1
+ATOM   2 C  CA  . MET X 1 ? 11.639 6.071 -5.147 1.00 10.00 5 A 1
+HETATM 3 ZN ZN  . ZN  Y . ? 1.000  2.000 3.000  0.50 20.00 9 B 1
+ATOM   4 C  "C1'" . MET X 1 ? 0 0 0 1 0 5 A 2
+#
+loop_
+_atom_type.symbol
+N
+"""
+
+EXPECTED = (
+    b"ATOM      1  N   MET A   5      11.104   6.134  -6.504  1.00 10.00           N\n"
+    b"ATOM      2  CA  MET A   5      11.639   6.071  -5.147  1.00 10.00           C\n"
+    b"TER\n"
+    b"HETATM    3 ZN    ZN B   9       1.000   2.000   3.000  0.50 20.00          ZN\n"
+    b"TER\n"
+)
+
+ATOM_SITE = {
+    "group_PDB": ["ATOM", "ATOM"],
+    "label_atom_id": ["N", "CA"],
+    "label_comp_id": ["MET", "MET"],
+    "label_asym_id": ["X", "X"],
+    "auth_asym_id": ["A", "A"],
+    "auth_seq_id": ["5", "5"],
+    "Cartn_x": ["11.104", "11.639"],
+    "Cartn_y": ["6.134", "6.071"],
+    "Cartn_z": ["-6.504", "-5.147"],
+    "occupancy": ["1.00", "1.00"],
+    "B_iso_or_equiv": ["10.00", "10.00"],
+    "type_symbol": ["N", "C"],
+}
+
+
+def transcode_in_chunks(data: bytes, chunk_size: int):
+    transcoder = StructureTranscoder()
+    out = [transcoder.feed(data[i : i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(transcoder.finish())
+    return b"".join(out), transcoder.format
+
+
+def byte_array(values, dtype: str, kind_type: int):
+    return np.asarray(values, dtype=dtype).tobytes(), {"kind": "ByteArray", "type": kind_type}
+
+
+@pytest.mark.parametrize(
+    "head, expected",
+    [
+        (b"ATOM      1  N   MET A   1", PDB),
+        (b"# comment\n\ndata_1ABC\n", MMCIF),
+        (b"\x83\xa7version", BINARY_CIF),
+        (b"", PDB),
+    ],
+)
+def test_detect_structure_format(head, expected):
+    assert detect_structure_format(head) == expected
+
+
+def test_atom_name_alignment():
+    assert format_atom_name("CA", "C") == " CA "
+    assert format_atom_name("ZN", "ZN") == "ZN  "
+    assert format_atom_name("HD21", "H") == "HD21"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_mmcif_keeps_first_model_with_author_ids(chunk_size):
+    assert transcode_in_chunks(MMCIF_DOCUMENT, chunk_size) == (EXPECTED, MMCIF)
+
+
+def test_pdb_passes_through_unchanged():
+    pdb = EXPECTED * 100
+    assert transcode_in_chunks(pdb, 100) == (pdb, PDB)
+
+
+def test_mmcif_without_atom_site_is_rejected():
+    with pytest.raises(ValueError):
+        to_pdb_bytes(b"data_EMPTY\n_entry.id EMPTY\n")
+
+
+def test_residue_number_must_fit_pdb_columns():
+    with pytest.raises(ValueError):
+        to_pdb_bytes(MMCIF_DOCUMENT.replace(b" 5 A 1\n", b" 12345 A 1\n", 1))
+
+
+@pytest.mark.parametrize(
+    "serial, expected",
+    [
+        (1, "    1"),
+        (99999, "99999"),
+        (100000, "A0000"),
+        (100001, "A0001"),
+        (100035, "A000Z"),
+        (100036, "A0010"),
+        (99999 + 26 * 36**4, "ZZZZZ"),
+        (100000 + 26 * 36**4, "a0000"),
+        (MAX_SERIAL, "zzzzz"),
+    ],
+)
+def test_hybrid36_serial(serial, expected):
+    assert hybrid36_serial(serial) == expected
+
+
+def test_serial_past_hybrid36_is_rejected():
+    with pytest.raises(ValueError):
+        hybrid36_serial(MAX_SERIAL + 1)
+
+
+def test_large_structures_never_repeat_a_serial():
+    writer = AtomSiteWriter()
+    atoms = 100_050
+    lines = [
+        writer.write("ATOM", "CA", "", "GLY", "A", "1", "", 0.0, 0.0, 0.0, 1.0, 0.0, "C", "1")
+        for _ in range(atoms)
+    ]
+    serials = [line[6:11] for line in lines]
+    assert len(set(serials)) == atoms
+    assert serials[0] == "    1"
+    assert serials[99998:100001] == ["99999", "A0000", "A0001"]
+    assert all(len(line) == len(lines[0]) for line in lines)
+
+
+def test_binary_cif_matches_text(bcif_document):
+    assert to_pdb_bytes(bcif_document(ATOM_SITE)) == EXPECTED[: EXPECTED.index(b"HETATM")]
+
+
+def test_binary_cif_needs_atom_site(bcif_document):
+    columns = {"id": ["TEST"]}
+    document = bcif_document(columns).replace(b"_atom_site", b"_entry.id_")
+    with pytest.raises(ValueError):
+        to_pdb_bytes(document)
+
+
+def test_decode_delta_run_length():
+    data, array = byte_array([1, 3, 2, 2], "<i4", 3)
+    encoded = {
+        "data": data,
+        "encoding": [
+            {"kind": "Delta", "origin": 10, "srcType": 3},
+            {"kind": "RunLength", "srcType": 3, "srcSize": 5},
+            array,
+        ],
+    }
+    assert decode_bcif_data(encoded).tolist() == [11, 12, 13, 15, 17]
+
+
+def test_decode_integer_packing_continues_at_bounds():
+    data, array = byte_array([127, 3, -128, -1, 5], "<i1", 1)
+    packing = {"kind": "IntegerPacking", "byteCount": 1, "isUnsigned": False, "srcSize": 3}
+    assert decode_bcif_data({"data": data, "encoding": [packing, array]}).tolist() == [130, -129, 5]
+
+
+def test_decode_fixed_point():
+    data, array = byte_array([11104, -6504], "<i4", 3)
+    fixed = {"kind": "FixedPoint", "factor": 1000, "srcType": 33}
+    decoded = decode_bcif_data({"data": data, "encoding": [fixed, array]})
+    assert decoded.tolist() == [11.104, -6.504]
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        decode_bcif_data({"data": b"", "encoding": [{"kind": "Quantum"}]})
@@ -0,0 +1,111 @@
+import hashlib
+
+import pytest
+
+from pdb_prep import (
+    DEFAULT_RENAME_TABLE,
+    RenameTable,
+    StreamingPreparer,
+    prepare_pdb_bytes,
+    prepare_pdb_file,
+)
+
+ATOM = b"ATOM      1  N   HIE B   1      11.104   6.134  -6.504  1.00  0.00           N\n"
+TAIL = b"ATOM      2  CA  GLY C   2      11.639   6.071  -5.147  1.00  0.00           C\n"
+
+
+def prepare_in_chunks(data: bytes, chunk_size: int, block_size: int = 1 << 20) -> bytes:
+    preparer = StreamingPreparer(DEFAULT_RENAME_TABLE, block_size)
+    out = [preparer.feed(data[i : i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(preparer.finish())
+    return b"".join(out)
+
+
+@pytest.fixture(scope="module")
+def example(repo_dir):
+    return (repo_dir / "example.pdb").read_bytes()
+
+
+@pytest.fixture(scope="module")
+def expected(repo_dir):
+    return (repo_dir / "example_prep.pdb").read_bytes()
+
+
+def test_prepare_file_matches_reference(repo_dir, tmp_path, expected):
+    target = tmp_path / "example_prep.pdb"
+    stats = prepare_pdb_file(repo_dir / "example.pdb", target)
+    assert target.read_bytes() == expected
+    assert stats.terminated
+    assert stats.atom_records == expected.count(b"\nATOM") + expected.startswith(b"ATOM")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 7, 81, 82, 4096, 1 << 20])
+@pytest.mark.parametrize("block_size", [0, 1, 1000, 1 << 20])
+def test_chunk_sizes_give_identical_output(example, expected, chunk_size, block_size):
+    assert prepare_in_chunks(example, chunk_size, block_size) == expected
+
+
+def test_digest_covers_output(example, expected):
+    preparer = StreamingPreparer(block_size=0)
+    for i in range(0, len(example), 100):
+        preparer.feed(example[i : i + 100])
+    preparer.finish()
+    assert preparer.content_sha256 == hashlib.sha256(expected).hexdigest()
+
+
+def test_truncates_at_first_ter():
+    prepared, stats = prepare_pdb_bytes(ATOM + b"TER     2      HIE B   1\n" + TAIL + b"END\n")
+    assert prepared == ATOM.replace(b"HIE B", b"HIS A") + b"TER\n"
+    assert stats.terminated
+    assert stats.atom_records == 1
+    assert stats.renamed == {"HIE": 1}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5])
+def test_ter_split_across_chunks(chunk_size):
+    data = ATOM + b"TER\n" + TAIL
+    assert prepare_in_chunks(data, chunk_size, block_size=0) == (
+        ATOM.replace(b"HIE B", b"HIS A") + b"TER\n"
+    )
+
+
+def test_ter_as_first_record():
+    prepared, stats = prepare_pdb_bytes(b"TER\n" + ATOM)
+    assert prepared == b"TER\n"
+    assert stats.atom_records == 0
+
+
+def test_input_after_ter_is_ignored():
+    preparer = StreamingPreparer(block_size=0)
+    assert preparer.feed(ATOM + b"TER\n").endswith(b"TER\n")
+    assert preparer.done
+    assert preparer.feed(TAIL) == b""
+    assert preparer.finish() == b""
+
+
+def test_without_ter_keeps_trailing_line():
+    last = TAIL.rstrip(b"\n")
+    prepared, stats = prepare_pdb_bytes(ATOM + last)
+    assert prepared == ATOM.replace(b"HIE B", b"HIS A") + last.replace(b"C   2", b"A   2")
+    assert not stats.terminated
+    assert stats.atom_records == 2
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 81, 82, 1000])
+def test_crlf_line_endings(chunk_size):
+    data = (ATOM + TAIL + b"TER\n").replace(b"\n", b"\r\n")
+    expected = ATOM.replace(b"HIE B", b"HIS A") + TAIL.replace(b"C   2", b"A   2") + b"TER\n"
+    assert prepare_in_chunks(data, chunk_size, block_size=0) == expected
+
+
+def test_residue_rename_overrides():
+    table = DEFAULT_RENAME_TABLE.extend({"GLY": "ALA"})
+    prepared, stats = prepare_pdb_bytes(ATOM + TAIL, table)
+    assert b"ALA A   2" in prepared
+    assert stats.renamed == {"HIE": 1, "GLY": 1}
+
+
+@pytest.mark.parametrize("renames", [{"HISE": "HIS"}, {"HIS": "HS"}, {"HIÉ": "HIS"}])
+def test_rename_table_rejects_bad_names(renames):
+    with pytest.raises(ValueError):
+        RenameTable(renames)
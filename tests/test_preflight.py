@@ -0,0 +1,72 @@
+import pytest
+
+from preflight import MAX_TRUNCATED_FRACTION, PreflightError, check_pdb_file, scan_pdb_bytes
+
+
+@pytest.fixture(scope="module")
+def lines(repo_dir):
+    return (repo_dir / "example_prep.pdb").read_bytes().splitlines(keepends=True)
+
+
+def atom_indices(lines):
+    return [i for i, line in enumerate(lines) if line.startswith(b"ATOM")]
+
+
+def truncate(lines, indices):
+    return [line[:40] + b"\n" if i in indices else line for i, line in enumerate(lines)]
+
+
+def test_example_passes(repo_dir, lines):
+    report = check_pdb_file(repo_dir / "example_prep.pdb")
+    assert report.ok
+    assert (report.residues, report.standard_residues) == (208, 208)
+    assert report.atom_records == len(atom_indices(lines))
+    assert (report.truncated_lines, report.incomplete_backbone) == (0, 0)
+
+
+@pytest.mark.parametrize("data", [b"", b"HEADER    EMPTY\nEND\n"])
+def test_empty_structure(data):
+    report = scan_pdb_bytes(data)
+    assert report.errors == ["no ATOM/HETATM records"]
+
+
+def test_no_protein_residues():
+    data = b"HETATM    1 ZN    ZN B   9      20.000   0.000   0.000  1.00  0.00          ZN\n"
+    report = scan_pdb_bytes(data)
+    assert report.errors == ["no standard amino-acid residues"]
+    assert report.nonstandard_residues == {"ZN": 1}
+
+
+def test_a_few_truncated_records_are_dropped(lines, tmp_path):
+    atoms = atom_indices(lines)
+    bad = {atoms[5], atoms[100]}
+    path = tmp_path / "input_prep.pdb"
+    path.write_bytes(b"".join(truncate(lines, bad)))
+
+    report = check_pdb_file(path)
+    assert report.ok
+    assert report.truncated_lines == 2
+    assert report.truncated_line_numbers == sorted(i + 1 for i in bad)
+    assert path.read_bytes() == b"".join(line for i, line in enumerate(lines) if i not in bad)
+    assert check_pdb_file(path).truncated_lines == 0
+
+
+def test_many_truncated_records_are_rejected(lines, tmp_path):
+    atoms = atom_indices(lines)
+    bad = set(atoms[: int(len(atoms) * MAX_TRUNCATED_FRACTION) + 1])
+    path = tmp_path / "input_prep.pdb"
+    data = b"".join(truncate(lines, bad))
+    path.write_bytes(data)
+
+    with pytest.raises(PreflightError) as error:
+        check_pdb_file(path)
+    assert error.value.report.truncated_lines == len(bad)
+    assert "truncated" in str(error.value)
+    assert path.read_bytes() == data
+
+
+def test_missing_backbone_everywhere_is_rejected(lines):
+    kept = [line for line in lines if not line.startswith(b"ATOM") or line[12:16].strip() != b"CA"]
+    report = scan_pdb_bytes(b"".join(kept))
+    assert report.incomplete_backbone == report.standard_residues == 208
+    assert report.errors == ["no amino-acid residue has a complete N/CA/C/O backbone"]
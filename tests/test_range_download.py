@@ -0,0 +1,129 @@
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from download_retry import RetryBudget
+from range_download import RangeDownloader, range_length
+
+ATOM_SITE = {
+    "group_PDB": ["ATOM", "ATOM", "ATOM"],
+    "label_atom_id": ["N", "CA", "C"],
+    "label_comp_id": ["HIE", "HIE", "HIE"],
+    "auth_asym_id": ["B", "B", "B"],
+    "auth_seq_id": ["1", "1", "1"],
+    "Cartn_x": ["11.104", "11.639", "13.149"],
+    "Cartn_y": ["6.134", "6.071", "6.186"],
+    "Cartn_z": ["-6.504", "-5.147", "-5.192"],
+    "type_symbol": ["N", "C", "C"],
+}
+
+
+def no_sleep(delay):
+    pass
+
+
+class FakeArtifact:
+    """An artifact whose data is served by the ``http_server`` fixture."""
+
+    def __init__(self, server, name: str):
+        self.id = f"urn:ivcap:artifact:{name}"
+        self.name = name
+        self.size = None
+        self._data_href = f"{server.url}/{name}"
+        # The pool keys its clients on this one, so it must outlive the download.
+        self.client = httpx.Client()
+        self._ivcap = SimpleNamespace(
+            _client=SimpleNamespace(get_httpx_client=lambda: self.client)
+        )
+
+
+def ranged_gets(server):
+    return [request for request in server.requests if request[0] == "GET" and request[2]]
+
+
+def test_parts_cover_the_whole_length():
+    assert RangeDownloader(part_bytes=10).parts(25) == [(0, 9), (10, 19), (20, 24)]
+
+
+def test_range_length_needs_accept_ranges():
+    assert range_length(httpx.Headers({"Accept-Ranges": "bytes", "Content-Length": "42"})) == 42
+    assert range_length(httpx.Headers({"Content-Length": "42"})) is None
+
+
+def test_applies_to_large_resources_only():
+    downloader = RangeDownloader(workers=4, min_bytes=100)
+    assert downloader.applies(100)
+    assert not downloader.applies(99)
+    assert not downloader.applies(None)
+    assert not RangeDownloader(workers=1, min_bytes=0).applies(100)
+
+
+def test_download_writes_every_part(http_server, tmp_path):
+    data = os.urandom(300_000)
+    http_server.files["/big.bin"] = data
+    downloader = RangeDownloader(workers=4, part_bytes=1 << 16, min_bytes=0)
+    target = tmp_path / "big.bin"
+    with httpx.Client() as client:
+        stats = downloader.download(
+            client, f"{http_server.url}/big.bin", target, len(data), RetryBudget(sleep=no_sleep)
+        )
+    assert target.read_bytes() == data
+    assert (stats.parts, stats.workers, stats.retries) == (5, 4, 0)
+    assert len(ranged_gets(http_server)) == 5
+
+
+@pytest.fixture
+def ranged(tool_service, monkeypatch):
+    monkeypatch.setattr(tool_service, "download_cache", None)
+    monkeypatch.setattr(
+        tool_service, "range_downloader", RangeDownloader(workers=4, part_bytes=1024, min_bytes=0)
+    )
+    return tool_service
+
+
+def test_raw_input_is_downloaded_in_ranges(ranged, http_server, repo_dir, tmp_path):
+    data = (repo_dir / "example.pdb").read_bytes()
+    http_server.files["/example.pdb"] = data
+    raw_path = tmp_path / "example.pdb"
+    prep_path = tmp_path / "example_prep.pdb"
+    stats = ranged.download_and_prepare_artifact(
+        FakeArtifact(http_server, "example.pdb"),
+        prep_path,
+        ranged.StreamingPreparer(),
+        raw_path=raw_path,
+        retries=RetryBudget(sleep=no_sleep),
+    )
+    assert raw_path.read_bytes() == data
+    assert prep_path.read_bytes() == (repo_dir / "example_prep.pdb").read_bytes()
+    assert stats.ranges == len(ranged_gets(http_server)) > 1
+
+
+def test_prep_stream_stops_at_ter(ranged, http_server, repo_dir, tmp_path):
+    http_server.files["/example.pdb"] = (repo_dir / "example.pdb").read_bytes()
+    stats = ranged.download_and_prepare_artifact(
+        FakeArtifact(http_server, "example.pdb"),
+        tmp_path / "example_prep.pdb",
+        ranged.StreamingPreparer(),
+        retries=RetryBudget(sleep=no_sleep),
+    )
+    assert stats.ranges == 0
+    assert not ranged_gets(http_server)
+
+
+def test_binary_cif_is_downloaded_whole(ranged, http_server, bcif_document, tmp_path):
+    http_server.files["/model.bcif"] = bcif_document(ATOM_SITE)
+    prep_path = tmp_path / "model_prep.pdb"
+    stats = ranged.download_and_prepare_artifact(
+        FakeArtifact(http_server, "model.bcif"),
+        prep_path,
+        ranged.StreamingPreparer(),
+        retries=RetryBudget(sleep=no_sleep),
+    )
+    assert stats.structure_format == "bcif"
+    assert stats.ranges == len(ranged_gets(http_server)) > 1
+    lines = prep_path.read_bytes().splitlines()
+    assert [line[17:22] for line in lines[:3]] == [b"HIS A"] * 3
+    assert lines[-1] == b"TER"
+    assert list(tmp_path.iterdir()) == [prep_path]
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import pytest
+
+from foldx_executor import FoldxRun
+
+FXOUT_HEADER = "/work/input_prep.pdb\n"
+
+
+class FakeRepair:
+    """
+    Stands in for run_foldx_repair: each pass writes ``input_prep_Repair.pdb``
+    and an fxout whose total energy falls from ``start`` to the next value of
+    ``energies``. ``None`` writes an fxout without energy rows.
+    """
+
+    def __init__(self, start, energies):
+        self.energy = start
+        self.energies = list(energies)
+        self.inputs = []
+
+    def __call__(self, prep_path, foldx_binary, residues=None, on_progress=None, fixed_residues=None):
+        self.inputs.append(prep_path.read_text())
+        repaired = prep_path.with_name(f"{prep_path.stem}_Repair.pdb")
+        repaired.write_text(f"pass {len(self.inputs)}\n")
+        energy = self.energies.pop(0)
+        rows = FXOUT_HEADER
+        if energy is not None:
+            rows += f"Starting Structure\t{self.energy}\t-166.6\n"
+            rows += "Now Optimizing Residues\n"
+            rows += f"GLUA1\t{energy}\t-166.6\n"
+            self.energy = energy
+        repaired.with_suffix(".fxout").write_text(rows)
+        return repaired, FoldxRun(returncode=0, run_seconds=1.0, wait_seconds=0.5)
+
+
+@pytest.fixture
+def repair(tool_service, tmp_path, monkeypatch):
+    prep_path = tmp_path / "input_prep.pdb"
+
+    def run(start, energies, **options):
+        prep_path.write_text("pass 0\n")
+        fake = FakeRepair(start, energies)
+        monkeypatch.setattr(tool_service, "run_foldx_repair", fake)
+        req = tool_service.Request(pdb_artifact="urn:ivcap:artifact:input", **options)
+        report = SimpleNamespace(custom=lambda *args: None, step_finished=lambda *args: None)
+        return fake, tool_service.run_repair_passes(req, prep_path, tmp_path / "foldx", 200, report)
+
+    return run
+
+
+def test_single_pass(repair):
+    fake, (repaired_path, _, passes, converged) = repair(10.0, [-5.0])
+    assert len(fake.inputs) == 1
+    assert [(p.start_energy, p.energy) for p in passes] == [(10.0, -5.0)]
+    assert converged is None
+    assert repaired_path.read_text() == "pass 1\n"
+
+
+def test_stops_once_the_improvement_is_below_the_tolerance(repair):
+    fake, (repaired_path, run, passes, converged) = repair(
+        10.0, [-5.0, -5.5, -5.52, -9.0], max_passes=4, energy_tolerance=0.05
+    )
+    assert converged is True
+    assert [p.number for p in passes] == [1, 2, 3]
+    assert [round(p.improvement, 2) for p in passes] == [15.0, 0.5, 0.02]
+    # Every pass repairs the output of the one before it.
+    assert fake.inputs == ["pass 0\n", "pass 1\n", "pass 2\n"]
+    assert repaired_path.read_text() == "pass 3\n"
+    assert (passes[-1].foldx_seconds, passes[-1].queue_wait_seconds) == (1.0, 0.5)
+
+
+def test_stops_at_the_pass_cap(repair):
+    fake, (_, _, passes, converged) = repair(10.0, [8.0, 6.0, 4.0], max_passes=3)
+    assert converged is False
+    assert len(passes) == len(fake.inputs) == 3
+    assert passes[-1].energy == 4.0
+
+
+def test_stops_when_the_fxout_has_no_energy(repair):
+    fake, (_, _, passes, converged) = repair(10.0, [None, 6.0], max_passes=3)
+    assert len(fake.inputs) == 1
+    assert (passes[0].improvement, converged) == (None, None)
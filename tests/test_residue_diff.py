@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from clash_scan import NEIGHBOR_RADIUS, load_structure_atoms
+from residue_diff import diff_structures
+
+RESIDUE = 10
+
+
+def edit_residue(lines, resseq, edit):
+    """Applies ``edit`` to the ATOM lines of residue ``resseq`` (None drops them)."""
+    out = []
+    for line in lines:
+        if line.startswith(b"ATOM") and int(line[22:26]) == resseq:
+            line = edit(line)
+            if line is None:
+                continue
+        out.append(line)
+    return out
+
+
+def shift_x(line, delta):
+    return line[:30] + b"%8.3f" % (float(line[30:38]) + delta) + line[38:]
+
+
+def neighbours(structure, residues):
+    """Brute force: residues with an atom within NEIGHBOR_RADIUS of ``residues``."""
+    selected = structure.coords[np.isin(structure.residue_index, residues)]
+    dist = np.linalg.norm(structure.coords[:, None] - selected[None], axis=-1)
+    return set(np.unique(structure.residue_index[(dist <= NEIGHBOR_RADIUS).any(axis=1)]).tolist())
+
+
+@pytest.fixture(scope="module")
+def lines(repo_dir):
+    return (repo_dir / "example_prep.pdb").read_bytes().splitlines(keepends=True)
+
+
+@pytest.fixture
+def diff(lines, tmp_path):
+    parent_path = tmp_path / "parent.pdb"
+    parent_path.write_bytes(b"".join(lines))
+    parent = load_structure_atoms(parent_path)
+
+    def run(edited):
+        path = tmp_path / "design.pdb"
+        path.write_bytes(b"".join(edited))
+        structure = load_structure_atoms(path)
+        report, repair = diff_structures(structure, parent)
+        return structure, report, repair
+
+    return run
+
+
+def test_identical_structures(diff, lines):
+    structure, report, repair = diff(lines)
+    assert (report.changed_residues, report.removed_atoms, report.repaired_residues) == (0, 0, 0)
+    assert report.skipped_residues == structure.residues
+    assert not repair.any()
+
+
+def test_mutation_repairs_its_neighbourhood(diff, lines):
+    structure, report, repair = diff(
+        edit_residue(lines, RESIDUE, lambda line: line[:17] + b"ALA" + line[20:])
+    )
+    changed = RESIDUE - 1
+    assert report.changed_residues == 1
+    assert report.changed_residue_labels == [structure.residue_label(changed)]
+    assert set(np.flatnonzero(repair).tolist()) == neighbours(structure, [changed])
+    assert 1 < report.repaired_residues < structure.residues
+
+
+def test_rounding_noise_is_not_a_move(diff, lines):
+    _, report, _ = diff(edit_residue(lines, RESIDUE, lambda line: shift_x(line, 0.01)))
+    assert report.changed_residues == 0
+
+
+def test_moved_atoms_change_their_residue(diff, lines):
+    structure, report, repair = diff(edit_residue(lines, RESIDUE, lambda line: shift_x(line, 0.5)))
+    assert report.changed_residues == 1
+    assert set(np.flatnonzero(repair).tolist()) == neighbours(structure, [RESIDUE - 1])
+
+
+def test_deleted_residue_repairs_what_was_around_it(diff, lines):
+    structure, report, repair = diff(edit_residue(lines, RESIDUE, lambda line: None))
+    assert report.removed_atoms > 0
+    assert report.residues == report.parent_residues - 1
+    # The residues either side were bonded to the deleted one.
+    assert repair[RESIDUE - 2] and repair[RESIDUE - 1]
+    assert report.repaired_residues < structure.residues
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from repair_cache import CACHE_SCHEMA
+
+INPUT_URN = "urn:ivcap:artifact:input"
+REPAIRED_URN = "urn:ivcap:artifact:repaired"
+
+
+class ArtifactFetched(Exception):
+    pass
+
+
+class FakeIvcap:
+    def __init__(self, aspects):
+        self.aspects = aspects
+        self.fetched = []
+
+    def list_aspects(self, entity=None, schema=None, limit=None, **kwargs):
+        matches = [a for a in self.aspects if a.entity == entity and a.schema == schema]
+        return matches[:limit]
+
+    def get_artifact(self, urn):
+        self.fetched.append(urn)
+        raise ArtifactFetched(urn)
+
+
+class ContentCacheIvcap:
+    """Serves ``example_prep.pdb`` and answers every content-cache lookup with a hit."""
+
+    def __init__(self, server):
+        self.server = server
+        self.keys = []
+
+    def list_aspects(self, entity=None, schema=None, limit=None, **kwargs):
+        if schema != CACHE_SCHEMA:
+            return []
+        self.keys.append(entity)
+        return [SimpleNamespace(content={"repaired_pdb_urn": REPAIRED_URN, "$policy": None})]
+
+    def get_artifact(self, urn):
+        from tests.test_range_download import FakeArtifact
+
+        return FakeArtifact(self.server, "example_prep.pdb")
+
+
+class FakeReport:
+    def step_started(self, name, opts=None, **kwargs):
+        pass
+
+    def step_finished(self, name, opts=None, **kwargs):
+        pass
+
+
+@pytest.fixture
+def job(tool_service):
+    stored = SimpleNamespace(
+        entity=INPUT_URN,
+        schema=tool_service.Result.SCHEMA,
+        content={
+            "$schema": tool_service.Result.SCHEMA,
+            "$id": INPUT_URN,
+            "repaired_pdb_urn": REPAIRED_URN,
+        },
+    )
+    return SimpleNamespace(ivcap=FakeIvcap([stored]), report=FakeReport())
+
+
+def test_default_request_reuses_result_stored_under_input_urn(tool_service, job):
+    result = tool_service.foldx_repair_pdb(tool_service.Request(pdb_artifact=INPUT_URN), job)
+
+    assert result.repaired_pdb_urn == REPAIRED_URN
+    assert job.ivcap.fetched == []
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"residue_renames": {"HIE": "HIS"}},
+        {"compress_output": "gzip"},
+        {"parent_artifact": "urn:ivcap:artifact:parent"},
+        {"repair_mode": "selective"},
+        {"max_passes": 3},
+        {"energy_tolerance": 0.5},
+    ],
+)
+def test_non_default_options_bypass_input_urn_cache(tool_service, job, options):
+    req = tool_service.Request(pdb_artifact=INPUT_URN, **options)
+    assert not tool_service.has_default_options(req)
+
+    with pytest.raises(ArtifactFetched):
+        tool_service.foldx_repair_pdb(req, job)
+    assert job.ivcap.fetched == [INPUT_URN]
+
+
+@pytest.mark.parametrize("renames", [{"HISE": "HIS"}, {"HIE": ""}, {"HIÉ": "HIS"}])
+def test_bad_residue_renames_reject_the_request(tool_service, renames):
+    with pytest.raises(ValueError, match="3-character ASCII"):
+        tool_service.Request(pdb_artifact=INPUT_URN, residue_renames=renames)
+
+
+def test_content_cache_is_keyed_on_policy_and_output_name(
+    tool_service, http_server, repo_dir, monkeypatch
+):
+    monkeypatch.setattr(tool_service, "download_cache", None)
+    http_server.files["/example_prep.pdb"] = (repo_dir / "example_prep.pdb").read_bytes()
+    job = SimpleNamespace(ivcap=ContentCacheIvcap(http_server), report=FakeReport())
+    requests = [
+        {},
+        {"$policy": "urn:ivcap:policy:a"},
+        {"$policy": "urn:ivcap:policy:b"},
+        {"$policy": "urn:ivcap:policy:a", "output_name": "mine.pdb"},
+        {"$policy": "urn:ivcap:policy:a"},
+    ]
+    for options in requests:
+        req = tool_service.Request(pdb_artifact=INPUT_URN, max_passes=2, **options)
+        assert tool_service.foldx_repair_pdb(req, job).repaired_pdb_urn == REPAIRED_URN
+    keys = job.ivcap.keys
+    assert len(set(keys[:4])) == 4
+    assert keys[4] == keys[1]
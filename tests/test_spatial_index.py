@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+import spatial_index
+from spatial_index import CellList, load_coordinates
+
+
+def brute_pairs(coords: np.ndarray, cutoff: float):
+    dist = np.linalg.norm(coords[:, None] - coords[None], axis=-1)
+    i, j = np.nonzero(np.triu(dist < cutoff, k=1))
+    return set(zip(i.tolist(), j.tolist()))
+
+
+def brute_query(coords: np.ndarray, points: np.ndarray, radius: float):
+    dist = np.linalg.norm(points[:, None] - coords[None], axis=-1)
+    q, a = np.nonzero(dist <= radius)
+    return set(zip(q.tolist(), a.tolist()))
+
+
+def pair_set(i: np.ndarray, j: np.ndarray):
+    return set(zip(i.tolist(), j.tolist()))
+
+
+@pytest.fixture(scope="module")
+def rng():
+    return np.random.default_rng(7)
+
+
+@pytest.fixture(
+    scope="module",
+    params=["uniform", "sparse", "flat"],
+)
+def coords(request, rng):
+    if request.param == "uniform":
+        return rng.uniform(0, 30, size=(600, 3)).astype(np.float32)
+    if request.param == "sparse":
+        # Two clusters far apart, so the grid is mostly empty.
+        cluster = rng.uniform(0, 6, size=(150, 3))
+        return np.concatenate([cluster, cluster[::-1] + 800]).astype(np.float32)
+    return np.column_stack([rng.uniform(0, 40, size=(300, 2)), np.zeros(300)]).astype(np.float32)
+
+
+@pytest.mark.parametrize("cutoff", [1.5, 4.0, 5.0, 11.0])
+def test_pairs_match_brute_force(coords, cutoff):
+    cells = CellList(coords)
+    i, j = cells.pairs(cutoff)
+    assert (i < j).all()
+    assert len(i) == len(pair_set(i, j))
+    assert pair_set(i, j) == brute_pairs(coords, cutoff)
+
+
+@pytest.mark.parametrize("radius", [2.0, 5.0, 9.0])
+def test_query_radius_matches_brute_force(coords, rng, radius):
+    cells = CellList(coords)
+    points = coords[rng.choice(len(coords), 20)] + rng.normal(0, 1, size=(20, 3)).astype(np.float32)
+    assert pair_set(*cells.query_radius(points, radius)) == brute_query(coords, points, radius)
+
+
+def test_within_and_far_points(coords):
+    cells = CellList(coords)
+    points = np.array([[-1000, -1000, -1000], coords[0]], dtype=np.float32)
+    expected = np.zeros(len(coords), dtype=bool)
+    expected[[atom for _, atom in brute_query(coords, points, 3.0)]] = True
+    assert (cells.within(points, 3.0) == expected).all()
+
+
+def test_small_chunks_give_the_same_pairs(coords, monkeypatch):
+    expected = pair_set(*CellList(coords).pairs(4.0))
+    monkeypatch.setattr(spatial_index, "MAX_CHUNK_PAIRS", 7)
+    assert pair_set(*CellList(coords).pairs(4.0)) == expected
+
+
+def test_residue_neighborhood():
+    coords = np.array([[0, 0, 0], [1, 0, 0], [3, 0, 0], [20, 0, 0]], dtype=np.float32)
+    cells = CellList(coords, residue_index=np.array([0, 0, 1, 2]))
+    selected = np.array([True, False, False])
+    assert cells.residue_neighborhood(selected, 2.5).tolist() == [True, True, False]
+
+
+def test_residue_neighborhood_needs_index():
+    with pytest.raises(ValueError):
+        CellList(np.zeros((2, 3))).residue_neighborhood(np.array([True]), 1.0)
+
+
+@pytest.mark.parametrize("n", [0, 1])
+def test_tiny_inputs(n):
+    cells = CellList(np.zeros((n, 3)))
+    assert [len(a) for a in cells.pairs(5.0)] == [0, 0]
+    assert cells.within(np.zeros((1, 3)), 1.0).tolist() == [True] * n
+
+
+@pytest.mark.parametrize(
+    "args",
+    [(np.zeros((3, 2)),), (np.zeros((3, 3)), 0.0), (np.zeros((3, 3)), 5.0, np.zeros(2))],
+)
+def test_rejects_bad_arguments(args):
+    with pytest.raises(ValueError):
+        CellList(*args)
+
+
+def test_load_coordinates(repo_dir):
+    coords, residues = load_coordinates(repo_dir / "example.pdb")
+    first = (repo_dir / "example.pdb").read_bytes().split(b"\n", 1)[0]
+    assert coords.dtype == np.float32
+    assert coords[0].tolist() == pytest.approx([float(first[30 + 8 * k : 38 + 8 * k]) for k in range(3)])
+    assert residues[0] == 0
+    assert (np.diff(residues) >= 0).all()
@@ -0,0 +1,249 @@
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from workspace import DEFAULT_FOOTPRINT, DISK, TMPFS, WorkspaceManager, WorkspaceReaper
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    """Stands in for the disk behind /tmp."""
+    root = tmp_path / "disk"
+    root.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(root))
+    return root
+
+
+@pytest.fixture
+def shm(tmp_path):
+    """Stands in for /dev/shm."""
+    root = tmp_path / "shm"
+    root.mkdir()
+    return root
+
+
+@pytest.fixture
+def managers():
+    created = []
+
+    def make(**kwargs):
+        manager = WorkspaceManager(**kwargs)
+        created.append(manager)
+        return manager
+
+    yield make
+    for manager in created:
+        manager.close()
+
+
+def tmpfs_manager(managers, shm, budget=1000):
+    return managers(mode=TMPFS, tmpfs_dir=shm, memory_budget=budget, footprint_factor=1.0)
+
+
+def test_tmpfs_reserves_the_footprint(managers, shm, disk):
+    manager = tmpfs_manager(managers, shm)
+    with manager.workspace(600) as workspace:
+        assert workspace.location == TMPFS
+        assert workspace.path.parent == shm
+        assert workspace.reserved == 600
+        assert manager.metrics()["tmpfs_reserved_bytes"] == 600
+    manager.reaper.drain()
+    assert manager.metrics()["tmpfs_reserved_bytes"] == 0
+    assert not workspace.path.exists()
+
+
+def test_falls_back_to_disk_when_the_budget_is_spent(managers, shm, disk):
+    manager = tmpfs_manager(managers, shm)
+    with manager.workspace(600) as first, manager.workspace(600) as second:
+        assert (first.location, second.location) == (TMPFS, DISK)
+        assert second.path.parent == disk
+        assert second.reserved == 0
+    manager.reaper.drain()
+    metrics = manager.metrics()
+    assert (metrics["tmpfs_workspaces"], metrics["disk_workspaces"]) == (1, 1)
+    assert metrics["tmpfs_fallbacks"] == 1
+    # The released reservation makes room again.
+    with manager.workspace(600) as third:
+        assert third.location == TMPFS
+
+
+def test_unknown_size_assumes_the_default_footprint(managers, shm, disk):
+    assert tmpfs_manager(managers, shm).estimate_footprint(None) == DEFAULT_FOOTPRINT
+    with tmpfs_manager(managers, shm, budget=DEFAULT_FOOTPRINT - 1).workspace() as workspace:
+        assert workspace.location == DISK
+    with tmpfs_manager(managers, shm, budget=DEFAULT_FOOTPRINT).workspace() as workspace:
+        assert workspace.location == TMPFS
+
+
+def test_missing_tmpfs_dir_uses_disk(managers, tmp_path, disk):
+    manager = managers(mode=TMPFS, tmpfs_dir=tmp_path / "missing")
+    assert manager.mode == DISK
+    with manager.workspace(10) as workspace:
+        assert workspace.path.parent == disk
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        WorkspaceManager(mode="ramdisk")
+
+
+@pytest.fixture
+def foldx(tmp_path):
+    binary = tmp_path / "bin" / "foldx_20251231"
+    binary.parent.mkdir()
+    binary.write_text("#!/bin/sh\n")
+    (binary.parent / "rotabase.txt").write_text("rotamers\n")
+    return binary
+
+
+def test_pool_stages_the_foldx_files(managers, disk, foldx):
+    manager = managers(foldx_binary=foldx, pool_size=2)
+    with manager.workspace() as workspace:
+        assert workspace.pooled
+        assert workspace.staged == ("foldx_20251231", "rotabase.txt")
+        assert workspace.foldx_binary.resolve() == foldx
+        assert (workspace.path / "rotabase.txt").read_text() == "rotamers\n"
+    assert manager.metrics()["pool_hits"] == 1
+
+
+def test_returned_workspace_is_reset_and_reused(managers, disk, foldx):
+    manager = managers(foldx_binary=foldx, pool_size=1)
+    with manager.workspace() as workspace:
+        (workspace.path / "input_prep_Repair.pdb").write_text("repaired")
+        (workspace.path / "molecules").mkdir()
+        (workspace.path / "molecules" / "scratch").write_text("x")
+        (workspace.path / "link").symlink_to(workspace.path / "molecules")
+    manager.reaper.drain()
+    assert sorted(entry.name for entry in workspace.path.iterdir()) == list(workspace.staged)
+    assert manager.metrics()["pool_idle"] == 1
+    with manager.workspace() as again:
+        assert again is workspace
+
+
+def test_busy_pool_hands_out_one_off_workspaces(managers, disk, foldx):
+    manager = managers(foldx_binary=foldx, pool_size=2)
+    with manager.workspace() as a, manager.workspace() as b, manager.workspace() as c:
+        assert len({a.path, b.path, c.path}) == 3
+        assert [a.pooled, b.pooled, c.pooled] == [True, True, False]
+        assert c.foldx_binary == foldx
+    manager.reaper.drain()
+    metrics = manager.metrics()
+    assert (metrics["pool_hits"], metrics["pool_misses"], metrics["pool_idle"]) == (2, 1, 2)
+    assert not c.path.exists()
+    assert a.path.exists() and b.path.exists()
+
+
+def test_concurrent_jobs_never_share_a_workspace(managers, disk, foldx):
+    manager = managers(foldx_binary=foldx, pool_size=3)
+    in_use = set()
+    lock = threading.Lock()
+    clashes = []
+
+    def job():
+        for _ in range(20):
+            with manager.workspace() as workspace:
+                with lock:
+                    if workspace.path in in_use:
+                        clashes.append(workspace.path)
+                    in_use.add(workspace.path)
+                (workspace.path / "input.pdb").write_text("ATOM\n")
+                with lock:
+                    in_use.discard(workspace.path)
+
+    threads = [threading.Thread(target=job) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    manager.reaper.drain()
+    assert not clashes
+    assert manager.metrics()["pool_idle"] == 3
+    assert len(list(disk.iterdir())) == 3
+
+
+def test_close_removes_idle_workspaces(disk, foldx):
+    manager = WorkspaceManager(foldx_binary=foldx, pool_size=2)
+    assert len(list(disk.iterdir())) == 2
+    manager.close()
+    assert not list(disk.iterdir())
+
+
+def test_pool_needs_the_foldx_binary(managers, disk):
+    assert managers(pool_size=2).pool_size == 0
+
+
+class Cleanup:
+    """Records which thread cleaned up each workspace; ``hold`` blocks the first."""
+
+    def __init__(self, hold=False):
+        self.threads = {}
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self, workspace):
+        self.started.set()
+        self.release.wait(10)
+        self.threads[workspace.name] = threading.current_thread().name
+
+
+def fake_workspace(tmp_path, name):
+    return SimpleNamespace(name=name, path=tmp_path)
+
+
+def test_reaper_cleans_up_in_the_background(tmp_path):
+    cleanup = Cleanup()
+    reaper = WorkspaceReaper(cleanup, max_backlog=4, min_free_fraction=0.0)
+    for name in "abc":
+        reaper.submit(fake_workspace(tmp_path, name))
+    reaper.drain()
+    assert set(cleanup.threads.values()) == {"workspace-reaper"}
+    metrics = reaper.metrics()
+    assert (metrics["reaped"], metrics["inline_cleanups"], metrics["backlog"]) == (3, 0, 0)
+    assert metrics["max_latency_seconds"] >= metrics["mean_latency_seconds"] > 0
+
+
+def test_full_backlog_cleans_up_inline(tmp_path):
+    cleanup = Cleanup(hold=True)
+    reaper = WorkspaceReaper(cleanup, max_backlog=1, min_free_fraction=0.0)
+    reaper.submit(fake_workspace(tmp_path, "busy"))
+    assert cleanup.started.wait(10)
+    # The reaper is stuck on "busy": "queued" fills the backlog, so "inline"
+    # has nowhere to wait and is cleaned up by the caller.
+    reaper.submit(fake_workspace(tmp_path, "queued"))
+    assert reaper.metrics()["backlog"] == 1
+    threading.Timer(0.2, cleanup.release.set).start()
+    reaper.submit(fake_workspace(tmp_path, "inline"))
+    reaper.drain()
+    assert cleanup.threads == {
+        "busy": "workspace-reaper",
+        "queued": "workspace-reaper",
+        "inline": threading.current_thread().name,
+    }
+    metrics = reaper.metrics()
+    assert (metrics["reaped"], metrics["inline_cleanups"], metrics["peak_backlog"]) == (3, 1, 1)
+
+
+def test_low_free_space_cleans_up_inline(tmp_path):
+    cleanup = Cleanup()
+    reaper = WorkspaceReaper(cleanup, max_backlog=4, min_free_fraction=1.0)
+    reaper.submit(fake_workspace(tmp_path, "a"))
+    assert cleanup.threads == {"a": threading.current_thread().name}
+    assert reaper.metrics()["inline_cleanups"] == 1
+    # A path whose filesystem cannot be queried does not force inline cleanup.
+    reaper.submit(fake_workspace(tmp_path / "gone", "b"))
+    reaper.drain()
+    assert cleanup.threads["b"] == "workspace-reaper"
+
+
+def test_failed_cleanup_is_logged(tmp_path, caplog):
+    def cleanup(workspace):
+        raise PermissionError("busy")
+
+    reaper = WorkspaceReaper(cleanup, min_free_fraction=1.0)
+    reaper.submit(fake_workspace(tmp_path, "a"))
+    assert reaper.metrics()["reaped"] == 1
+    assert "Failed to clean up workspace" in caplog.text
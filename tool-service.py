@@ -1,18 +1,58 @@
 import os
 import subprocess
-import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import ClassVar, Optional
+from typing import Callable, ClassVar, Dict, Iterator, List, Literal, Optional, Tuple
 
 import httpx
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from ivcap_service import JobContext, Service, getLogger
 from ivcap_ai_tool import ToolOptions, ivcap_ai_tool, logging_init, start_tool_server
+from ivcap_ai_tool.server import get_fast_app
+
+from clash_scan import load_structure_atoms, scan_clashes, write_fixed_residues
+from compression import (
+    CONTENT_TYPES,
+    SUFFIXES,
+    StreamDecompressor,
+    compress_file,
+    strip_compression_suffix,
+)
+from download_cache import CacheEntry, DownloadCache, read_chunks
+from download_retry import ResumableStream, RetryBudget
+from foldx_batch import STDOUT_NAME, BatchScheduler
+from foldx_executor import FoldxExecutor, FoldxRun, FoldxSupervisionError
+from foldx_progress import ProgressSnapshot, read_repair_energies
+from http_pool import TransferPool
+from mmcif import BINARY_CIF_SUFFIX, StructureTranscoder
+from pdb_prep import (
+    DEFAULT_RENAME_TABLE,
+    PrepStats,
+    StreamingPreparer,
+    check_renames,
+)
+from preflight import PreflightError, check_pdb_file
+from range_download import RangeDownloader, RangeNotSatisfied, range_length
+from repair_cache import lookup_cached_repair, record_cached_repair, repair_cache_key
+from residue_diff import diff_structures
+from workspace import WorkspaceManager
 
 logging_init()
 logger = getLogger("app")
 
+# Keep the unprepared artifact in the job workspace next to the prepped file.
+KEEP_RAW_INPUT = os.getenv("FOLDX_KEEP_RAW_INPUT", "").lower() in ("1", "true", "yes")
+# Minimum number of seconds between two progress events of a FoldX run.
+PROGRESS_INTERVAL = float(os.getenv("FOLDX_PROGRESS_INTERVAL", 5.0))
+# FoldX stdout lines logged when a run fails.
+STDOUT_TAIL_LINES = 20
+FIXED_RESIDUES_NAME = "fixed_residues.txt"
+MAX_REPAIR_PASSES = 10
+PARENT_PREP_NAME = "parent_prep.pdb"
+
 service = Service(
     name="FoldX tool to prepare a protein PDB file for other FoldX tools",
     contact={
@@ -25,6 +65,27 @@ service = Service(
     },
 )
 
+FOLDX_BINARY = Path(__file__).resolve().parent / "foldx_20251231"
+
+# Shared by every job in the process so concurrent requests queue for FoldX
+# slots instead of oversubscribing the container's CPU quota.
+foldx_executor = FoldxExecutor.from_environment()
+# Set when the server shuts down, so FoldX runs still in flight are killed
+# rather than left running without their job.
+foldx_shutdown = threading.Event()
+foldx_scheduler = BatchScheduler.from_environment(
+    foldx_executor, PROGRESS_INTERVAL, foldx_shutdown
+)
+workspaces = WorkspaceManager.from_environment(
+    foldx_binary=FOLDX_BINARY,
+    foldx_memory=foldx_executor.max_workers * foldx_executor.job_memory,
+)
+# One connection pool for every artifact transfer in the process.
+transfer_pool = TransferPool.from_environment()
+# Raw artifact bytes shared between jobs (and worker processes), if enabled.
+download_cache = DownloadCache.from_environment()
+range_downloader = RangeDownloader.from_environment()
+
 # ====================================
 # Request/Result schemas
 # ====================================
@@ -39,6 +100,51 @@ class Request(BaseModel):
     output_name: Optional[str] = Field(
         None, description="Desired filename for the repaired artifact"
     )
+    residue_renames: Optional[Dict[str, str]] = Field(
+        None,
+        description=(
+            "Additional three-letter residue renames applied during prep, "
+            "merged over the built-in Amber/CHARMM protonation table"
+        ),
+    )
+    compress_output: Optional[Literal["gzip", "bzip2", "zstd"]] = Field(
+        None, description="Compress the repaired PDB before uploading it"
+    )
+    parent_artifact: Optional[str] = Field(
+        None,
+        description=(
+            "URN of the repaired artifact this structure was derived from. Only "
+            "residues that differ from it, and their neighbours, are repaired"
+        ),
+    )
+    repair_mode: Literal["full", "selective"] = Field(
+        "full",
+        description=(
+            "'selective' restricts RepairPDB to residues flagged by a steric "
+            "clash pre-scan and their neighbours; 'full' repairs every residue"
+        ),
+    )
+    max_passes: int = Field(
+        1,
+        ge=1,
+        le=MAX_REPAIR_PASSES,
+        description="Run RepairPDB up to this many times, each on the previous output",
+    )
+    energy_tolerance: float = Field(
+        0.05,
+        ge=0.0,
+        description=(
+            "Stop once a pass lowers the total energy by less than this many kcal/mol"
+        ),
+    )
+
+    @field_validator("residue_renames")
+    @classmethod
+    def _check_residue_renames(cls, renames: Optional[Dict[str, str]]):
+        # Rejects the request up front instead of failing the job at prep time.
+        if renames:
+            check_renames(renames)
+        return renames
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -51,6 +157,43 @@ class Request(BaseModel):
         },
     )
 
+# Request fields that change the repaired output. The Result stored under an
+# input URN does not record them, so it only answers requests leaving them all
+# at their defaults; everything else goes through the content cache.
+REPAIR_OPTIONS = (
+    "residue_renames",
+    "compress_output",
+    "parent_artifact",
+    "repair_mode",
+    "max_passes",
+    "energy_tolerance",
+)
+
+
+def has_default_options(req: Request) -> bool:
+    return all(
+        getattr(req, name) == Request.model_fields[name].default for name in REPAIR_OPTIONS
+    )
+
+
+class RepairPass(BaseModel):
+    number: int = Field(description="1-based pass number")
+    start_energy: Optional[float] = Field(
+        None, description="FoldX total energy before the pass (kcal/mol)"
+    )
+    energy: Optional[float] = Field(
+        None, description="FoldX total energy after the pass (kcal/mol)"
+    )
+    foldx_seconds: float = Field(description="FoldX run time of the pass")
+    queue_wait_seconds: float = Field(description="Time spent waiting for a FoldX slot")
+
+    @property
+    def improvement(self) -> Optional[float]:
+        if self.start_energy is None or self.energy is None:
+            return None
+        return self.start_energy - self.energy
+
+
 class Result(BaseModel):
     SCHEMA: ClassVar[str] = "urn:sd:schema.foldx_repair_pdb.2"
     jschema: str = Field(SCHEMA, alias="$schema")
@@ -61,6 +204,14 @@ class Result(BaseModel):
     policy: Optional[str] = Field(
         None, alias="$policy", description="Policy applied to the repaired artifact"
     )
+    passes: List[RepairPass] = Field(
+        default_factory=list,
+        description="Energy and timings of each RepairPDB pass (empty for cached repairs)",
+    )
+    converged: Optional[bool] = Field(
+        None,
+        description="Whether the last pass improved the energy by less than the tolerance",
+    )
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -80,67 +231,415 @@ class Result(BaseModel):
 # ====================================
 
 
-def repair_pdb_with_foldx(pdb_path: Path, foldx_binary: Path) -> Path:
-    base_name = pdb_path.stem
-    prep_path = pdb_path.with_name(f"{base_name}_prep.pdb")
-
-    logger.info("Preparing PDB '%s' for FoldX repair", pdb_path.name)
-    with pdb_path.open("r", encoding="utf-8") as source, prep_path.open(
-        "w", encoding="utf-8"
-    ) as prepared:
-        for line in source:
-            newline = (
-                line.replace("HIE", "HIS")
-                .replace("HID", "HIS")
-                .replace("CYX", "CYS")
-                .replace("CYP", "CYS")
-            )
-            newline = f"{newline[:21]}A{newline[22:]}"
-            if "TER" in line:
-                prepared.write("TER\n")
-                break
-            prepared.write(newline)
-
-    foldx_cmd = [
-        str(foldx_binary),
-        "--command=RepairPDB",
-        f"--output-dir={pdb_path.parent}",
-        f"--pdb={prep_path.name}",
-        f"--pdb-dir={pdb_path.parent}",
-        "-d",
-        "true",
-    ]
-    logger.info("Running FoldX: %s", " ".join(foldx_cmd))
-    subprocess.run(foldx_cmd, cwd=pdb_path.parent, check=True)
-
-    repaired_path = pdb_path.with_name(f"{base_name}_prep_Repair.pdb")
+def prep_path_for(pdb_path: Path) -> Path:
+    stem = Path(strip_compression_suffix(pdb_path.name)).stem
+    return pdb_path.with_name(f"{stem}_prep.pdb")
+
+
+def run_foldx_repair(
+    prep_path: Path,
+    foldx_binary: Path,
+    residues: Optional[int] = None,
+    on_progress: Optional[Callable[[ProgressSnapshot], None]] = None,
+    fixed_residues: Optional[str] = None,
+) -> Tuple[Path, FoldxRun]:
+    stdout_path = prep_path.parent / STDOUT_NAME
+    logger.info("Running FoldX repair for '%s'", prep_path.name)
+    try:
+        run = foldx_scheduler.submit(
+            prep_path, foldx_binary, residues, on_progress, fixed_residues
+        )
+    except (subprocess.CalledProcessError, FoldxSupervisionError):
+        if stdout_path.exists():
+            tail = stdout_path.read_text(errors="replace").splitlines()[-STDOUT_TAIL_LINES:]
+            logger.error("FoldX output:\n%s", "\n".join(tail))
+        raise
+    logger.info(
+        "FoldX finished in %.2fs after waiting %.2fs for a slot "
+        "(peak RSS %d bytes, %.2f CPU seconds)",
+        run.run_seconds,
+        run.wait_seconds,
+        run.peak_rss,
+        run.cpu_seconds,
+    )
+
+    repaired_path = prep_path.with_name(f"{prep_path.stem}_Repair.pdb")
     if not repaired_path.exists():
         raise FileNotFoundError(
             f"FoldX did not produce repaired file at '{repaired_path}'"
         )
-    return repaired_path
+    return repaired_path, run
+
+
+def run_repair_passes(
+    req: Request,
+    prep_path: Path,
+    foldx_binary: Path,
+    residues: Optional[int],
+    report,
+    fixed_residues: Optional[str] = None,
+) -> Tuple[Path, FoldxRun, List[RepairPass], Optional[bool]]:
+    """
+    Runs RepairPDB up to ``req.max_passes`` times, each pass on the previous
+    output, until a pass lowers the total energy by less than
+    ``req.energy_tolerance``. ``converged`` is None for a single pass or when
+    the fxout has no energies, and False when the pass cap was reached first.
+    """
+    passes: List[RepairPass] = []
+    converged = None
+    for number in range(1, req.max_passes + 1):
+        if number > 1:
+            # The next pass repairs the previous output under the same name.
+            repaired_path.replace(prep_path)
+        try:
+            repaired_path, foldx_run = run_foldx_repair(
+                prep_path,
+                foldx_binary,
+                residues,
+                on_progress=lambda snapshot: report.custom(
+                    "repair-progress", snapshot.as_dict()
+                ),
+                fixed_residues=fixed_residues,
+            )
+        except FoldxSupervisionError as exc:
+            report.step_finished(
+                "repair",
+                {
+                    "message": str(exc),
+                    "passes": [repair_pass.model_dump() for repair_pass in passes],
+                    **exc.run.as_dict(),
+                },
+            )
+            raise
+        start_energy, energy = read_repair_energies(repaired_path.with_suffix(".fxout"))
+        repair_pass = RepairPass(
+            number=number,
+            start_energy=start_energy,
+            energy=energy,
+            foldx_seconds=round(foldx_run.run_seconds, 3),
+            queue_wait_seconds=round(foldx_run.wait_seconds, 3),
+        )
+        passes.append(repair_pass)
+        logger.info(
+            "Repair pass %d: total energy %s -> %s kcal/mol",
+            number,
+            start_energy,
+            energy,
+        )
+        if req.max_passes == 1:
+            break
+        if repair_pass.improvement is None:
+            logger.warning("No total energy in the FoldX output, stopping after pass %d", number)
+            break
+        if repair_pass.improvement < req.energy_tolerance:
+            converged = True
+            break
+    else:
+        converged = False
+    return repaired_path, foldx_run, passes, converged
+
+
+def log_prep_stats(prep_path: Path, stats: PrepStats) -> None:
+    logger.info(
+        "Prepared '%s' (%d atom records, terminated=%s, renamed=%s)",
+        prep_path.name,
+        stats.atom_records,
+        stats.terminated,
+        stats.renamed,
+    )
+
 
-def download_artifact_to_path(artifact, target_path: Path) -> None:
+def transfer_client(artifact) -> httpx.Client:
+    """The job's authenticated client, routed through the shared connection pool."""
+    return transfer_pool.client_for(artifact._ivcap._client)
+
+
+def _artifact_data_href(artifact) -> str:
     data_href = getattr(artifact, "_data_href", None)
     if not data_href:
         artifact.refresh()
         data_href = getattr(artifact, "_data_href", None)
     if not data_href:
         raise ValueError(f"Artifact '{artifact.id}' does not expose downloadable data.")
+    return data_href
+
+
+@dataclass
+class DownloadStats:
+    bytes_read: int = 0
+    content_length: Optional[int] = None
+    terminated_early: bool = False
+    compression: Optional[str] = None
+    structure_format: Optional[str] = None
+    cache_hit: bool = False
+    # Number of parallel byte ranges; 0 for a single stream.
+    ranges: int = 0
 
-    client = artifact._ivcap._client.get_httpx_client()
-    timeout = httpx.Timeout(60.0, connect=10.0, read=60.0)
+    @property
+    def bytes_skipped(self) -> Optional[int]:
+        if self.content_length is None:
+            return None
+        return max(self.content_length - self.bytes_read, 0)
+
+
+def _cache_entry(artifact, complete: bool) -> Optional[CacheEntry]:
+    """
+    The download cache entry that may serve ``artifact``: one with an ETag
+    (confirmed by a conditional GET) or whose size matches the artifact's.
+    """
+    if download_cache is None:
+        return None
+    entry = download_cache.lookup(artifact.id)
+    if entry is None or (complete and not entry.complete):
+        return None
+    if entry.etag or entry.matches(None, getattr(artifact, "size", None)):
+        return entry
+    return None
+
+
+@contextmanager
+def open_artifact_stream(
+    artifact,
+    stats: DownloadStats,
+    complete: bool = True,
+    use_cache: bool = True,
+    retries: Optional[RetryBudget] = None,
+) -> Iterator[Iterator[bytes]]:
+    """
+    Yields the raw bytes of ``artifact`` in chunks, from the download cache
+    when it holds a valid copy and from the Data Fabric otherwise. Downloaded
+    bytes are added to the cache; a caller that stops early leaves a prefix
+    entry, which only serves callers passing ``complete=False``. Broken
+    transfers are resumed while ``retries`` lasts.
+    """
+    retries = retries or RetryBudget.from_environment()
+    entry = _cache_entry(artifact, complete) if use_cache else None
+    if entry is not None and not entry.etag:
+        blob = download_cache.open(entry)
+        if blob is not None:
+            download_cache.record_hit(entry)
+            stats.cache_hit = True
+            with blob:
+                yield read_chunks(blob)
+            return
+
+    data_href = _artifact_data_href(artifact)
+    client = transfer_client(artifact)
+    timeout = transfer_pool.timeout
+    headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else {}
     try:
-        with client.stream("GET", data_href, timeout=timeout) as response:
+        with ResumableStream(client, data_href, retries, headers, timeout) as response:
+            if response.status_code == httpx.codes.NOT_MODIFIED:
+                blob = download_cache.open(entry)
+                if blob is None:
+                    # Evicted since the lookup, fetch it again.
+                    response.close()
+                    with open_artifact_stream(
+                        artifact, stats, complete, use_cache=False, retries=retries
+                    ) as chunks:
+                        yield chunks
+                    return
+                download_cache.record_hit(entry)
+                stats.cache_hit = True
+                with blob:
+                    yield read_chunks(blob)
+                return
+
             response.raise_for_status()
-            with target_path.open("wb") as out_file:
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit():
+                stats.content_length = int(content_length)
+            writer = download_cache.writer(artifact.id) if download_cache else None
+            exhausted = False
+
+            def chunks() -> Iterator[bytes]:
+                nonlocal exhausted
                 for chunk in response.iter_bytes():
                     if chunk:
-                        out_file.write(chunk)
+                        if writer:
+                            writer.write(chunk)
+                        yield chunk
+                exhausted = True
+
+            try:
+                yield chunks()
+            except BaseException:
+                if writer:
+                    writer.abort()
+                raise
+            stats.bytes_read = response.num_bytes_downloaded
+            response.close()
+            if writer:
+                download_cache.record_miss()
+                download_cache.commit(
+                    writer,
+                    etag=response.headers.get("ETag"),
+                    size=getattr(artifact, "size", None) or stats.content_length,
+                    complete=exhausted,
+                )
+    except httpx.HTTPError as exc:
+        raise RuntimeError(
+            f"Failed to download artifact '{artifact.id}' from '{data_href}'"
+        ) from exc
+
+
+def _download_in_ranges(
+    artifact, target_path: Path, stats: DownloadStats, retries: RetryBudget
+) -> bool:
+    """
+    Fetches ``artifact`` into ``target_path`` with parallel range requests.
+    Returns False, having written nothing, when the server does not support
+    ranges or the artifact is too small to benefit.
+    """
+    data_href = _artifact_data_href(artifact)
+    client = transfer_client(artifact)
+    timeout = transfer_pool.timeout
+    attempt = 0
+    while True:
+        try:
+            head = client.head(data_href, timeout=timeout)
+            head.raise_for_status()
+            break
+        except httpx.HTTPError as exc:
+            if retries.retry(data_href, 0, attempt, exc):
+                attempt += 1
+                continue
+            if isinstance(exc, httpx.HTTPStatusError):
+                head = None
+                break
+            raise RuntimeError(
+                f"Failed to download artifact '{artifact.id}' from '{data_href}'"
+            ) from exc
+    length = range_length(head.headers) if head is not None else None
+    if not range_downloader.applies(length):
+        range_downloader.record_fallback()
+        return False
+    try:
+        ranged = range_downloader.download(
+            client, data_href, target_path, length, retries, timeout
+        )
+    except RangeNotSatisfied as exc:
+        logger.warning("Range requests for '%s' not honoured (%s)", artifact.id, exc)
+        range_downloader.record_fallback()
+        return False
     except httpx.HTTPError as exc:
         raise RuntimeError(
             f"Failed to download artifact '{artifact.id}' from '{data_href}'"
         ) from exc
+    stats.bytes_read = stats.content_length = length
+    stats.ranges = ranged.parts
+    if download_cache:
+        download_cache.record_miss()
+        download_cache.store_file(
+            artifact.id,
+            target_path,
+            head.headers.get("ETag"),
+            getattr(artifact, "size", None) or length,
+        )
+    return True
+
+
+def download_artifact_to_path(
+    artifact,
+    target_path: Path,
+    retries: Optional[RetryBudget] = None,
+) -> DownloadStats:
+    """
+    Downloads ``artifact`` to ``target_path``, from the download cache when
+    possible. Large artifacts are fetched in parallel byte ranges if the
+    server supports them.
+    """
+    stats = DownloadStats()
+    retries = retries or RetryBudget.from_environment()
+    if _cache_entry(artifact, complete=True) is None:
+        if _download_in_ranges(artifact, target_path, stats, retries):
+            return stats
+    with (
+        open_artifact_stream(artifact, stats, retries=retries) as chunks,
+        target_path.open("wb") as out_file,
+    ):
+        for chunk in chunks:
+            out_file.write(chunk)
+    return stats
+
+
+def is_binary_cif(artifact) -> bool:
+    name = strip_compression_suffix(getattr(artifact, "name", None) or "")
+    return name.lower().endswith(BINARY_CIF_SUFFIX)
+
+
+def prepare_chunks(
+    chunks: Iterator[bytes],
+    prep_path: Path,
+    preparer: StreamingPreparer,
+    stats: DownloadStats,
+) -> bool:
+    """
+    Feeds raw artifact chunks through decompression, structure conversion
+    and the prep transform into ``prep_path``. Returns True when it stopped
+    at the first TER record without consuming every chunk.
+    """
+    decompressor = StreamDecompressor()
+    structure = StructureTranscoder()
+    stopped = False
+    with prep_path.open("wb") as prepared:
+        for chunk in chunks:
+            prepared.write(preparer.feed(structure.feed(decompressor.feed(chunk))))
+            if preparer.done:
+                stopped = True
+                break
+        else:
+            tail = structure.feed(decompressor.finish()) + structure.finish()
+            prepared.write(preparer.feed(tail))
+        prepared.write(preparer.finish())
+    stats.compression = decompressor.codec
+    stats.structure_format = structure.format
+    return stopped
+
+
+def download_and_prepare_artifact(
+    artifact,
+    prep_path: Path,
+    preparer: StreamingPreparer,
+    raw_path: Optional[Path] = None,
+    retries: Optional[RetryBudget] = None,
+) -> DownloadStats:
+    """
+    Streams the artifact through the prep transform straight into
+    ``prep_path``, decompressing gzip/bzip2/zstd input and converting
+    mmCIF/BinaryCIF to PDB records on the fly. The HTTP stream is closed as
+    soon as the prep scanner has seen the first TER record, since everything
+    after it would be discarded. When the whole artifact is needed anyway,
+    because ``raw_path`` is given or the artifact is BinaryCIF (decoded only
+    once complete), it is downloaded to disk first, in parallel byte ranges if
+    it is large, and prepared from there.
+    """
+    if raw_path is not None or is_binary_cif(artifact):
+        download_path = raw_path or prep_path.with_name(prep_path.name + ".download")
+        stats = download_artifact_to_path(artifact, download_path, retries)
+        try:
+            with download_path.open("rb") as source:
+                prepare_chunks(read_chunks(source), prep_path, preparer, stats)
+        finally:
+            if raw_path is None:
+                download_path.unlink(missing_ok=True)
+    else:
+        stats = DownloadStats()
+        with open_artifact_stream(
+            artifact, stats, complete=False, retries=retries
+        ) as chunks:
+            stats.terminated_early = prepare_chunks(chunks, prep_path, preparer, stats)
+
+    if stats.cache_hit:
+        logger.info("Served '%s' from the download cache", artifact.id)
+    elif stats.terminated_early:
+        logger.info(
+            "Closed download of '%s' at first TER record after %d bytes (%s skipped)",
+            artifact.id,
+            stats.bytes_read,
+            "unknown" if stats.bytes_skipped is None else stats.bytes_skipped,
+        )
+    return stats
 
 
 # ====================================
@@ -156,9 +655,11 @@ def foldx_repair_pdb(req: Request, jobCtxt: JobContext) -> Result:
     ivcap = jobCtxt.ivcap
     input_urn = req.pdb_artifact
 
-    # Step 1: Check for cached repair
+    # Step 1: Check for cached repair (only valid for default options)
     jobCtxt.report.step_started("cache-check", {"message": f"Checking cache for '{input_urn}'"})
-    cached = list(ivcap.list_aspects(entity=input_urn, schema=Result.SCHEMA, limit=1))
+    cached = []
+    if has_default_options(req):
+        cached = list(ivcap.list_aspects(entity=input_urn, schema=Result.SCHEMA, limit=1))
     if cached:
         content = cached[0].content
         logger.info("Using cached repair '%s'", content["repaired_pdb_urn"])
@@ -175,55 +676,247 @@ def foldx_repair_pdb(req: Request, jobCtxt: JobContext) -> Result:
     jobCtxt.report.step_started("download", {"message": f"Fetching '{input_urn}'"})
     artifact = ivcap.get_artifact(input_urn)
 
-    foldx_binary = Path(__file__).resolve().parent / "foldx_20251231"
+    foldx_binary = FOLDX_BINARY
     if not foldx_binary.exists():
         raise FileNotFoundError(f"FoldX binary not found at '{foldx_binary}'")
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        work_dir = Path(tmp_dir)
+    with workspaces.workspace(getattr(artifact, "size", None)) as workspace:
+        work_dir = workspace.path
         input_name = artifact.name or "input.pdb"
         input_path = work_dir / input_name
 
-        download_artifact_to_path(artifact, input_path)
+        prep_path = prep_path_for(input_path)
+        renames = DEFAULT_RENAME_TABLE.extend(req.residue_renames)
+        preparer = StreamingPreparer(renames)
+        # One retry budget for every download of the job.
+        download_retries = RetryBudget.from_environment()
+        download_stats = download_and_prepare_artifact(
+            artifact,
+            prep_path,
+            preparer,
+            raw_path=input_path if KEEP_RAW_INPUT else None,
+            retries=download_retries,
+        )
+        prep_stats = preparer.stats
+        log_prep_stats(prep_path, prep_stats)
         jobCtxt.report.step_finished(
-            "download", {"message": f"Downloaded artifact to '{input_path.name}'"}
+            "download",
+            {
+                "message": f"Downloaded and prepared artifact as '{prep_path.name}'",
+                "atom_records": prep_stats.atom_records,
+                "renamed_residues": prep_stats.renamed,
+                "bytes_read": download_stats.bytes_read,
+                "bytes_skipped": download_stats.bytes_skipped,
+                "compression": download_stats.compression,
+                "structure_format": download_stats.structure_format,
+                "download_cache_hit": download_stats.cache_hit,
+                "download_ranges": download_stats.ranges,
+                "workspace": workspace.location,
+                "warm_workspace": workspace.pooled,
+                **download_retries.as_dict(),
+            },
         )
 
-        # Step 3: Run FoldX repair
+        # Step 3: Check for a repair of byte-identical prepared content
+        cache_key = repair_cache_key(
+            preparer.content_sha256,
+            foldx_binary,
+            {
+                "residue_renames": renames.renames,
+                "compress_output": req.compress_output,
+                "repair_mode": req.repair_mode,
+                "parent_artifact": req.parent_artifact,
+                "max_passes": req.max_passes,
+                "energy_tolerance": req.energy_tolerance,
+                # A hit returns the stored artifact as is, so only callers
+                # asking for the same policy and name may share it.
+                "policy": req.policy,
+                "output_name": req.output_name,
+            },
+        )
         jobCtxt.report.step_started(
-            "repair", {"message": f"Running FoldX repair for '{input_path.name}'"}
+            "content-cache", {"message": f"Checking cache for '{cache_key}'"}
         )
-        repaired_path = repair_pdb_with_foldx(input_path, foldx_binary)
+        cached = lookup_cached_repair(ivcap, cache_key)
+        if cached:
+            logger.info("Using cached repair '%s'", cached["repaired_pdb_urn"])
+            jobCtxt.report.step_finished(
+                "content-cache",
+                {"message": f"Using cached repair '{cached['repaired_pdb_urn']}'"},
+            )
+            return Result(
+                id=input_urn,
+                repaired_pdb_urn=cached["repaired_pdb_urn"],
+                policy=cached.get("$policy"),
+            )
+        jobCtxt.report.step_finished(
+            "content-cache", {"message": f"No cached repair found for '{cache_key}'"}
+        )
+
+        # Step 4: Pre-flight scan of the prepared structure
+        jobCtxt.report.step_started(
+            "preflight", {"message": f"Scanning '{prep_path.name}'"}
+        )
+        try:
+            preflight = check_pdb_file(prep_path)
+        except PreflightError as exc:
+            jobCtxt.report.step_finished(
+                "preflight", {"message": str(exc), **exc.report.as_dict()}
+            )
+            raise
         jobCtxt.report.step_finished(
-            "repair", {"message": f"Repaired file '{repaired_path.name}' created"}
+            "preflight",
+            {
+                "message": (
+                    f"{preflight.residues} residues, "
+                    f"{preflight.incomplete_backbone} with incomplete backbone"
+                ),
+                **preflight.as_dict(),
+            },
         )
 
-        # Step 4: Upload repaired artifact
+        # Step 5: Optionally restrict the repair to clashing or changed regions
+        repair_region = None
+        if req.repair_mode == "selective" or req.parent_artifact:
+            structure = load_structure_atoms(prep_path)
+        if req.repair_mode == "selective":
+            jobCtxt.report.step_started(
+                "clash-scan", {"message": f"Scanning '{prep_path.name}' for clashes"}
+            )
+            clashes, repair_region = scan_clashes(structure)
+            jobCtxt.report.step_finished(
+                "clash-scan",
+                {
+                    "message": (
+                        f"{clashes.clashing_residues} clashing residues, repairing "
+                        f"{clashes.repaired_residues} and skipping "
+                        f"{clashes.skipped_residues}"
+                    ),
+                    **clashes.as_dict(),
+                },
+            )
+        if req.parent_artifact:
+            jobCtxt.report.step_started(
+                "parent-diff",
+                {"message": f"Comparing '{prep_path.name}' with '{req.parent_artifact}'"},
+            )
+            parent_path = work_dir / PARENT_PREP_NAME
+            download_and_prepare_artifact(
+                ivcap.get_artifact(req.parent_artifact),
+                parent_path,
+                StreamingPreparer(renames),
+                retries=download_retries,
+            )
+            diff, changed_region = diff_structures(
+                structure, load_structure_atoms(parent_path)
+            )
+            if repair_region is None:
+                repair_region = changed_region
+            else:
+                repair_region |= changed_region
+            jobCtxt.report.step_finished(
+                "parent-diff",
+                {
+                    "message": (
+                        f"{diff.changed_residues} changed residues, repairing "
+                        f"{diff.repaired_residues} and skipping {diff.skipped_residues}"
+                    ),
+                    **diff.as_dict(),
+                    "retries": download_retries.used,
+                },
+            )
+        fixed_residues = None
+        if repair_region is not None:
+            fixed_path = work_dir / FIXED_RESIDUES_NAME
+            if write_fixed_residues(structure, repair_region, fixed_path):
+                fixed_residues = fixed_path.name
+
+        # Step 6: Run FoldX repair, re-running it on its own output until the
+        # energy stops improving
+        jobCtxt.report.step_started(
+            "repair", {"message": f"Running FoldX repair for '{prep_path.name}'"}
+        )
+        repaired_path, foldx_run, passes, converged = run_repair_passes(
+            req,
+            prep_path,
+            workspace.foldx_binary or foldx_binary,
+            preflight.residues,
+            jobCtxt.report,
+            fixed_residues=fixed_residues,
+        )
+        jobCtxt.report.step_finished(
+            "repair",
+            {
+                "message": (
+                    f"Repaired file '{repaired_path.name}' created after "
+                    f"{len(passes)} pass{'es' if len(passes) > 1 else ''}"
+                ),
+                "passes": [repair_pass.model_dump() for repair_pass in passes],
+                "converged": converged,
+                **foldx_run.as_dict(),
+            },
+        )
+
+        # Step 7: Upload repaired artifact
         jobCtxt.report.step_started(
             "upload",
             {"message": f"Uploading repaired artifact '{repaired_path.name}'"},
         )
         output_name = req.output_name or repaired_path.name
+        upload_path = repaired_path
+        content_type = "chemical/x-pdb"
+        if req.compress_output:
+            upload_path = compress_file(repaired_path, req.compress_output)
+            content_type = CONTENT_TYPES[req.compress_output]
+            suffix = SUFFIXES[req.compress_output]
+            if not output_name.endswith(suffix):
+                output_name += suffix
         uploaded = ivcap.upload_artifact(
             name=output_name,
-            file_path=str(repaired_path),
-            content_type="chemical/x-pdb",
+            file_path=str(upload_path),
+            content_type=content_type,
             policy=req.policy,
         )
         stored_policy = req.policy or getattr(uploaded, "policy", None)
+        record_cached_repair(ivcap, cache_key, uploaded.urn, stored_policy)
         jobCtxt.report.step_finished(
             "upload",
             {"message": f"Repaired artifact stored as '{uploaded.urn}'"},
         )
 
-    # Step 5: Return result referencing repaired artifact URN
+    # Step 8: Return result referencing repaired artifact URN
     result = Result(
         id=input_urn,
         repaired_pdb_urn=uploaded.urn,
         policy=stored_policy,
+        passes=passes,
+        converged=converged,
     )
     return result
 
 
+# ====================================
+# Service metrics
+# ====================================
+
+@get_fast_app().get("/_metrics", tags=["System"])
+def service_metrics():
+    return {
+        "foldx_executor": foldx_executor.metrics(),
+        "foldx_batching": foldx_scheduler.metrics(),
+        "workspaces": workspaces.metrics(),
+        "download_cache": download_cache.metrics() if download_cache else None,
+        "range_downloads": range_downloader.metrics(),
+        "http_pool": transfer_pool.metrics(),
+    }
+
+
+# ====================================
+# Shutdown
+# ====================================
+
+get_fast_app().router.add_event_handler("shutdown", foldx_shutdown.set)
+
+
 if __name__ == "__main__":
     start_tool_server(service)
@@ -0,0 +1,344 @@
+"""
+Per-job FoldX workspaces.
+
+By default each job works in a temporary directory on the disk backing /tmp.
+With ``FOLDX_WORKSPACE=tmpfs`` the directory is created on ``/dev/shm`` (or
+``FOLDX_TMPFS_DIR``) instead, so FoldX's repaired PDB, fxout and scratch files
+never touch network-attached storage. tmpfs pages are charged to the
+container's memory cgroup, so every tmpfs workspace reserves its estimated
+footprint against the memory left over after the FoldX slots, and jobs fall
+back to disk when the reservation does not fit.
+
+With ``FOLDX_WORKSPACE_POOL=N`` up to N workspaces are pre-staged with
+symlinks to the FoldX binary and its support files. Jobs check them out and
+the manager resets them for the next job once they are returned.
+
+Resetting and deleting returned workspaces is left to a ``WorkspaceReaper``
+thread so it never adds to the latency of a response. Its backlog is bounded
+and it stops deferring work while the workspace filesystem runs low on space;
+in both cases the job cleans up its own workspace before returning.
+"""
+
+import atexit
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from ivcap_service import getLogger
+
+from foldx_executor import read_memory_limit
+
+logger = getLogger("app")
+
+DISK = "disk"
+TMPFS = "tmpfs"
+
+DEFAULT_TMPFS_DIR = Path("/dev/shm")
+# Workspace footprint per input byte: the prepped PDB, the repaired PDB, the
+# fxout and the ``-d true`` debug output, with headroom for compressed inputs.
+DEFAULT_FOOTPRINT_FACTOR = 6.0
+# Footprint assumed when the artifact size is unknown.
+DEFAULT_FOOTPRINT = 64 * 1024 * 1024
+WORKSPACE_PREFIX = "foldx-"
+# Files FoldX looks for in its working directory, staged when found next to
+# the binary.
+SUPPORT_FILES = ("rotabase.txt",)
+DEFAULT_REAPER_BACKLOG = 32
+# Below this fraction of free space, workspaces are cleaned up inline.
+DEFAULT_MIN_FREE_FRACTION = 0.1
+
+
+@dataclass
+class Workspace:
+    path: Path
+    location: str
+    reserved: int = 0
+    foldx_binary: Optional[Path] = None
+    pooled: bool = False
+    staged: Tuple[str, ...] = field(default_factory=tuple)
+
+
+class WorkspaceReaper:
+    """
+    Runs ``cleanup`` on returned workspaces from a background thread. At most
+    ``max_backlog`` workspaces wait for cleanup. Once the backlog is full, or
+    the filesystem holding a workspace has less than ``min_free_fraction``
+    free, ``submit`` cleans up inline instead, so deferred deletions cannot
+    fill the node.
+    """
+
+    def __init__(
+        self,
+        cleanup: Callable[["Workspace"], None],
+        max_backlog: int = DEFAULT_REAPER_BACKLOG,
+        min_free_fraction: float = DEFAULT_MIN_FREE_FRACTION,
+    ):
+        self.cleanup = cleanup
+        self.max_backlog = max_backlog
+        self.min_free_fraction = min_free_fraction
+        self._queue: "queue.Queue[Tuple[Workspace, float]]" = queue.Queue(max_backlog)
+        self._lock = threading.Lock()
+        self._reaped = 0
+        self._inline = 0
+        self._max_backlog_seen = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._total_cleanup = 0.0
+        threading.Thread(target=self._run, name="workspace-reaper", daemon=True).start()
+
+    def _low_on_space(self, path: Path) -> bool:
+        try:
+            usage = shutil.disk_usage(path)
+        except OSError:
+            return False
+        return usage.free < usage.total * self.min_free_fraction
+
+    def submit(self, workspace: "Workspace") -> None:
+        submitted = time.monotonic()
+        if not self._low_on_space(workspace.path):
+            try:
+                self._queue.put_nowait((workspace, submitted))
+            except queue.Full:
+                pass
+            else:
+                with self._lock:
+                    self._max_backlog_seen = max(self._max_backlog_seen, self._queue.qsize())
+                return
+        with self._lock:
+            self._inline += 1
+        self._reap(workspace, submitted)
+
+    def _reap(self, workspace: "Workspace", submitted: float) -> None:
+        start = time.monotonic()
+        try:
+            self.cleanup(workspace)
+        except OSError as exc:
+            logger.warning("Failed to clean up workspace '%s': %s", workspace.path, exc)
+        finished = time.monotonic()
+        with self._lock:
+            self._reaped += 1
+            self._total_cleanup += finished - start
+            self._total_latency += finished - submitted
+            self._max_latency = max(self._max_latency, finished - submitted)
+
+    def _run(self) -> None:
+        while True:
+            workspace, submitted = self._queue.get()
+            try:
+                self._reap(workspace, submitted)
+            finally:
+                self._queue.task_done()
+
+    def drain(self) -> None:
+        """Blocks until every queued workspace has been cleaned up."""
+        self._queue.join()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "backlog": self._queue.qsize(),
+                "max_backlog": self.max_backlog,
+                "peak_backlog": self._max_backlog_seen,
+                "reaped": self._reaped,
+                "inline_cleanups": self._inline,
+                "mean_latency_seconds": self._total_latency / self._reaped
+                if self._reaped
+                else 0.0,
+                "max_latency_seconds": self._max_latency,
+                "mean_cleanup_seconds": self._total_cleanup / self._reaped
+                if self._reaped
+                else 0.0,
+            }
+
+
+class WorkspaceManager:
+    """
+    Hands out per-job workspace directories, placing them on tmpfs while the
+    estimated footprint fits ``memory_budget`` and on disk otherwise.
+    """
+
+    def __init__(
+        self,
+        mode: str = DISK,
+        tmpfs_dir: Path = DEFAULT_TMPFS_DIR,
+        memory_budget: Optional[int] = None,
+        footprint_factor: float = DEFAULT_FOOTPRINT_FACTOR,
+        foldx_binary: Optional[Path] = None,
+        pool_size: int = 0,
+        reaper_backlog: int = DEFAULT_REAPER_BACKLOG,
+        min_free_fraction: float = DEFAULT_MIN_FREE_FRACTION,
+    ):
+        if mode not in (DISK, TMPFS):
+            raise ValueError(f"Unknown workspace mode '{mode}'")
+        if mode == TMPFS and not tmpfs_dir.is_dir():
+            logger.warning("tmpfs directory '%s' is missing, using disk workspaces", tmpfs_dir)
+            mode = DISK
+        self.mode = mode
+        self.tmpfs_dir = tmpfs_dir
+        self.memory_budget = memory_budget
+        self.footprint_factor = footprint_factor
+        self.foldx_binary = foldx_binary
+        self.pool_size = pool_size if foldx_binary else 0
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self._tmpfs_jobs = 0
+        self._disk_jobs = 0
+        self._fallbacks = 0
+        self._idle: Deque[Workspace] = deque()
+        self._pool_hits = 0
+        self._pool_misses = 0
+        self.reaper = WorkspaceReaper(self._recycle, reaper_backlog, min_free_fraction)
+        for _ in range(self.pool_size):
+            self._idle.append(self._create_staged())
+        atexit.register(self.close)
+
+    @classmethod
+    def from_environment(
+        cls, foldx_binary: Optional[Path] = None, foldx_memory: int = 0
+    ) -> "WorkspaceManager":
+        """``foldx_memory`` is the memory held back for the FoldX processes."""
+        memory_limit = read_memory_limit()
+        budget = max(memory_limit - foldx_memory, 0) if memory_limit else None
+        return cls(
+            mode=os.getenv("FOLDX_WORKSPACE", DISK).lower(),
+            tmpfs_dir=Path(os.getenv("FOLDX_TMPFS_DIR", DEFAULT_TMPFS_DIR)),
+            memory_budget=budget,
+            footprint_factor=float(
+                os.getenv("FOLDX_TMPFS_FOOTPRINT_FACTOR", DEFAULT_FOOTPRINT_FACTOR)
+            ),
+            foldx_binary=foldx_binary if foldx_binary and foldx_binary.exists() else None,
+            pool_size=int(os.getenv("FOLDX_WORKSPACE_POOL", 0)),
+            reaper_backlog=int(os.getenv("FOLDX_REAPER_BACKLOG", DEFAULT_REAPER_BACKLOG)),
+            min_free_fraction=float(
+                os.getenv("FOLDX_REAPER_MIN_FREE", DEFAULT_MIN_FREE_FRACTION)
+            ),
+        )
+
+    def estimate_footprint(self, input_size: Optional[int]) -> int:
+        if not input_size:
+            return DEFAULT_FOOTPRINT
+        return int(input_size * self.footprint_factor)
+
+    def _reserve_tmpfs(self, footprint: int) -> bool:
+        with self._lock:
+            available = shutil.disk_usage(self.tmpfs_dir).free
+            if self.memory_budget is not None:
+                available = min(available, self.memory_budget - self._reserved)
+            if footprint > available:
+                self._fallbacks += 1
+                return False
+            self._reserved += footprint
+            self._tmpfs_jobs += 1
+            return True
+
+    def _base_dir(self, location: str) -> Optional[Path]:
+        return self.tmpfs_dir if location == TMPFS else None
+
+    def _create_staged(self) -> Workspace:
+        path = Path(
+            tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=self._base_dir(self.mode))
+        )
+        staged = []
+        for source in (self.foldx_binary,) + tuple(
+            self.foldx_binary.with_name(name) for name in SUPPORT_FILES
+        ):
+            if source.exists():
+                (path / source.name).symlink_to(source)
+                staged.append(source.name)
+        return Workspace(
+            path,
+            self.mode,
+            foldx_binary=path / self.foldx_binary.name,
+            pooled=True,
+            staged=tuple(staged),
+        )
+
+    def _checkout(self, location: str) -> Workspace:
+        if self.pool_size and location == self.mode:
+            # When every staged workspace is busy or still being reset the job
+            # gets a plain one-off workspace.
+            with self._lock:
+                if self._idle:
+                    self._pool_hits += 1
+                    return self._idle.popleft()
+                self._pool_misses += 1
+        path = Path(tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=self._base_dir(location)))
+        return Workspace(path, location, foldx_binary=self.foldx_binary)
+
+    def _reset(self, workspace: Workspace) -> None:
+        for entry in workspace.path.iterdir():
+            if entry.name in workspace.staged:
+                continue
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+
+    def _recycle(self, workspace: Workspace) -> None:
+        try:
+            if workspace.pooled:
+                self._reset(workspace)
+            else:
+                shutil.rmtree(workspace.path, ignore_errors=True)
+        finally:
+            with self._lock:
+                self._reserved -= workspace.reserved
+                workspace.reserved = 0
+                if workspace.pooled:
+                    self._idle.append(workspace)
+
+    @contextmanager
+    def workspace(self, input_size: Optional[int] = None) -> Iterator[Workspace]:
+        """
+        Checks out a job workspace. It is handed to the reaper to be reset or
+        removed after the block exits.
+        """
+        footprint = self.estimate_footprint(input_size)
+        if self.mode == TMPFS and self._reserve_tmpfs(footprint):
+            workspace = self._checkout(TMPFS)
+            workspace.reserved = footprint
+        else:
+            if self.mode == TMPFS:
+                logger.info(
+                    "Workspace footprint of %d bytes does not fit in tmpfs, using disk",
+                    footprint,
+                )
+            with self._lock:
+                self._disk_jobs += 1
+            workspace = self._checkout(DISK)
+        try:
+            yield workspace
+        finally:
+            self.reaper.submit(workspace)
+
+    def close(self) -> None:
+        """Waits for pending cleanups and removes the idle pooled workspaces."""
+        self.reaper.drain()
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for workspace in idle:
+            shutil.rmtree(workspace.path, ignore_errors=True)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "tmpfs_reserved_bytes": self._reserved,
+                "tmpfs_budget_bytes": self.memory_budget,
+                "tmpfs_workspaces": self._tmpfs_jobs,
+                "disk_workspaces": self._disk_jobs,
+                "tmpfs_fallbacks": self._fallbacks,
+                "pool_size": self.pool_size,
+                "pool_idle": len(self._idle),
+                "pool_hits": self._pool_hits,
+                "pool_misses": self._pool_misses,
+                "reaper": self.reaper.metrics(),
+            }